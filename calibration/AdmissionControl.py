@@ -0,0 +1,188 @@
+#
+
+""" Core and memory aware admission control of the external processes (marlin, ddsim).
+    A process is started only if a core is free and its expected peak memory fits in the
+    memory budget, otherwise it waits in the queue. The expected peak memory of a workload
+    is learned from the max RSS of its completed runs (see ProcessTools.ChildWatcher).
+    The budgets default to the batch slot (NSLOTS) or to the node resources. The batch
+    memory limit (i.e h_vmem) is a virtual memory limit, checked against the learned RSS
+    scaled by virtualMemoryFactor, as the virtual size of the marlin/ddsim processes is
+    well above their RSS. An optional per-child memory limit is enforced with setrlimit.
+"""
+
+import os
+import logging
+import resource
+import threading
+import multiprocessing
+
+
+""" Get the available memory of the node (bytes) from /proc/meminfo, None if unknown
+"""
+def getAvailableMemory():
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = dict([(line.split(":")[0], line.split(":")[1].split()) for line in f if ":" in line])
+    except IOError:
+        return None
+
+    for key in ("MemAvailable", "MemFree"):
+        if key in meminfo:
+            return int(meminfo[key][0])*1024
+    return None
+
+
+""" Get the number of cores of the job (batch slots if set, cores of the node otherwise)
+"""
+def getAvailableCores():
+    nSlots = os.environ.get("NSLOTS")
+    if nSlots and nSlots.isdigit():
+        return int(nSlots)
+    return multiprocessing.cpu_count()
+
+
+""" Admission class.
+    Resources reserved for a process, to release when the process ends
+"""
+class Admission(object):
+    def __init__(self, workload, memory, virtualMemory):
+        self.workload = workload
+        self.memory = memory
+        self.virtualMemory = virtualMemory
+
+
+""" AdmissionController class.
+    Use AdmissionController.instance() to get the controller shared by all launchers
+"""
+class AdmissionController(object):
+    # the expected peak memory of a workload never run (bytes)
+    defaultPeakMemory = 2*1024**3
+    # the fraction of the memory budget used by the processes
+    memoryFraction = 0.9
+    # the virtual size / RSS ratio assumed for the virtual memory budget
+    virtualMemoryFactor = 2.
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    """ Get the shared controller (created with default budgets if not configured)
+    """
+    @classmethod
+    def instance(cls):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    """ Configure the shared controller. None values use the default budgets
+    """
+    @classmethod
+    def configure(cls, maxNCores=None, maxMemory=None, maxChildMemory=None):
+        with cls._instanceLock:
+            cls._instance = cls(maxNCores, maxMemory, maxChildMemory)
+            return cls._instance
+
+    def __init__(self, maxNCores=None, maxMemory=None, maxChildMemory=None):
+        self._logger = logging.getLogger("admissionControl")
+        self._condition = threading.Condition()
+        self._maxNCores = int(maxNCores) if maxNCores else getAvailableCores()
+        self._maxMemory = int(maxMemory) if maxMemory else self._defaultMaxMemory()
+        self._maxVirtualMemory = self._defaultMaxVirtualMemory()
+        self._maxChildMemory = int(maxChildMemory) if maxChildMemory else None
+        self._usedCores = 0
+        self._usedMemory = 0
+        self._usedVirtualMemory = 0
+        self._peakMemory = {}
+
+        self._logger.info("Admission control: {0} cores, {1} memory, {2} virtual memory".format(self._maxNCores,
+            "{0:.1f} GB".format(self._maxMemory / 1024.**3) if self._maxMemory else "unlimited",
+            "{0:.1f} GB".format(self._maxVirtualMemory / 1024.**3) if self._maxVirtualMemory else "unlimited"))
+
+    def _defaultMaxMemory(self):
+        memory = getAvailableMemory()
+        return int(memory*self.memoryFraction) if memory else None
+
+    def _defaultMaxVirtualMemory(self):
+        # the batch system memory limit (i.e h_vmem) is set as virtual memory limit
+        softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_AS)
+        if softLimit == resource.RLIM_INFINITY:
+            return None
+        return int(softLimit*self.memoryFraction)
+
+    """ The expected peak memory of a workload (bytes)
+    """
+    def expectedMemory(self, workload):
+        with self._condition:
+            return self._peakMemory.get(workload, self.defaultPeakMemory)
+
+    def _canAdmit(self, memory):
+        # always admit a process when nothing runs, even if it doesn't fit
+        if self._usedCores == 0:
+            return True
+        if self._usedCores + 1 > self._maxNCores:
+            return False
+        if self._maxVirtualMemory is not None and self._usedVirtualMemory + memory*self.virtualMemoryFactor > self._maxVirtualMemory:
+            return False
+        return self._maxMemory is None or self._usedMemory + memory <= self._maxMemory
+
+    def _reserve(self, workload, memory):
+        virtualMemory = int(memory*self.virtualMemoryFactor)
+        self._usedCores = self._usedCores + 1
+        self._usedMemory = self._usedMemory + memory
+        self._usedVirtualMemory = self._usedVirtualMemory + virtualMemory
+        return Admission(workload, memory, virtualMemory)
+
+    """ Reserve the resources for a process if available, None otherwise
+    """
+    def tryAcquire(self, workload):
+        with self._condition:
+            memory = self._peakMemory.get(workload, self.defaultPeakMemory)
+            if not self._canAdmit(memory):
+                return None
+            return self._reserve(workload, memory)
+
+    """ Reserve the resources for a process, wait until they are available
+    """
+    def acquire(self, workload):
+        with self._condition:
+            memory = self._peakMemory.get(workload, self.defaultPeakMemory)
+            if not self._canAdmit(memory):
+                self._logger.info("Process '{0}' queued, waiting for resources".format(workload))
+            while not self._canAdmit(memory):
+                self._condition.wait(1.)
+            return self._reserve(workload, memory)
+
+    """ Release the resources of an ended process. The max RSS of the
+        process (rusage, optional) updates the expected peak memory of its workload
+    """
+    def release(self, admission, rusage=None):
+        with self._condition:
+            self._usedCores = self._usedCores - 1
+            self._usedMemory = self._usedMemory - admission.memory
+            self._usedVirtualMemory = self._usedVirtualMemory - admission.virtualMemory
+
+            if rusage is not None and rusage.ru_maxrss > 0:
+                # ru_maxrss is in kilobytes on linux
+                peakMemory = rusage.ru_maxrss*1024
+                if admission.workload not in self._peakMemory:
+                    self._peakMemory[admission.workload] = peakMemory
+                else:
+                    self._peakMemory[admission.workload] = max(self._peakMemory[admission.workload], peakMemory)
+
+            self._condition.notify_all()
+
+    """ The function to pass as preexec_fn to Popen, applying the per-child memory limit (None if no limit)
+    """
+    def preexecFunction(self):
+        if self._maxChildMemory is None:
+            return None
+        maxChildMemory = self._maxChildMemory
+        def setMemoryLimit():
+            softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_AS)
+            limit = maxChildMemory if hardLimit == resource.RLIM_INFINITY else min(maxChildMemory, hardLimit)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, hardLimit))
+        return setMemoryLimit
+
+
+
+#
@@ -0,0 +1,153 @@
+#
+
+""" Append-only journal of the calibration results (JSON lines).
+    Each step start, iteration and step output is appended to the journal as one
+    json record on one line. An append is a single write on a file opened in append
+    mode, under an exclusive file lock, so the concurrent steps (threads or processes)
+    can share the journal and a reader never sees a partial record.
+    Record types :
+     - start : {"type" : "start", "step" : name}. The records of the step before are obsolete
+     - iteration : {"type" : "iteration", "step" : name, "iteration" : id, "parameters" : {...}, "processes" : [...]}
+     - output : {"type" : "output", "step" : name, "parameters" : [[processor, name, value], ...], "resources" : {...}}
+    The journal is converted to the calibration xml format with exportXml.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from calibration.XmlTools import etree, createXMLParser
+
+
+class CalibrationJournal(object):
+    def __init__(self, fileName):
+        self._fileName = os.path.abspath(fileName)
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger("calibrationJournal")
+
+    def fileName(self):
+        return self._fileName
+
+    """ Append a record to the journal (the record time is added)
+    """
+    def append(self, record):
+        record = dict(record)
+        record["time"] = time.time()
+        line = json.dumps(record, sort_keys=True, default=str) + "\n"
+
+        with self._lock:
+            fd = os.open(self._fileName, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def appendStart(self, stepName):
+        self.append({"type" : "start", "step" : stepName})
+
+    def appendIteration(self, stepName, iterId, parameters, processes):
+        self.append({"type" : "iteration", "step" : stepName, "iteration" : iterId, "parameters" : parameters, "processes" : processes})
+
+    def appendOutput(self, stepName, parameters, resources):
+        self.append({"type" : "output", "step" : stepName, "parameters" : parameters, "resources" : resources})
+
+    """ Read the journal records. A truncated last line (killed writer) is ignored
+    """
+    def records(self):
+        if not os.path.isfile(self._fileName):
+            return []
+
+        records = []
+        with open(self._fileName) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    self._logger.warning("Skipping corrupted journal record in {0}".format(self._fileName))
+        return records
+
+    """ Get the current records of each step : the records after the last start record.
+        Returns a list of (stepName, records), in the order the steps were started
+    """
+    def stepRecords(self):
+        steps = []
+        stepRecords = {}
+
+        for record in self.records():
+            stepName = record["step"]
+            if record["type"] == "start" or stepName not in stepRecords:
+                if stepName in stepRecords:
+                    steps.remove(stepName)
+                steps.append(stepName)
+                stepRecords[stepName] = []
+            if record["type"] != "start":
+                stepRecords[stepName].append(record)
+
+        return [(stepName, stepRecords[stepName]) for stepName in steps]
+
+    def _createUsageElement(self, tag, usage):
+        element = etree.Element(tag)
+        for key, value in sorted(usage.items()):
+            element.set(key, "{0:.3f}".format(value) if isinstance(value, float) else str(value))
+        return element
+
+    """ Create the step element of the calibration xml format from the step records
+    """
+    def _createStepElement(self, stepName, records):
+        step = etree.Element("step", name=stepName)
+        iterations = None
+
+        for record in records:
+            if record["type"] == "iteration":
+                if iterations is None:
+                    iterations = etree.Element("iterations")
+                    step.append(iterations)
+                iteration = etree.Element("iteration", id=str(record["iteration"]))
+                iterations.append(iteration)
+                for key, value in record["parameters"].items():
+                    parameter = etree.Element(key)
+                    parameter.text = str(value)
+                    iteration.append(parameter)
+                processes = etree.Element("processes")
+                iteration.append(processes)
+                for usage in record["processes"]:
+                    processes.append(self._createUsageElement("process", usage))
+
+            elif record["type"] == "output":
+                output = step.find("output")
+                if output is None:
+                    output = etree.Element("output")
+                    step.append(output)
+                for processor, name, value in record["parameters"]:
+                    parameter = etree.Element("parameter", processor=processor, name=name)
+                    parameter.text = value
+                    output.append(parameter)
+                for element in step.findall("resources"):
+                    step.remove(element)
+                if record["resources"]:
+                    step.append(self._createUsageElement("resources", record["resources"]))
+
+        return step
+
+    """ Export the journal in the calibration xml format. The input element is taken
+        from the input calibration file, the steps of the journal replace the ones of the input file
+    """
+    def exportXml(self, inputCalibrationFile, outputCalibrationFile):
+        xmlTree = etree.parse(inputCalibrationFile, createXMLParser())
+        root = xmlTree.getroot()
+
+        for stepName, records in self.stepRecords():
+            for element in root.findall("step"):
+                if element.get("name") == stepName:
+                    root.remove(element)
+            root.append(self._createStepElement(stepName, records))
+
+        with open(outputCalibrationFile, "w") as f:
+            f.write(etree.tostring(xmlTree, xml_declaration=True, pretty_print=True))
+
+
+
+#
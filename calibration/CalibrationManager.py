@@ -1,14 +1,17 @@
 """
 """
 
-from calibration.Marlin import Marlin
-from calibration.PandoraAnalysis import *
-from calibration.FileTools import *
-from calibration.GeometryInterface import GeometryInterface
+from calibration.RescaleStrategy import rescaleStrategies
+from calibration.Checkpoint import Checkpoint
+from calibration.CalibrationStore import CalibrationStore
+from calibration.CalibrationJournal import CalibrationJournal
+from calibration.Trace import Tracer
+from calibration.Workspace import Workspace
 import os, sys
 from calibration.XmlTools import *
 import argparse
 import logging
+import threading
 
 
 class CalibrationManager(object) :
@@ -16,24 +19,31 @@ class CalibrationManager(object) :
         self._xmlFile = None
         self._outputXmlFile = None
         self._xmlTree = None
+        self._store = None
         self._steps = []
         self._startStep = 0
         self._endStep = sys.maxint
         self._badRun = False
         self._runException = None
+        self._checkpoint = None
+        self._resumeFromXml = False
+        self._parallelSteps = False
+        self._maxNCores = 1
+        self._completedSteps = set()
+        self._compactFile = None
+        self._journal = None
+        self._geometryLock = threading.Lock()
         
         # Preconfigure logging before any other thing...
         # Use a specific argparser for that
         loggingLevelsMap = {"DEBUG" : logging.DEBUG, "INFO" : logging.INFO, "WARNING" : logging.WARNING, "ERROR" : logging.ERROR, "CRITICAL" : logging.CRITICAL} 
-        loggingLevels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
         
+        # The default arguments are parsed once here (logging, step range, --showSteps)
         parser = argparse.ArgumentParser("Calibration runner:", formatter_class=argparse.RawTextHelpFormatter, add_help=False)
-        parser.add_argument("--logLevel", action="store", type=type("DEBUG"), default="INFO", choices=loggingLevels,
-                                help="The logging level (default INFO)", required = False)
-        parser.add_argument("--logFile", action="store", default="",
-                                help="The log file (default : no log file)", required = False)
+        self._getDefaultArgs(parser, useRequired=False)
 
         parsed, extra = parser.parse_known_args()
+        self._defaultArgs = parsed
 
         logformat = "%(asctime)s [%(levelname)s] - %(name)s : %(message)s"
 
@@ -58,6 +68,8 @@ class CalibrationManager(object) :
                                 help="The log file (default : no log file)", required = False)
         parser.add_argument("--showSteps", action="store_true", default=False,
                                 help="Show the registered steps in calibration manager and exit", required = False)
+        parser.add_argument("--dryRun", action="store_true", default=False,
+                                help="Check the command line, show the steps to run and exit (no geometry, no xml file loaded)", required = False)
         parser.add_argument("--inputCalibrationFile", action="store",
                                 help="The XML input calibration file", required = useRequired)
         parser.add_argument("--outputCalibrationFile", action="store",
@@ -66,6 +78,18 @@ class CalibrationManager(object) :
                                 help="The step id to start from", required = False)
         parser.add_argument("--endStep", action="store", type=int, default=sys.maxint,
                                 help="The step id to stop at", required = False)
+        parser.add_argument("--checkpointDir", action="store", default=None,
+                                help="The directory where the calibration state is saved after each step and iteration (default no checkpoint)", required = False)
+        parser.add_argument("--resume", action="store_true", default=False,
+                                help="Resume the calibration from the last checkpoint (requires --checkpointDir)", required = False)
+        parser.add_argument("--parallelSteps", action="store_true", default=False,
+                                help="Run the steps that don't depend on each other (see setLoadStepOutputs) concurrently", required = False)
+        parser.add_argument("--maxNCores", action="store", type=int, default=None,
+                                help="The maximum number of cores used by concurrent steps and processes (default batch slots (NSLOTS) or number of cores of the machine)", required = False)
+        parser.add_argument("--journal", action="store_true", default=False,
+                                help="Append the step iterations and outputs to a json lines journal (<output>_journal.jsonl) instead of rewriting the progress xml file after each iteration", required = False)
+        parser.add_argument("--traceFile", action="store", default=None,
+                                help="Write a timeline of the run (steps, iterations, processes) in this file, in the chrome trace format (chrome://tracing, perfetto)", required = False)
         parser.add_argument("--maxRecordNumber", action="store", default=0,
                                 help="The maximum number of events to process", required = False)
         parser.add_argument("--skipNEvents", action="store", default=0,
@@ -73,6 +97,11 @@ class CalibrationManager(object) :
 
     
     def _getAdditionalArgs(self, parser, requiredArgs):
+        # not needed by --showSteps
+        from calibration.GearCache import GearCache
+        from calibration.Executors import executors
+        from calibration.GeometryInterface import GeometryInterface
+
         parser.add_argument("--compactFile", action="store",
                                 help="The compact XML file", required = ("compactFile" in requiredArgs))
         parser.add_argument("--steeringFile", action="store",
@@ -95,19 +124,75 @@ class CalibrationManager(object) :
                                 help="The input kaon0L energy (unit GeV)", required = False)
         parser.add_argument("--muonEnergy", action="store", default=10,
                                 help="The input muon energy (unit GeV)", required = False)
+        parser.add_argument("--maxNShards", action="store", default=1,
+                                help="The maximum number of concurrent Marlin processes (event range shards) per reconstruction (default 1, no sharding)", required = False)
+        parser.add_argument("--minEventsPerShard", action="store", default=500,
+                                help="The minimum number of events processed by a Marlin shard", required = False)
+        parser.add_argument("--nativeAnalysis", action="store_true", default=False,
+                                help="Run the ecal/hcal digitisation analysis in-process (numpy/uproot) instead of the LCPandoraAnalysis binaries. The barrel/endcap calibrations still run the binaries (see --nativeRegionAnalysis)", required = False)
+        parser.add_argument("--nativeRegionAnalysis", action="store_true", default=False,
+                                help="With --nativeAnalysis, run the barrel/endcap digitisation analysis in-process too", required = False)
+        parser.add_argument("--validateNativeAnalysis", action="store_true", default=False,
+                                help="Run the LCPandoraAnalysis binaries and report where the in-process analysis differs from them (all the digitisation calibrations, numpy/uproot). The binary results are used", required = False)
+        parser.add_argument("--surrogateIterations", action="store_true", default=False,
+                                help="Predict the ecal/hcal energy factors of each iteration by reweighting the last reconstruction, as long as the Marlin iterations confirm the predictions (numpy/uproot)", required = False)
+        parser.add_argument("--rescaleStrategy", action="store", default=None, choices=sorted(rescaleStrategies.keys()),
+                                help="The update strategy of the calibration constants in iterative steps (default fixedPoint)", required = False)
+        parser.add_argument("--marlinCacheDir", action="store", default=None,
+                                help="The directory of the marlin output cache. Identical marlin runs are not processed again (default no cache)", required = False)
+        parser.add_argument("--marlinCacheSize", action="store", default=20,
+                                help="The maximum size of the marlin output cache (unit GB). The least recently used outputs are removed first", required = False)
+        parser.add_argument("--memoizeAnalysis", action="store_true", default=False,
+                                help="Store the LCPandoraAnalysis calibrator results in a sqlite database next to the output calibration file and reuse them for identical inputs", required = False)
+        parser.add_argument("--maxNParallelAnalyses", action="store", default=4,
+                                help="The maximum number of LCPandoraAnalysis calibrators running concurrently within an iteration", required = False)
+        parser.add_argument("--analysisOutputDir", action="store", default=None,
+                                help="The directory where the LCPandoraAnalysis calibrators create their temporary output directories (default system temporary directory)", required = False)
+        parser.add_argument("--marlinCmdLineOverrides", action="store_true", default=False,
+                                help="Write the marlin steering file once and pass the modified parameters on the marlin command line (--Processor.Parameter=value)", required = False)
+        parser.add_argument("--steeringDir", action="store", default=None,
+                                help="The directory of the temporary marlin steering files, i.e /dev/shm (default system temporary directory)", required = False)
+        parser.add_argument("--workspace", action="store", default=None,
+                                help="The root directory of the run directories. Each run, step and iteration gets its own directory (default current directory)", required = False)
+        parser.add_argument("--workspaceRetention", action="store", default=Workspace.keepAll, choices=Workspace.retentionPolicies,
+                                help="Which run directories are kept at the end of the run : all, failed runs only or none (default all)", required = False)
+        parser.add_argument("--workspaceMaxRuns", action="store", type=int, default=0,
+                                help="The maximum number of run directories kept in the workspace, the oldest are removed first (default no limit)", required = False)
+        parser.add_argument("--gearCacheDir", action="store", default=None,
+                                help="The directory of the gear files converted from the compact files, shared between runs (default {0})".format(GearCache.defaultCacheDirectory), required = False)
+        parser.add_argument("--geometryBackend", action="store", default=GeometryInterface.gearBackend, choices=GeometryInterface.backends,
+                                help="How the calorimeter geometry is read : converted to gear by convertToGear or read from the compact file directly (default gear)", required = False)
+        parser.add_argument("--maxMemory", action="store", type=float, default=None,
+                                help="The memory budget of the concurrent marlin/ddsim processes (unit GB, default 90%% of the available memory). The batch slot virtual memory limit is enforced in addition", required = False)
+        parser.add_argument("--maxChildMemory", action="store", type=float, default=None,
+                                help="The address space limit of each marlin/ddsim process (unit GB, default no limit)", required = False)
+        parser.add_argument("--executor", action="store", default="local", choices=sorted(executors.keys()),
+                                help="Where the marlin processes run : on this node, as SGE or HTCondor batch jobs, or on the local fake scheduler (default local)", required = False)
+        parser.add_argument("--batchOptions", action="store", default="",
+                                help="Additional batch submission options (qsub options, or condor submit commands separated by ';')", required = False)
+        parser.add_argument("--batchDir", action="store", default=None,
+                                help="The directory of the batch job scripts and logs, on a file system shared with the batch nodes (default <workspace run directory>/batch)", required = False)
                                 
+    """ Get the geometry interface, created on first call (only the steps using the geometry load it)
+    """
     def getGeometry(self) :
-        return self._geometry
+        from calibration.GeometryInterface import GeometryInterface
+        with self._geometryLock :
+            if self._geometry is None :
+                with Tracer.instance().span("loadGeometry", "geometry"):
+                    self._geometry = GeometryInterface(self._compactFile)
+            return self._geometry
     
     def getArgParser(self):
         return self._argparser
         
-    def printSteps(self):
+    def printSteps(self, startStep=0, endStep=sys.maxint):
         stepId = 0
         print "================================"
         print "===== Registered steps ({0}) =====".format(len(self._steps))
         for step in self._steps:
-            print " => {0}) {1} : {2}".format(stepId, step.name(), step.description())
+            if startStep <= stepId <= endStep :
+                print " => {0}) {1} : {2}".format(stepId, step.name(), step.description())
             stepId += 1
         print "================================"
 
@@ -118,22 +203,14 @@ class CalibrationManager(object) :
 
     def readCmdLine(self) :
         
-        # Step 1) : Parse cmd line, see if we just want to show the registered steps ...
-        parser = argparse.ArgumentParser("Calibration runner:", formatter_class=argparse.RawTextHelpFormatter, add_help=False)
-        parser.add_argument("--showSteps", action="store_true", default=False,
-                                help="Show the registered steps and exit", required = False)
-        
-        parsed, extra = parser.parse_known_args()
+        # Step 1) : See if we just want to show the registered steps ...
+        parsed = self._defaultArgs
 
         if parsed.showSteps :
             self.printSteps()
             sys.exit(0)        
 
-        # Step 2) : Second parsing to get the list of steps to run
-        parser = argparse.ArgumentParser("Calibration runner:", formatter_class=argparse.RawTextHelpFormatter, add_help=False)
-        self._getDefaultArgs(parser, useRequired=False)
-        
-        parsed, extra = parser.parse_known_args()
+        # Step 2) : Get the list of steps to run
         self._startStep = int(parsed.startStep)
         self._endStep = min(int(parsed.endStep), len(self._steps)-1)
         
@@ -142,6 +219,18 @@ class CalibrationManager(object) :
 
         if self._startStep > self._endStep :
             raise ValueError("Start step can't be greater than End step")
+
+        if parsed.checkpointDir :
+            self._checkpoint = Checkpoint(parsed.checkpointDir)
+        elif parsed.resume :
+            raise ValueError("Option --resume requires --checkpointDir")
+
+        if parsed.resume :
+            lastCompletedStep = self._checkpoint.lastCompletedStep()
+            if lastCompletedStep is not None and lastCompletedStep >= self._startStep :
+                self._startStep = lastCompletedStep + 1
+                self._resumeFromXml = True
+                self._logger.info("Resuming calibration after step {0}".format(lastCompletedStep))
         
         # Step 3) : Gather the list or required argument by the steps to run
         requiredArgs = set()
@@ -153,34 +242,126 @@ class CalibrationManager(object) :
         # Step 4) : Final command line parsing
         self._getAdditionalArgs(self._argparser, requiredArgs)
         parsed = self._argparser.parse_args()
+
+        if parsed.dryRun :
+            self._logger.info("Dry run, command line checked. Steps to run :")
+            self.printSteps(self._startStep, self._endStep)
+            sys.exit(0)
+
+        # the modules of the marlin and pandora analysis runtime are only needed from here
+        from calibration.GearCache import GearCache
+        from calibration.AdmissionControl import AdmissionController, getAvailableCores
+        from calibration.Executors import setDefaultExecutor, BatchExecutor
+        from calibration.GeometryInterface import GeometryInterface
+        from calibration.Marlin import Marlin
+        from calibration.MarlinXML import MarlinXML
+        from calibration.PandoraXML import PandoraXML
+        from calibration.PandoraAnalysis import PandoraAnalysisBinary
+        from calibration.PfoAnalysisEngine import nativeEngineAvailable
+        from calibration.CalibratorMemo import CalibratorMemo
         
         self._xmlFile = parsed.inputCalibrationFile
+        self._parallelSteps = parsed.parallelSteps
+        self._maxNCores = parsed.maxNCores if parsed.maxNCores else getAvailableCores()
+        if parsed.traceFile:
+            Tracer.instance().enable(parsed.traceFile)
+        Workspace.configure(parsed.workspace, parsed.workspaceRetention, parsed.workspaceMaxRuns)
+        GearCache.configure(parsed.gearCacheDir)
+        GeometryInterface.backend = parsed.geometryBackend
         self._outputXmlFile = parsed.outputCalibrationFile if parsed.outputCalibrationFile else parsed.inputCalibrationFile
-        parser = createXMLParser()
-        self._xmlTree = etree.parse(self._xmlFile, parser)
-        self._geometry = GeometryInterface(parsed.compactFile)
+        self._compactFile = parsed.compactFile
+        if parsed.journal :
+            self._journal = CalibrationJournal(os.path.splitext(self._outputXmlFile)[0] + "_journal.jsonl")
+
+        if (parsed.nativeAnalysis or parsed.validateNativeAnalysis) and not nativeEngineAvailable():
+            raise RuntimeError("Native analysis requested but numpy/uproot are not available")
+        if parsed.nativeRegionAnalysis and not parsed.nativeAnalysis:
+            raise ValueError("Option --nativeRegionAnalysis requires --nativeAnalysis")
+        PandoraAnalysisBinary.useNativeEngine = parsed.nativeAnalysis
+        PandoraAnalysisBinary.nativeRegions = parsed.nativeRegionAnalysis
+        PandoraAnalysisBinary.validateNativeEngine = parsed.validateNativeAnalysis
+        PandoraAnalysisBinary.maxNConcurrentRuns = int(parsed.maxNParallelAnalyses)
+        PandoraAnalysisBinary.outputDirectory = parsed.analysisOutputDir
+        PandoraAnalysisBinary.memo = CalibratorMemo(os.path.splitext(self._outputXmlFile)[0] + "_memo.sqlite") if parsed.memoizeAnalysis else None
+        Marlin.useCommandLineOverrides = parsed.marlinCmdLineOverrides
+        BatchExecutor.directory = parsed.batchDir
+        BatchExecutor.submitOptions = parsed.batchOptions
+        setDefaultExecutor(parsed.executor)
+        # the batch jobs can't read the steering and pandora settings files of the local temporary directory
+        MarlinXML.steeringDirectory = parsed.steeringDir if parsed.steeringDir or parsed.executor == "local" else BatchExecutor.batchDirectory()
+        PandoraXML.settingsDirectory = None if parsed.executor == "local" else BatchExecutor.batchDirectory()
+        AdmissionController.configure(parsed.maxNCores,
+            parsed.maxMemory*1024**3 if parsed.maxMemory else None,
+            parsed.maxChildMemory*1024**3 if parsed.maxChildMemory else None)
             
         # Step 5) : Pass command line result to running steps
         for step in self._steps[self._startStep:self._endStep+1] :
-            step.readCmdLine(parsed)
+            step.setCheckpoint(self._checkpoint, parsed.resume)
+            with Tracer.instance().span("readCmdLine", "step", {"step" : step.name()}):
+                step.readCmdLine(parsed)
 
 
 
+    """ Parse the input calibration file (or the checkpoint one when resuming).
+        The calibration store is written in the progress file while running
+    """
+    def _loadXml(self) :
+        parser = createXMLParser()
+        with Tracer.instance().span("parseXml", "xml"):
+            self._xmlTree = etree.parse(self._checkpoint.xmlFile() if self._resumeFromXml else self._xmlFile, parser)
+        self._store = CalibrationStore(self._xmlTree, self._progressXmlFile(), journal=self._journal)
+        if self._journal is not None :
+            self._logger.info("Calibration progress appended to {0}".format(self._journal.fileName()))
+        else :
+            self._logger.info("Calibration progress written in {0}".format(self._store.fileName()))
+
+    def _progressXmlFile(self) :
+        return os.path.splitext(self._outputXmlFile)[0] + "_progress.xml"
+
     def run(self) :
         self.readCmdLine()
+        self._loadXml()
+        from calibration.StepScheduler import StepScheduler, runStep
         
         try:
-            for step in self._steps[self._startStep:self._endStep+1] :
-                step.init(self._xmlTree)
-                step.run(self._xmlTree)
-                step.writeOutput(self._xmlTree)
+            if self._parallelSteps :
+                scheduler = StepScheduler(self._steps[self._startStep:self._endStep+1], self._maxNCores)
+                scheduler.setCompletionCallback(self._stepCompleted)
+                scheduler.run(self._store)
+            else :
+                for step in self._steps[self._startStep:self._endStep+1] :
+                    runStep(step, self._store)
+                    self._stepCompleted(step)
         except RuntimeError as e:
             self._logger.error("Caught exception while running: {0}".format(str(e)))
             self._badRun = True
             self._runException = e
+
+        from calibration.PandoraAnalysis import PandoraAnalysisBinary
+        if PandoraAnalysisBinary.memo is not None:
+            PandoraAnalysisBinary.memo.logStatistics()
+
+        Workspace.instance().finalize(not self._badRun)
         
         self.writeXml(None)
 
+    """ Bookkeeping of a completed step. The checkpoint records the last step
+        completed with all the previous ones (steps may complete out of order)
+    """
+    def _stepCompleted(self, step) :
+        self._completedSteps.add(step.name())
+
+        if self._checkpoint is None :
+            return
+
+        lastCompletedStep = self._startStep - 1
+        while lastCompletedStep + 1 <= self._endStep and self._steps[lastCompletedStep + 1].name() in self._completedSteps :
+            lastCompletedStep = lastCompletedStep + 1
+
+        with Tracer.instance().span("saveCheckpoint", "xml"):
+            self._checkpoint.saveManagerState(self._store.tostring(), lastCompletedStep)
+        self._checkpoint.clearStepState(step.name())
+
     def writeXml(self, xmlFile=None) :
 
         if xmlFile is None :
@@ -189,9 +370,12 @@ class CalibrationManager(object) :
         if self._badRun :
             xmlFile = "calibration_failed.xml"
 
-        f = file(xmlFile, 'w')
-        f.write(etree.tostring(self._xmlTree, xml_declaration=True, pretty_print=True))
-        f.close()
+        with Tracer.instance().span("writeXml", "xml"):
+            self._store.flush(xmlFile)
+        # the progress file is kept for inspection if the run failed
+        if not self._badRun and os.path.isfile(self._store.fileName()) :
+            os.remove(self._store.fileName())
+        Tracer.instance().write()
 
         if self._runException is not None :
             raise self._runException
@@ -2,19 +2,35 @@
 """
 
 from calibration.XmlTools import etree
+from calibration.RescaleStrategy import createRescaleStrategy
+from calibration.MarlinCache import MarlinCache
+from calibration.ProcessTools import ResourceAccounting, ProcessUsage
+from calibration.Trace import Tracer
+from calibration.Workspace import Workspace
+from calibration.StepMetadata import StepMetadata
 import logging
 import glob
 
 class CalibrationStep(object) :
-    def __init__(self, stepName) :
-        self._name = stepName
+    # step metadata, declared by each step class (see StepMetadata)
+    metadata = StepMetadata(None, "No description available", ())
+
+    def __init__(self, stepName=None) :
+        self._name = stepName if stepName else self.metadata.name
         self._logger = logging.getLogger(self._name)
         self._manager = None
-        self._requiredArgs = set()
+        self._requiredArgs = set(self.metadata.requiredArgs)
         self._stepOutputsToLoad = list()
         self._pfoAnalysisProcessor =  "MyPfoAnalysis"
         self._marlinPandoraProcessor = "MyDDMarlinPandora"
         self._runProcessors = list()
+        self._rescaleStrategy = "fixedPoint"
+        self._checkpoint = None
+        self._resume = False
+        self._iterationRecords = []
+        self._nCores = 1
+        self._resourceAccounting = ResourceAccounting()
+        self._iterationStartTime = 0.
 
     def setManager(self, mgr) :
         self._manager = mgr
@@ -35,10 +51,26 @@ class CalibrationStep(object) :
         return self._name
 
     def description(self):
-        return "No description available"
+        return self.metadata.description
     
     def requiredArgs(self):
         return self._requiredArgs
+
+    """ The steps this step depends on (the step outputs it loads)
+    """
+    def dependencies(self):
+        return list(self._stepOutputsToLoad)
+
+    """ The number of cores used by the step (concurrent marlin processes)
+    """
+    def nCores(self):
+        return self._nCores
+
+    """ The resource usage of the processes launched by the step.
+        Set as the thread resource accounting while running the step (see ProcessTools)
+    """
+    def resourceAccounting(self):
+        return self._resourceAccounting
     
     """ The (optional) steps output to load before processing this step
     """
@@ -57,34 +89,58 @@ class CalibrationStep(object) :
     
     def setMarlinPandoraProcessor(self, processor):
         self._marlinPandoraProcessor = str(processor)
+
+    """ Set the checkpoint where the iterative steps save their state after each iteration.
+        If resume is True, the iteration loop continues from the saved state
+    """
+    def setCheckpoint(self, checkpoint, resume=False):
+        self._checkpoint = checkpoint
+        self._resume = resume
+
+    """ Set the update strategy of the iterative calibration loops (see RescaleStrategy module)
+    """
+    def setRescaleStrategy(self, strategy):
+        self._rescaleStrategy = str(strategy)
+
+    """ Create a new rescale strategy instance for the given true energy
+    """
+    def _createRescaleStrategy(self, trueEnergy):
+        return createRescaleStrategy(self._rescaleStrategy, trueEnergy)
         
+    """ Apply the common marlin runtime settings from the command line (event sharding)
+    """
+    def _configureMarlin(self, parsed):
+        self._marlin.setPfoAnalysisProcessor(self._pfoAnalysisProcessor)
+        self._marlin.setMaxNShards(int(parsed.maxNShards))
+        self._marlin.setMinEventsPerShard(int(parsed.minEventsPerShard))
+        self._nCores = max(1, int(parsed.maxNShards))
+        self._marlin.setCache(self._createMarlinCache(parsed))
+
+    """ Create the marlin output cache from the command line arguments (None if disabled)
+    """
+    def _createMarlinCache(self, parsed):
+        if not parsed.marlinCacheDir:
+            return None
+        return MarlinCache(parsed.marlinCacheDir, float(parsed.marlinCacheSize)*1024**3)
+
     def _loadStepOutputs(self, config):    
         for step in self._stepOutputsToLoad:
             self._marlin.loadStepOutputParameters(config, step)
 
-    def _cleanupElement(self, tree) :
-        elts = tree.xpath("//step[@name='{0}']".format(self._name))
+    def _cleanupElement(self, config) :
         # remove previous elements
-        if elts :
-            for elt in elts :
-                tree.getroot().remove(elt)
+        config.resetStep(self._name)
 
     def getParameter(self, config, name, step=None) :
-        userInput = config.xpath("//input")
+        userInput = config.input()
         stepElt = None
 
         if step is not None :
-            stepElts = config.xpath("//step[@name='{0}']".format(step))
+            stepElt = config.stepOutput(step)
 
-            if len(stepElts) :
-                stepElt = stepElts[-1].find("output")
-
-        if not len(userInput) and stepElt is None :
+        if userInput is None and stepElt is None :
             raise RuntimeError("Couldn't get parameter '{0}' from input nor from step".format(name))
 
-        if len(userInput) :
-            userInput = userInput[0]
-
         # first look into the step element
         if stepElt :
             paramElt = stepElt.find(name)
@@ -98,23 +154,11 @@ class CalibrationStep(object) :
             raise NameError("Parameter '{0}' not found in user input config".format(name))
         return paramElt.text
 
-    def _getXMLStep(self, tree, create=False):
-        elts = tree.xpath("//step[@name='{0}']".format(self._name))
-        if not elts and create:
-            elt = etree.Element("step", name=self._name)
-            tree.getroot().append(elt)
-            return elt
-        return None if not elts else elts[0]
-
-    def _getXMLStepOutput(self, tree, create=False):
-        step = self._getXMLStep(tree, create)
-        if step is None:
-            return None
-        output = step.find("output")
-        if output is None:
-            output = etree.Element("output")
-            step.append(output)
-        return output
+    def _getXMLStep(self, config, create=False):
+        return config.step(self._name, create)
+
+    def _getXMLStepOutput(self, config, create=False):
+        return config.stepOutput(self._name, create)
 
     def _writeProcessorParameter(self, parent, processor, name, value):
         element = etree.Element("parameter", processor=processor, name=name)
@@ -122,14 +166,20 @@ class CalibrationStep(object) :
         parent.append(element)
 
     def _configureIterationOutput(self, config):
-        step = self._getXMLStep(config, create=True)
-        iterations = step.find("iterations")
-        if iterations is None:
-            iterations = etree.Element("iterations")
-            step.append(iterations)
-        return iterations
+        return config.stepIterations(self._name)
 
-    def _writeIterationOutput(self, config, iterId, parameters):
+    """ Write the iteration parameters in the step element, with the resource
+        usage of the processes run since the previous iteration (unless given).
+        The step changes are committed in the calibration store
+    """
+    def _writeIterationOutput(self, config, iterId, parameters, usages=None):
+        if usages is None:
+            usages = self._resourceAccounting.takeUsages()
+            tracer = Tracer.instance()
+            tracer.completeEvent("iteration {0}".format(iterId), "iteration", self._iterationStartTime, tracer.now(), None, {"step" : self._name})
+            self._iterationStartTime = tracer.now()
+        processDicts = [dict(usage._asdict()) for usage in usages]
+        self._iterationRecords.append((iterId, dict(parameters), processDicts))
         iterations = self._configureIterationOutput(config)
         iteration = etree.Element("iteration", id=str(iterId))
         iterations.append(iteration)
@@ -137,6 +187,61 @@ class CalibrationStep(object) :
             parameter = etree.Element(key)
             parameter.text = str(value)
             iteration.append(parameter)
+        processes = etree.Element("processes")
+        iteration.append(processes)
+        for usage in usages:
+            processes.append(self._createUsageElement("process", usage._asdict()))
+        config.commitIteration(self._name, iterId, dict(parameters), processDicts)
+
+    def _createUsageElement(self, tag, usage):
+        element = etree.Element(tag)
+        for key, value in usage.items():
+            element.set(key, "{0:.3f}".format(value) if isinstance(value, float) else str(value))
+        return element
+
+    """ Write the resource usage summary of the processes launched by the step
+    """
+    def writeResourceSummary(self, config):
+        step = self._getXMLStep(config, create=True)
+        for element in step.findall("resources"):
+            step.remove(element)
+        step.append(self._createUsageElement("resources", self._resourceAccounting.summary()))
+
+    """ Save the loop state after a completed iteration (if checkpointing is enabled).
+        The iteration outputs written so far are saved with the state
+    """
+    def _checkpointIteration(self, iteration, state):
+        if self._checkpoint is None:
+            return
+        state = dict(state)
+        state["iteration"] = iteration
+        state["iterationRecords"] = self._iterationRecords
+        self._checkpoint.saveStepState(self._name, state)
+
+    """ Get the loop state of the last completed iteration when resuming (None otherwise).
+        The saved iteration outputs are written again in the config
+    """
+    def _restoreIteration(self, config):
+        self._iterationRecords = []
+        self._iterationStartTime = Tracer.instance().now()
+        if self._checkpoint is None or not self._resume:
+            return None
+
+        state = self._checkpoint.loadStepState(self._name)
+        if state is None:
+            return None
+
+        for record in state["iterationRecords"]:
+            usages = [ProcessUsage(**usage) for usage in record[2]] if len(record) > 2 else []
+            self._writeIterationOutput(config, record[0], record[1], usages)
+
+        self._logger.info("{0}: resuming after iteration {1}".format(self._name, state["iteration"]))
+        return state
+
+    """ The path of a file produced by the step (or a step iteration) in the workspace
+    """
+    def _workspacePath(self, fileName, iteration=None) :
+        return Workspace.instance().stepPath(self._name, fileName, iteration)
 
     def _extractFileList(self, inputFile, extension=None) :
         if isinstance(inputFile, list) :
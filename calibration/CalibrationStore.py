@@ -0,0 +1,180 @@
+#
+
+""" Calibration document store.
+    Wraps the calibration xml tree with an index of the input and step elements,
+    so the steps look up their inputs and outputs without scanning the tree.
+    The store is written atomically (temporary file + rename) in its file each
+    time a step commits its changes (after each iteration and at the end of the
+    step), so the file always reflects the current state of the calibration.
+    The concurrent steps (see StepScheduler) work on a copy of the store, their
+    step element is committed in the parent store.
+    With a journal (see CalibrationJournal), the step starts, iterations and outputs
+    are appended to the journal instead of writing the whole file on each commit.
+"""
+
+import os
+import copy
+import logging
+import tempfile
+import threading
+from calibration.XmlTools import etree
+
+
+class CalibrationStore(object):
+    """ Constructor. If fileName is set, the store is written in this file on commit,
+        unless a journal is set
+    """
+    def __init__(self, xmlTree, fileName=None, parent=None, journal=None):
+        self._xmlTree = xmlTree
+        self._fileName = os.path.abspath(fileName) if fileName else None
+        self._parent = parent
+        self._journal = journal
+        self._lock = threading.RLock()
+        self._logger = logging.getLogger("calibrationStore")
+        self._input = None
+        self._steps = {}
+        self._index()
+
+    def _index(self):
+        root = self._xmlTree.getroot()
+        for element in root.iter("input"):
+            self._input = element
+            break
+        # the last step element wins, as in the previous xpath lookups
+        for element in root.findall("step"):
+            self._steps[element.get("name")] = element
+
+    """ The calibration xml tree
+    """
+    def tree(self):
+        return self._xmlTree
+
+    def fileName(self):
+        return self._fileName
+
+    def journal(self):
+        return self._journal
+
+    """ The user input element (None if not found)
+    """
+    def input(self):
+        return self._input
+
+    """ Get the element of a step, created if not found and create is True
+    """
+    def step(self, name, create=False):
+        with self._lock:
+            element = self._steps.get(name)
+            if element is None and create:
+                element = etree.Element("step", name=name)
+                self._xmlTree.getroot().append(element)
+                self._steps[name] = element
+            return element
+
+    """ Get the output element of a step, created if not found and create is True
+    """
+    def stepOutput(self, name, create=False):
+        step = self.step(name, create)
+        if step is None:
+            return None
+        output = step.find("output")
+        if output is None and create:
+            output = etree.Element("output")
+            step.append(output)
+        return output
+
+    """ Get the iterations element of a step (step and iterations elements are created if needed)
+    """
+    def stepIterations(self, name):
+        step = self.step(name, create=True)
+        iterations = step.find("iterations")
+        if iterations is None:
+            iterations = etree.Element("iterations")
+            step.append(iterations)
+        return iterations
+
+    def removeStep(self, name):
+        with self._lock:
+            element = self._steps.pop(name, None)
+            if element is not None:
+                self._xmlTree.getroot().remove(element)
+
+    """ Remove the previous element of a step before running it
+    """
+    def resetStep(self, name):
+        self.removeStep(name)
+        if self._journal is not None:
+            self._journal.appendStart(name)
+
+    """ Replace the element of a step by the given element
+    """
+    def replaceStep(self, name, element):
+        with self._lock:
+            self.removeStep(name)
+            self._xmlTree.getroot().append(element)
+            self._steps[name] = element
+
+    """ Create a copy of the store. The copy commits its steps in this store
+    """
+    def copy(self):
+        with self._lock:
+            return CalibrationStore(copy.deepcopy(self._xmlTree), None, self, self._journal)
+
+    """ Commit the changes of a step : copied in the parent store, then written on disk
+    """
+    def commitStep(self, name):
+        if self._parent is not None:
+            element = self.step(name)
+            if element is not None:
+                self._parent.replaceStep(name, copy.deepcopy(element))
+            self._parent.commitStep(name)
+            return
+        if self._journal is None:
+            self.flush()
+
+    """ Commit a step iteration (processes are the resource usage dicts of the iteration processes)
+    """
+    def commitIteration(self, name, iterId, parameters, processes):
+        if self._journal is not None:
+            self._journal.appendIteration(name, iterId, parameters, processes)
+        self.commitStep(name)
+
+    """ Commit the step output, once the step is completed
+    """
+    def commitOutput(self, name, resources=None):
+        if self._journal is not None:
+            output = self.stepOutput(name)
+            parameters = [] if output is None else [[p.get("processor"), p.get("name"), p.text] for p in output.iter("parameter")]
+            self._journal.appendOutput(name, parameters, resources)
+        self.commitStep(name)
+
+    """ Serialize the calibration tree
+    """
+    def tostring(self):
+        with self._lock:
+            return etree.tostring(self._xmlTree, xml_declaration=True, pretty_print=True)
+
+    """ Write the store atomically in a file (the store file by default)
+    """
+    def flush(self, fileName=None):
+        fileName = os.path.abspath(fileName) if fileName else self._fileName
+        if fileName is None:
+            return
+
+        with self._lock:
+            content = self.tostring()
+            # keep the permissions of the replaced file (mkstemp creates the file user readable only)
+            mode = os.stat(fileName).st_mode & 0o777 if os.path.isfile(fileName) else 0o644
+            fhandle, tmpFileName = tempfile.mkstemp(prefix=".tmp_calibration_", dir=os.path.dirname(fileName))
+            try:
+                with os.fdopen(fhandle, "w") as f:
+                    f.write(content)
+                os.chmod(tmpFileName, mode)
+                os.rename(tmpFileName, fileName)
+            except:
+                os.remove(tmpFileName)
+                raise
+
+
+
+#
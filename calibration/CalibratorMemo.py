@@ -0,0 +1,120 @@
+#
+
+""" Persistent memo of the PandoraAnalysis calibrator results.
+    The calibrators are deterministic functions of their root input files and
+    arguments. Their parsed outputs are stored in a sqlite database, keyed on
+    the binary name, the arguments (output path excluded) and the content digest
+    of the input files, so re-running or re-analysing a step doesn't launch
+    the binaries again.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+
+class CalibratorMemo(object):
+    def __init__(self, databaseFile):
+        self._databaseFile = databaseFile
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._nHits = 0
+        self._nMisses = 0
+        self._logger = logging.getLogger("calibratorMemo")
+
+        with self._lock:
+            connection = self._connect()
+            try:
+                connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, binary TEXT, arguments TEXT, outputs TEXT, hits INTEGER, created REAL, lastUsed REAL)")
+                connection.commit()
+            finally:
+                connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self._databaseFile, timeout=60)
+
+    """ Compute the memo key of a calibrator invocation.
+        Arguments refering to an existing file are replaced by the file content digest
+    """
+    def computeKey(self, binary, arguments):
+        keyArguments = []
+        for name, value in sorted(arguments.items()):
+            if value and os.path.isfile(value):
+                value = self.fileDigest(value)
+            keyArguments.append((name, value))
+
+        sha = hashlib.sha1()
+        sha.update(binary.encode())
+        sha.update(json.dumps(keyArguments).encode())
+        return sha.hexdigest()
+
+    """ Get the content digest of a file. Cached as long as the file is not modified
+    """
+    def fileDigest(self, fileName):
+        stat = os.stat(fileName)
+        fileId = (os.path.abspath(fileName), stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            if fileId in self._digests:
+                return self._digests[fileId]
+
+        sha = hashlib.sha1()
+        with open(fileName, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+
+        with self._lock:
+            self._digests[fileId] = sha.hexdigest()
+        return self._digests[fileId]
+
+    """ Get the stored outputs of a key (dict), None if not found
+    """
+    def load(self, key):
+        with self._lock:
+            connection = self._connect()
+            try:
+                row = connection.execute("SELECT outputs FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self._nMisses = self._nMisses + 1
+                    return None
+                connection.execute("UPDATE results SET hits = hits + 1, lastUsed = ? WHERE key = ?", (time.time(), key))
+                connection.commit()
+                self._nHits = self._nHits + 1
+            finally:
+                connection.close()
+
+        return json.loads(row[0])
+
+    """ Store the outputs (dict) of a key
+    """
+    def save(self, key, binary, arguments, outputs):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            try:
+                connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, 0, ?, ?)",
+                                   (key, binary, json.dumps(arguments, sort_keys=True), json.dumps(outputs), now, now))
+                connection.commit()
+            finally:
+                connection.close()
+
+    """ Get the number of hits and misses since the memo was opened
+    """
+    def statistics(self):
+        return self._nHits, self._nMisses
+
+    """ Log the hit/miss statistics
+    """
+    def logStatistics(self):
+        nHits, nMisses = self.statistics()
+        nQueries = nHits + nMisses
+        hitRate = 100. * nHits / nQueries if nQueries else 0.
+        self._logger.info("Calibrator memo {0}: {1} hits, {2} misses ({3:.1f}% hit rate)".format(self._databaseFile, nHits, nMisses, hitRate))
+
+
+
+#
@@ -0,0 +1,87 @@
+#
+
+""" Checkpointing of a calibration run.
+    The calibration manager saves a snapshot of the calibration xml tree after
+    each completed step, the iterative steps save their loop state after each
+    completed iteration. All files are written atomically (temporary file + rename),
+    a job killed while writing a checkpoint leaves the previous one untouched.
+"""
+
+import os
+import json
+import logging
+import tempfile
+
+
+class Checkpoint(object):
+    def __init__(self, directory):
+        self._directory = os.path.abspath(directory)
+        self._logger = logging.getLogger("checkpoint")
+
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+
+    def directory(self):
+        return self._directory
+
+    """ Write the content to the file atomically
+    """
+    def _atomicWrite(self, fileName, content):
+        fhandle, tmpFileName = tempfile.mkstemp(prefix=".tmp_", dir=self._directory)
+        try:
+            with os.fdopen(fhandle, "w") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpFileName, os.path.join(self._directory, fileName))
+        except:
+            os.remove(tmpFileName)
+            raise
+
+    def _readJson(self, fileName):
+        path = os.path.join(self._directory, fileName)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    """ Save the calibration xml content and the index of the last completed step
+    """
+    def saveManagerState(self, xmlContent, lastCompletedStep):
+        self._atomicWrite("calibration.xml", xmlContent)
+        self._atomicWrite("manager.json", json.dumps({"lastCompletedStep" : lastCompletedStep}))
+        self._logger.info("Checkpoint saved after step {0}".format(lastCompletedStep))
+
+    """ Get the index of the last completed step (None if no checkpoint)
+    """
+    def lastCompletedStep(self):
+        state = self._readJson("manager.json")
+        return None if state is None else state["lastCompletedStep"]
+
+    """ Get the calibration xml file of the last checkpoint
+    """
+    def xmlFile(self):
+        return os.path.join(self._directory, "calibration.xml")
+
+    """ Save the state of a step after a completed iteration
+    """
+    def saveStepState(self, stepName, state):
+        self._atomicWrite("step_{0}.json".format(stepName), json.dumps(state, indent=1))
+        self._logger.info("Checkpoint saved for step {0}, iteration {1}".format(stepName, state.get("iteration")))
+
+    """ Get the state of a step (None if not found)
+    """
+    def loadStepState(self, stepName):
+        return self._readJson("step_{0}.json".format(stepName))
+
+    """ Remove the state of a step, once completed
+    """
+    def clearStepState(self, stepName):
+        try:
+            os.remove(os.path.join(self._directory, "step_{0}.json".format(stepName)))
+        except OSError:
+            pass
+
+
+
+#
@@ -0,0 +1,202 @@
+#
+
+""" Reader of the DD4hep (lcgeo) compact files, without instantiating the geometry.
+    The constants of the compact file and of its includes are evaluated in python
+    (units, arithmetic and math functions), the calorimeter envelopes and layering
+    are read from the detector elements. The output is the geometry summary used by
+    GeometryInterface, with the conventions of the gear CalorimeterParameters :
+     - barrel : inner_r and outer_z from the envelope, outer_r = inner_r + layers
+     - endcap/ring : inner_r, outer_r and inner_z from the envelope, outer_z = inner_z + layers
+     - a layer absorber thickness is the sum of its radiator slices (radiator="yes"
+       or a material of radiatorMaterials)
+    This covers the driver conventions of the lcgeo calorimeters. Detectors built by
+    drivers computing their envelope in C++ may differ from the gear conversion.
+"""
+
+import os
+import math
+import logging
+from calibration.XmlTools import etree
+
+
+class CompactReader(object):
+    # DD4hep units (mm, rad, GeV)
+    units = {
+        "mm" : 1., "millimeter" : 1., "cm" : 10., "centimeter" : 10., "m" : 1000., "meter" : 1000.,
+        "um" : 1e-3, "micrometer" : 1e-3, "nm" : 1e-6, "km" : 1e6,
+        "rad" : 1., "radian" : 1., "mrad" : 1e-3, "deg" : math.pi/180., "degree" : math.pi/180.,
+        "pi" : math.pi, "twopi" : 2.*math.pi, "halfpi" : math.pi/2.,
+        "GeV" : 1., "MeV" : 1e-3, "keV" : 1e-6, "eV" : 1e-9, "TeV" : 1e3,
+        "tesla" : 1e-3, "T" : 1e-3, "g" : 1., "kg" : 1e3, "cm3" : 1e3
+    }
+    functions = {
+        "sin" : math.sin, "cos" : math.cos, "tan" : math.tan, "asin" : math.asin, "acos" : math.acos,
+        "atan" : math.atan, "atan2" : math.atan2, "sqrt" : math.sqrt, "pow" : math.pow, "exp" : math.exp,
+        "log" : math.log, "log10" : math.log10, "abs" : abs, "fabs" : math.fabs, "min" : min, "max" : max
+    }
+    # the gear detector names and their possible names in the compact files
+    detectorNames = {
+        "EcalBarrel" : ["EcalBarrel"],
+        "EcalEndcap" : ["EcalEndcap"],
+        "EcalPlug" : ["EcalPlug", "EcalEndcapRing", "EcalRing"],
+        "HcalBarrel" : ["HcalBarrel"],
+        "HcalEndcap" : ["HcalEndcap"],
+        "HcalRing" : ["HcalRing", "HcalEndcapRing"]
+    }
+    radiatorMaterials = set(["TungstenDens24", "TungstenDens25", "Tungsten", "tungsten", "W", "Iron", "iron", "Fe",
+                             "Steel235", "S235", "stainless_steel", "Steel", "Lead", "lead", "Pb", "Copper", "Cu"])
+
+    def __init__(self, compactFile):
+        self._compactFile = os.path.abspath(compactFile)
+        self._logger = logging.getLogger("compactReader")
+        self._constants = {}
+        self._constantExpressions = []
+        self._detectors = {}
+
+        self._readFile(self._compactFile, set())
+        self._evaluateConstants()
+
+    """ Read a compact file and its includes (depth first)
+    """
+    def _readFile(self, fileName, visited):
+        if fileName in visited:
+            return
+        visited.add(fileName)
+        root = etree.parse(fileName).getroot()
+        self._readElement(root, os.path.dirname(fileName), visited)
+
+    def _readElement(self, element, directory, visited):
+        for child in list(element):
+            tag = child.tag if isinstance(child.tag, str) else None
+            if tag is None:
+                continue
+            if tag in ("include", "gdmlFile") and child.get("ref"):
+                ref = child.get("ref")
+                fileName = ref if os.path.isabs(ref) else os.path.join(directory, ref)
+                if ref.endswith(".xml") and os.path.isfile(fileName):
+                    self._readFile(os.path.abspath(fileName), visited)
+                continue
+            if tag == "constant":
+                self._constantExpressions.append((child.get("name"), child.get("value")))
+                continue
+            if tag == "detector" and child.get("name"):
+                self._detectors.setdefault(child.get("name"), child)
+                continue
+            self._readElement(child, directory, visited)
+
+    """ Evaluate the constants. Constants may refer to constants defined later
+    """
+    def _evaluateConstants(self):
+        pending = list(self._constantExpressions)
+
+        while pending:
+            unresolved = []
+            for name, expression in pending:
+                try:
+                    self._constants[name] = self.evaluate(expression)
+                except NameError:
+                    unresolved.append((name, expression))
+                except (SyntaxError, TypeError, ValueError, ZeroDivisionError):
+                    # string constants (i.e detector names) are not numbers
+                    self._logger.debug("Constant {0} is not a number ({1})".format(name, expression))
+
+            if len(unresolved) == len(pending):
+                self._logger.warning("Unresolved constants: {0}".format(", ".join([name for name, expression in unresolved])))
+                break
+            pending = unresolved
+
+    """ Evaluate a compact file expression (i.e "Ecal_inner_radius + 2*mm")
+    """
+    def evaluate(self, expression):
+        if expression is None:
+            raise ValueError("CompactReader: empty expression")
+        namespace = dict(self.units)
+        namespace.update(self.functions)
+        namespace.update(self._constants)
+        return float(eval(expression.replace("^", "**"), {"__builtins__" : {}}, namespace))
+
+    def constant(self, name):
+        return self._constants[name]
+
+    def _getAttribute(self, elements, names):
+        for element in elements:
+            for name in names:
+                if element.get(name) is not None:
+                    return self.evaluate(element.get(name))
+        return None
+
+    """ Get the layer thickness, absorber and sensitive sums of a detector
+    """
+    def _getLayering(self, detector):
+        thicknessSum = 0.
+        absorberSum = 0.
+        sensitiveSum = 0.
+
+        for layer in detector.iter("layer"):
+            repeat = int(self.evaluate(layer.get("repeat", "1")))
+            slices = layer.findall("slice")
+            if not slices:
+                if layer.get("thickness") is not None:
+                    thicknessSum = thicknessSum + repeat*self.evaluate(layer.get("thickness"))
+                continue
+
+            thickness = 0.
+            absorber = 0.
+            for sliceElement in slices:
+                sliceThickness = self.evaluate(sliceElement.get("thickness"))
+                thickness = thickness + sliceThickness
+                if sliceElement.get("radiator", "").lower() in ("yes", "true", "1") or sliceElement.get("material") in self.radiatorMaterials:
+                    absorber = absorber + sliceThickness
+
+            thicknessSum = thicknessSum + repeat*thickness
+            absorberSum = absorberSum + repeat*absorber
+            sensitiveSum = sensitiveSum + repeat*(thickness - absorber)
+
+        return thicknessSum, absorberSum, sensitiveSum
+
+    """ Get the summary of a detector (see GeometryInterface), None if not found
+    """
+    def detectorSummary(self, gearName):
+        detector = None
+        for name in self.detectorNames.get(gearName, [gearName]):
+            if name in self._detectors:
+                detector = self._detectors[name]
+                break
+        if detector is None:
+            return None
+
+        elements = [element for element in [detector.find("dimensions"), detector.find("envelope/shape"), detector.find("envelope")] if element is not None]
+        thicknessSum, absorberSum, sensitiveSum = self._getLayering(detector)
+        innerR = self._getAttribute(elements, ["inner_r", "rmin", "rMin"])
+        outerR = self._getAttribute(elements, ["outer_r", "rmax", "rMax"])
+        innerZ = self._getAttribute(elements, ["inner_z", "zmin", "zMin"])
+        halfZ = self._getAttribute(elements, ["outer_z", "zmax", "zMax", "dz", "z", "zhalf"])
+
+        summary = {"inner_r" : innerR, "absorberSum" : absorberSum or None, "sensitiveSum" : sensitiveSum or None}
+
+        if innerZ is None:
+            # barrel
+            summary["inner_z"] = None
+            summary["outer_z"] = halfZ
+            summary["outer_r"] = innerR + thicknessSum if innerR is not None else None
+        else:
+            # endcap or ring
+            summary["inner_z"] = innerZ
+            summary["outer_z"] = innerZ + thicknessSum
+            summary["outer_r"] = outerR
+
+        return summary
+
+    """ Get the geometry summary of the calorimeters (see GeometryInterface)
+    """
+    def summary(self):
+        detectors = {}
+        for gearName in sorted(self.detectorNames.keys()):
+            detectorSummary = self.detectorSummary(gearName)
+            if detectorSummary is not None:
+                detectors["{0}/CalorimeterParameters".format(gearName)] = detectorSummary
+        return {"compactFile" : self._compactFile, "detectors" : detectors}
+
+
+
+#
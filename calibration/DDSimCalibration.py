@@ -1,15 +1,30 @@
 import os
-import subprocess
+import struct
+from calibration.ProcessTools import ProcessResult
+from calibration.Executors import createExecutor
+from calibration.AdmissionControl import AdmissionController
 
 
 """
-Simple factory class to create DDSim instance for calibration purpose
+Simple factory class to create DDSim instance for calibration purpose.
+The simulations can be split in event shards (see setEventsPerShard), each shard
+runs in its own ddsim process with its own random seed and output file. The shards
+are run on a bounded process pool, the most expensive ones first (see particleCosts)
 """
 class DDSimCalibration(object) :
+    # relative simulation cost of an event per GeV, by particle. Muons are minimum ionizing (cost per event)
+    particleCosts = {"kaon0L" : 4., "neutron" : 4., "pi+" : 4., "pi-" : 4., "proton" : 4., "gamma" : 1., "e-" : 1., "e+" : 1.}
+    mipParticleCosts = {"mu-" : 1., "mu+" : 1.}
+
     def __init__(self) :
         self.steeringFile = ""
         self.compactFile = ""
         self.simulations = []
+        self.eventsPerShard = 0
+        self.maxNProcesses = 0
+        self.seed = None
+        self._shards = []
+        self._results = []
 
     def setSterringFile(self, steeringFile):
         self.steeringFile = steeringFile
@@ -20,21 +35,123 @@ class DDSimCalibration(object) :
     def addSimulation(self, parameters):
         self.simulations.append(parameters)
 
+    """ Set the maximum number of events simulated by a ddsim process (0 : no sharding)
+    """
+    def setEventsPerShard(self, eventsPerShard):
+        self.eventsPerShard = int(eventsPerShard)
+
+    """ Set the maximum number of concurrent ddsim processes (0 : as many as the admission control allows)
+    """
+    def setMaxNProcesses(self, maxNProcesses):
+        self.maxNProcesses = int(maxNProcesses)
+
+    """ Set the base random seed. The shards get distinct seeds (seed, seed+1, ...).
+        Without seed, a random base seed is drawn for the sharded simulations, so
+        that independent productions don't simulate the same events
+    """
+    def setSeed(self, seed):
+        self.seed = int(seed)
+
+    """ Draw a random base seed, leaving room for the shard seeds below 2^31
+    """
+    def _randomSeed(self):
+        return struct.unpack("I", os.urandom(4))[0] % 2**30 + 1
+
+    """ The relative cost of a simulation shard, for longest job first ordering
+    """
+    def _shardCost(self, parameters):
+        particle = parameters.get("particle")
+        nEvents = float(parameters.get("numberOfEvents", 10000))
+        if "cost" in parameters:
+            return nEvents * float(parameters["cost"])
+        if particle in self.mipParticleCosts:
+            return nEvents * self.mipParticleCosts[particle]
+        return nEvents * self.particleCosts.get(particle, 1.) * float(parameters.get("energy", 1.))
+
+    """ Split the simulations in event shards. Returns a list of (simulation index, shard parameters, name)
+    """
+    def _createShards(self):
+        shards = []
+        seed = self.seed
+        if seed is None and self.eventsPerShard > 0:
+            seed = self._randomSeed()
+            print "Random base seed : {0} (use setSeed to reproduce)".format(seed)
+
+        for index, sim in enumerate(self.simulations):
+            nEvents = int(sim.get("numberOfEvents", 10000))
+            nShards = max(1, (nEvents + self.eventsPerShard - 1) // self.eventsPerShard) if self.eventsPerShard > 0 else 1
+            name = "ddsim {0} {1} GeV".format(sim.get("particle"), sim.get("energy"))
+
+            if nShards == 1:
+                parameters = dict(sim)
+                if seed is not None:
+                    parameters["seed"] = seed
+                    seed = seed + 1
+                shards.append((index, parameters, name))
+                continue
+
+            outputBase, outputExtension = os.path.splitext(sim.get("outputFile"))
+            for shard in range(nShards):
+                parameters = dict(sim)
+                parameters["numberOfEvents"] = nEvents // nShards + (1 if shard < nEvents % nShards else 0)
+                parameters["outputFile"] = "{0}_shard{1}{2}".format(outputBase, shard, outputExtension)
+                parameters["seed"] = seed
+                seed = seed + 1
+                shards.append((index, parameters, "{0} [{1}/{2}]".format(name, shard+1, nShards)))
+
+        return shards
+
+    """ Run the simulation shards in different processes with the default executor (see Executors),
+        as many at a time as the cores and memory allow (see AdmissionControl, local executor only)
+        and at most maxNProcesses, the most expensive shards first. Returns a list of ProcessResult (one per shard)
+    """
     def run(self):
-        processes = []
+        admissionController = AdmissionController.instance()
+        executor = createExecutor()
+        self._shards = self._createShards()
+        self._results = [ProcessResult(name, None, 0., [parameters.get("outputFile")]) for index, parameters, name in self._shards]
+        shardQueue = sorted(range(len(self._shards)), key=lambda shard: self._shardCost(self._shards[shard][1]), reverse=True)
+
+        while 1:
+            jobs = []
+            while shardQueue :
+                if self.maxNProcesses > 0 and executor.nRunning() + len(jobs) >= self.maxNProcesses :
+                    break
+                index, sim, name = self._shards[shardQueue[0]]
+                admission = None
+                if executor.usesLocalResources() :
+                    workload = "ddsim {0}".format(sim.get("particle"))
+                    # queue the simulation if the node is full. Wait only if none is running
+                    admission = admissionController.tryAcquire(workload) if executor.nRunning() or jobs else admissionController.acquire(workload)
+                    if admission is None :
+                        break
+                shard = shardQueue.pop(0)
+                args = self._createDDSimArgs(sim)
+                args[:0] = ['ddsim']
+                print "Args : " + str(args)
+                jobs.append((args, shard, name, admission))
+            executor.startArray(jobs)
 
-        # run simulations in different processes
-        for sim in self.simulations :
-            args = self._createDDSimArgs(sim)
-            args[:0] = ['ddsim']
-            print "Args : " + str(args)
-            process = subprocess.Popen(args = args)#, stdin = None, stdout = None, stderr = None)
-            processes.append(process)
+            if executor.nRunning() == 0:
+                break
 
-        for p in processes :
-            p.wait()
+            shard, status, wallTime, rusage = executor.wait()
+            self._results[shard] = self._results[shard]._replace(status=status, wallTime=wallTime)
+            if status :
+                print "Simulation '{0}' ended with status {1}".format(self._results[shard].name, status)
 
         print "Simulation(s) done ..."
+        return list(self._results)
+
+    """ The output files of each simulation (in the order of addSimulation), after run.
+        Only the shards that succeeded are listed
+    """
+    def simulationOutputFiles(self):
+        outputFiles = [[] for sim in self.simulations]
+        for (index, parameters, name), result in zip(self._shards, self._results):
+            if result.status == 0:
+                outputFiles[index].extend(result.outputs)
+        return outputFiles
 
     def _createDDSimArgs(self, parameters) :
         args = []
@@ -52,5 +169,8 @@ class DDSimCalibration(object) :
         args.append(parameters.get("physicsList", "QGSP_BERT"))
         args.append("--numberOfEvents")
         args.append(str(parameters.get("numberOfEvents", 10000)))
+        if parameters.get("seed") is not None:
+            args.append("--random.seed")
+            args.append(str(parameters.get("seed")))
 
         return args
@@ -1,17 +1,22 @@
 
 
 from calibration.CalibrationStep import CalibrationStep
+from calibration.StepMetadata import ecalEnergyMetadata
 from calibration.Marlin import Marlin
 from calibration.PandoraAnalysis import *
 from calibration.FileTools import *
+from calibration.PfoAnalysisEngine import nativeEngineAvailable
+from calibration.RescaleSurrogate import SurrogateIterations
 import os, sys
 from calibration.XmlTools import etree
 
 """ EcalEnergyStep class. Base class for calibrating the ecal
 """
 class EcalEnergyStep(CalibrationStep) :
+    metadata = ecalEnergyMetadata
+
     def __init__(self) :
-        CalibrationStep.__init__(self, "EcalEnergy")
+        CalibrationStep.__init__(self)
         self._marlin = None
 
         self._maxNIterations = 5
@@ -28,13 +33,7 @@ class EcalEnergyStep(CalibrationStep) :
         self._outputEcalRingFactors = None
         
         self._runRingCalibration = True
-        
-        # command line requirement
-        self._requireSteeringFile()
-        self._requireCompactFile()
-        self._requireIterations()
-        self._requirePhotonFile()
-        self._requireECalAccuracy()
+        self._useSurrogate = False
     
     """ Whether to run the ecal ring calibration
     """
@@ -56,11 +55,6 @@ class EcalEnergyStep(CalibrationStep) :
     def setEnergyFactors(self, barrelFactors, endcapFactors):
         pass
     
-    """ Get the step description
-    """
-    def description(self):
-        return "Calculate the constants related to the energy deposit in a ecal cell (unit GeV). Outputs the ecalFactors values"
-
     """ Read the command line arguments
     """
     def readCmdLine(self, parsed):
@@ -71,6 +65,10 @@ class EcalEnergyStep(CalibrationStep) :
         self._marlin.setCompactFile(parsed.compactFile)
         self._marlin.setMaxRecordNumber(parsed.maxRecordNumber)
         self._marlin.setInputFiles(self._extractFileList(parsed.lcioPhotonFile, "slcio"))
+        self._configureMarlin(parsed)
+
+        if parsed.rescaleStrategy:
+            self.setRescaleStrategy(parsed.rescaleStrategy)
 
         self._maxNIterations = int(parsed.maxNIterations)
         self._energyScaleAccuracy = float(parsed.ecalCalibrationAccuracy)
@@ -79,6 +77,10 @@ class EcalEnergyStep(CalibrationStep) :
         self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap = self._getGeometry().getEcalEndcapCosThetaRange()
         
         self._photonEnergy = parsed.photonEnergy
+        self._useSurrogate = parsed.surrogateIterations
+
+        if self._useSurrogate and not nativeEngineAvailable():
+            raise RuntimeError("{0}: surrogate iterations require numpy and uproot".format(self._name))
 
     """ Initialize the calibration step
     """
@@ -110,10 +112,45 @@ class EcalEnergyStep(CalibrationStep) :
 
         pfoAnalysisFile = ""
         
-        ecalCalibrator = EcalCalibrator()
-        ecalCalibrator.setPhotonEnergy(self._photonEnergy)
+        barrelCalibrator = EcalCalibrator()
+        barrelCalibrator.setPhotonEnergy(self._photonEnergy)
+        barrelCalibrator.setDetectorRegion("Barrel")
+        barrelCalibrator.setCosThetaRange(self._inputMinCosThetaBarrel, self._inputMaxCosThetaBarrel)
+
+        endcapCalibrator = EcalCalibrator()
+        endcapCalibrator.setPhotonEnergy(self._photonEnergy)
+        endcapCalibrator.setDetectorRegion("EndCap")
+        endcapCalibrator.setCosThetaRange(self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap)
+
+        barrelRescale = self._createRescaleStrategy(self._photonEnergy)
+        endcapRescale = self._createRescaleStrategy(self._photonEnergy)
+
+        surrogate = SurrogateIterations("ECal", self._photonEnergy, self._energyScaleAccuracy,
+            {"Barrel" : (self._inputMinCosThetaBarrel, self._inputMaxCosThetaBarrel),
+             "EndCap" : (self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap)}, self._useSurrogate)
+
+        firstIteration = 0
+        state = self._restoreIteration(config)
+
+        if state is not None:
+            firstIteration = state["iteration"] + 1
+            ecalBarrelFactors, ecalEndcapFactors = state["barrelFactors"], state["endcapFactors"]
+            barrelRescaleFactor, endcapRescaleFactor = state["barrelRescale"], state["endcapRescale"]
+            barrelRescaleFactorCumul, endcapRescaleFactorCumul = state["barrelRescaleCumul"], state["endcapRescaleCumul"]
+            barrelCurrentPrecision, endcapCurrentPrecision = state["barrelPrecision"], state["endcapPrecision"]
+            barrelAccuracyReached, endcapAccuracyReached = state["barrelAccuracyReached"], state["endcapAccuracyReached"]
+            newBarrelPhotonEnergy, newEndcapPhotonEnergy = state["newBarrelEnergy"], state["newEndcapEnergy"]
+            pfoAnalysisFile = state["pfoAnalysisFile"]
+            barrelRescale.setHistory(state["barrelHistory"])
+            endcapRescale.setHistory(state["endcapHistory"])
+            surrogate.setState(state.get("surrogate"))
+
+            if barrelAccuracyReached:
+                self._outputEcalBarrelFactors = ecalBarrelFactors
+            if endcapAccuracyReached:
+                self._outputEcalEndcapFactors = ecalEndcapFactors
 
-        for iteration in range(self._maxNIterations) :
+        for iteration in range(firstIteration, self._maxNIterations) :
 
             # readjust iteration parameters
             if not barrelAccuracyReached:
@@ -124,36 +161,51 @@ class EcalEnergyStep(CalibrationStep) :
                 for index in range(len(ecalEndcapFactors)):
                     ecalEndcapFactors[index] = ecalEndcapFactors[index]*endcapRescaleFactor
 
-            pfoAnalysisFile = "./PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration)
+            pfoAnalysisFile = self._workspacePath("PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration), iteration)
             
             # run marlin
             self.setEnergyFactors(ecalBarrelFactors, ecalEndcapFactors)
             self._marlin.setProcessorParameter(self._pfoAnalysisProcessor, "RootFile", pfoAnalysisFile)
             self._marlin.run()
 
-            # run calibration for barrel
+            # run the barrel and endcap calibrations concurrently
+            calibrators = []
+            if not barrelAccuracyReached:
+                barrelCalibrator.setRootFile(pfoAnalysisFile)
+                calibrators.append(barrelCalibrator)
+            if not endcapAccuracyReached:
+                endcapCalibrator.setRootFile(pfoAnalysisFile)
+                calibrators.append(endcapCalibrator)
+            runCalibrators(calibrators)
+
             if not barrelAccuracyReached:
-                ecalCalibrator.setRootFile(pfoAnalysisFile)
-                ecalCalibrator.setDetectorRegion("Barrel")
-                ecalCalibrator.setCosThetaRange(self._inputMinCosThetaBarrel, self._inputMaxCosThetaBarrel)
-                ecalCalibrator.run()
-                
-                newBarrelPhotonEnergy = ecalCalibrator.getEcalDigiMean()
-                barrelRescaleFactor = float(self._photonEnergy) / newBarrelPhotonEnergy
+                newBarrelPhotonEnergy = barrelCalibrator.getEcalDigiMean()
+                barrelRescaleFactor = barrelRescale.rescaleFactor(barrelRescaleFactorCumul, newBarrelPhotonEnergy)
                 barrelRescaleFactorCumul = barrelRescaleFactorCumul*barrelRescaleFactor
-                barrelCurrentPrecision = abs(1 - 1. / barrelRescaleFactor)
+                barrelCurrentPrecision = abs(1 - newBarrelPhotonEnergy / float(self._photonEnergy))
 
-            # run calibration for endcap
             if not endcapAccuracyReached:
-                ecalCalibrator.setRootFile(pfoAnalysisFile)
-                ecalCalibrator.setDetectorRegion("EndCap")
-                ecalCalibrator.setCosThetaRange(self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap)
-                ecalCalibrator.run()
-                                
-                newEndcapPhotonEnergy = ecalCalibrator.getEcalDigiMean()
-                endcapRescaleFactor = float(self._photonEnergy) / newEndcapPhotonEnergy
+                newEndcapPhotonEnergy = endcapCalibrator.getEcalDigiMean()
+                endcapRescaleFactor = endcapRescale.rescaleFactor(endcapRescaleFactorCumul, newEndcapPhotonEnergy)
                 endcapRescaleFactorCumul = endcapRescaleFactorCumul*endcapRescaleFactor
-                endcapCurrentPrecision = abs(1 - 1. / endcapRescaleFactor)
+                endcapCurrentPrecision = abs(1 - newEndcapPhotonEnergy / float(self._photonEnergy))
+
+            # predict the next factors by reweighting this reconstruction,
+            # as long as the marlin iterations confirm the predictions
+            measuredEnergies = {}
+            if not barrelAccuracyReached:
+                measuredEnergies["Barrel"] = newBarrelPhotonEnergy
+            if not endcapAccuracyReached:
+                measuredEnergies["EndCap"] = newEndcapPhotonEnergy
+            surrogateFactors = surrogate.rescaleFactors(pfoAnalysisFile, measuredEnergies)
+
+            if "Barrel" in surrogateFactors:
+                barrelRescaleFactorCumul = barrelRescaleFactorCumul / barrelRescaleFactor * surrogateFactors["Barrel"]
+                barrelRescaleFactor = surrogateFactors["Barrel"]
+
+            if "EndCap" in surrogateFactors:
+                endcapRescaleFactorCumul = endcapRescaleFactorCumul / endcapRescaleFactor * surrogateFactors["EndCap"]
+                endcapRescaleFactor = surrogateFactors["EndCap"]
             
             self._logger.info("=============================================")
             self._logger.info("======= Barrel output for iteration {0} =======".format(iteration))
@@ -196,6 +248,24 @@ class EcalEnergyStep(CalibrationStep) :
             if barrelAccuracyReached and endcapAccuracyReached :
                 break
 
+            self._checkpointIteration(iteration,
+                {"barrelFactors" : ecalBarrelFactors,
+                 "endcapFactors" : ecalEndcapFactors,
+                 "barrelRescale" : barrelRescaleFactor,
+                 "endcapRescale" : endcapRescaleFactor,
+                 "barrelRescaleCumul" : barrelRescaleFactorCumul,
+                 "endcapRescaleCumul" : endcapRescaleFactorCumul,
+                 "barrelPrecision" : barrelCurrentPrecision,
+                 "endcapPrecision" : endcapCurrentPrecision,
+                 "barrelAccuracyReached" : barrelAccuracyReached,
+                 "endcapAccuracyReached" : endcapAccuracyReached,
+                 "newBarrelEnergy" : newBarrelPhotonEnergy,
+                 "newEndcapEnergy" : newEndcapPhotonEnergy,
+                 "pfoAnalysisFile" : pfoAnalysisFile,
+                 "barrelHistory" : barrelRescale.history(),
+                 "endcapHistory" : endcapRescale.history(),
+                 "surrogate" : surrogate.state()})
+
         if not barrelAccuracyReached or not endcapAccuracyReached :
             raise RuntimeError("{0}: Couldn't reach the user accuracy ({1})".format(self._name, self._energyScaleAccuracy))
 
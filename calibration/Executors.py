@@ -0,0 +1,368 @@
+#
+
+""" Execution backends of the marlin and ddsim processes.
+    The executors have the ChildWatcher interface (start/startArray, nRunning, wait, terminateAll) :
+     - local : the processes run on this node (ChildWatcher), with admission control
+     - sge : each process is a task of a qsub job array, optionally held on previous jobs (-hold_jid)
+     - condor : each process is a job of a HTCondor cluster (condor_submit)
+     - fake : local fake batch scheduler running the job scripts in the background, for tests
+    A batch job runs a generated script in the directory of the launcher (shared file system
+    required), which writes the process status in a status file. The status files are
+    polled to detect the job completion. The wall time of a batch job includes its queue time.
+"""
+
+import os
+import time
+import shlex
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+from pipes import quote
+from calibration.ProcessTools import ChildWatcher, ProcessResult, runProcess
+from calibration.Workspace import Workspace
+
+
+""" BatchJob class.
+    A submitted batch job (or array task), cancelled by terminate()
+"""
+class BatchJob(object):
+    def __init__(self, executor, jobId, task, statusFile):
+        self.executor = executor
+        self.jobId = jobId
+        self.task = task
+        self.statusFile = statusFile
+        self.submitTime = time.time()
+        self.missingPolls = 0
+
+    def terminate(self):
+        self.executor.cancel(self)
+
+
+""" BatchExecutor class.
+    Base class of the batch backends. Sub-classes implement _submit, _jobAlive and cancel
+"""
+class BatchExecutor(ChildWatcher):
+    # the directory of the job scripts, status files and logs (default <workspace run directory>/batch)
+    directory = None
+    # additional submission options (qsub options or condor submit commands separated by ';')
+    submitOptions = ""
+    # the status files polling interval (unit seconds)
+    pollInterval = 5.
+    # the number of polls between two checks of the job presence in the batch system
+    aliveCheckPolls = 12
+
+    def __init__(self):
+        ChildWatcher.__init__(self)
+        self._logger = logging.getLogger("batchExecutor")
+        self._jobs = {}
+        self._poller = None
+        self._directory = self.batchDirectory()
+
+    """ The directory of the job scripts, created if needed. It must be on a file system shared with the batch nodes
+    """
+    @classmethod
+    def batchDirectory(cls):
+        directory = os.path.abspath(cls.directory if cls.directory else os.path.join(Workspace.instance().runDirectory(), "batch"))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        return directory
+
+    def usesLocalResources(self):
+        return False
+
+    def start(self, args, key, admission=None, name=None, **popenArgs):
+        return self.startArray([(args, key, name, admission)], **popenArgs)[0]
+
+    """ Submit the processes as one job array. jobs is a list of (args, key, name, admission),
+        the admissions are not used (the jobs don't run on this node).
+        holdJobIds is a list of job ids the array waits for (see jobIds). Returns the batch jobs
+    """
+    def startArray(self, jobs, holdJobIds=None, cwd=None, **popenArgs):
+        if not jobs:
+            return []
+        if popenArgs:
+            raise ValueError("BatchExecutor: unsupported process arguments ({0})".format(", ".join(sorted(popenArgs.keys()))))
+
+        arrayDirectory = tempfile.mkdtemp(prefix="array_", dir=self._directory)
+        workingDirectory = os.path.abspath(cwd) if cwd else os.getcwd()
+        statusFiles = []
+
+        for task, (args, key, name, admission) in enumerate(jobs):
+            statusFile = os.path.join(arrayDirectory, "task{0}.status".format(task))
+            statusFiles.append(statusFile)
+            with open(os.path.join(arrayDirectory, "task{0}.sh".format(task)), "w") as f:
+                f.write("#!/bin/bash\n")
+                f.write("cd {0}\n".format(quote(workingDirectory)))
+                f.write(" ".join([quote(str(arg)) for arg in args]) + "\n")
+                f.write("echo $? > {0}.tmp\n".format(quote(statusFile)))
+                f.write("mv {0}.tmp {0}\n".format(quote(statusFile)))
+
+        # the task index is the first argument (0 based) or the sge task id (1 based)
+        arrayScript = os.path.join(arrayDirectory, "array.sh")
+        with open(arrayScript, "w") as f:
+            f.write("#!/bin/bash\n")
+            f.write("TASK=${1:-$((SGE_TASK_ID-1))}\n")
+            f.write("exec /bin/bash {0}/task${{TASK}}.sh\n".format(quote(arrayDirectory)))
+        os.chmod(arrayScript, 0o755)
+
+        name = jobs[0][2] if jobs[0][2] else os.path.basename(jobs[0][0][0])
+        jobId = self._submit(arrayScript, len(jobs), name, arrayDirectory, workingDirectory, holdJobIds)
+        self._logger.info("Submitted {0} job(s) '{1}' : job id {2}".format(len(jobs), name, jobId))
+
+        batchJobs = []
+        for task, (args, key, jobName, admission) in enumerate(jobs):
+            job = BatchJob(self, jobId, task, statusFiles[task])
+            self._register(job, key, None, jobName if jobName is not None else os.path.basename(args[0]))
+            with self._lock:
+                self._jobs[key] = job
+            batchJobs.append(job)
+
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll)
+                self._poller.daemon = True
+                self._poller.start()
+
+        return batchJobs
+
+    """ The ids of the submitted jobs still running
+    """
+    def jobIds(self):
+        with self._lock:
+            return sorted(set([job.jobId for job in self._jobs.values()]))
+
+    def _readStatus(self, statusFile):
+        try:
+            with open(statusFile) as f:
+                return int(f.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def _poll(self):
+        nPolls = 0
+        while True:
+            time.sleep(self.pollInterval)
+            nPolls = nPolls + 1
+            with self._lock:
+                jobs = list(self._jobs.items())
+            if not jobs:
+                with self._lock:
+                    if not self._jobs:
+                        self._poller = None
+                        return
+                continue
+
+            checkAlive = (nPolls % self.aliveCheckPolls == 0)
+            for key, job in jobs:
+                status = self._readStatus(job.statusFile) if os.path.isfile(job.statusFile) else None
+
+                if status is None and checkAlive:
+                    # a job left the batch system without status : killed (memory, time limit, ...)
+                    # it is declared lost if it is still missing at the next check
+                    job.missingPolls = 0 if self._jobAlive(job) else job.missingPolls + 1
+                    if job.missingPolls > 1:
+                        self._logger.error("Batch job {0} (task {1}) lost without status".format(job.jobId, job.task))
+                        status = -1
+
+                if status is not None:
+                    with self._lock:
+                        del self._jobs[key]
+                    self._notify((key, status, time.time() - job.submitTime, None))
+
+    """ Submit the array script as a job array of nTasks tasks. Returns the job id
+    """
+    def _submit(self, arrayScript, nTasks, name, arrayDirectory, workingDirectory, holdJobIds):
+        raise NotImplementedError
+
+    """ Whether the job is still known by the batch system (queued or running)
+    """
+    def _jobAlive(self, job):
+        raise NotImplementedError
+
+    def cancel(self, job):
+        raise NotImplementedError
+
+    def _runCommand(self, args):
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = process.communicate()
+        return process.returncode, output, error
+
+    def _options(self):
+        return shlex.split(self.submitOptions) if self.submitOptions else []
+
+
+""" SGEExecutor class.
+    Sun/Univa grid engine backend (qsub job arrays, qstat, qdel)
+"""
+class SGEExecutor(BatchExecutor):
+    def _submit(self, arrayScript, nTasks, name, arrayDirectory, workingDirectory, holdJobIds):
+        # the job scripts need bash, whatever the queue shell is
+        args = ["qsub", "-terse", "-V", "-S", "/bin/bash", "-wd", workingDirectory, "-N", name.replace(" ", "_"), "-o", arrayDirectory, "-e", arrayDirectory, "-t", "1-{0}".format(nTasks)]
+        if holdJobIds:
+            args.extend(["-hold_jid", ",".join([str(jobId) for jobId in holdJobIds])])
+        args.extend(self._options())
+        args.append(arrayScript)
+
+        status, output, error = self._runCommand(args)
+        if status:
+            raise RuntimeError("SGEExecutor: qsub failed with status {0} : {1}".format(status, error.strip()))
+        # array job output : <jobId>.1-N:1
+        return output.strip().split(".")[0]
+
+    def _jobAlive(self, job):
+        status, output, error = self._runCommand(["qstat", "-j", str(job.jobId)])
+        return status == 0
+
+    def cancel(self, job):
+        self._runCommand(["qdel", str(job.jobId), "-t", str(job.task+1)])
+
+
+""" HTCondorExecutor class.
+    HTCondor backend (condor_submit clusters, condor_q, condor_rm).
+    HTCondor has no job dependencies without DAGMan, the hold job ids are ignored
+"""
+class HTCondorExecutor(BatchExecutor):
+    def _submit(self, arrayScript, nTasks, name, arrayDirectory, workingDirectory, holdJobIds):
+        if holdJobIds:
+            self._logger.warning("HTCondorExecutor: job dependencies are not supported, hold job ids {0} ignored".format(holdJobIds))
+
+        submitFile = os.path.join(arrayDirectory, "array.sub")
+        with open(submitFile, "w") as f:
+            f.write("universe = vanilla\n")
+            f.write("executable = /bin/bash\n")
+            f.write("arguments = {0} $(Process)\n".format(arrayScript))
+            f.write("getenv = True\n")
+            f.write("initialdir = {0}\n".format(workingDirectory))
+            f.write("output = {0}/task$(Process).out\n".format(arrayDirectory))
+            f.write("error = {0}/task$(Process).err\n".format(arrayDirectory))
+            f.write("log = {0}/array.log\n".format(arrayDirectory))
+            f.write("batch_name = {0}\n".format(name.replace(" ", "_")))
+            for option in self.submitOptions.split(";"):
+                if option.strip():
+                    f.write(option.strip() + "\n")
+            f.write("queue {0}\n".format(nTasks))
+
+        status, output, error = self._runCommand(["condor_submit", "-terse", submitFile])
+        if status:
+            raise RuntimeError("HTCondorExecutor: condor_submit failed with status {0} : {1}".format(status, error.strip()))
+        # terse output : <cluster>.0 - <cluster>.<N-1>
+        return output.strip().split(".")[0]
+
+    def _jobAlive(self, job):
+        status, output, error = self._runCommand(["condor_q", "{0}.{1}".format(job.jobId, job.task), "-af", "JobStatus"])
+        return status != 0 or bool(output.strip())
+
+    def cancel(self, job):
+        self._runCommand(["condor_rm", "{0}.{1}".format(job.jobId, job.task)])
+
+
+""" FakeBatchExecutor class.
+    Local fake batch scheduler : the job scripts are run in background processes
+    on this node, the job arrays wait for their hold jobs. For tests of the batch path
+"""
+class FakeBatchExecutor(BatchExecutor):
+    pollInterval = 0.2
+    aliveCheckPolls = 5
+
+    _jobIdLock = threading.Lock()
+    _nextJobId = 1
+    # the task processes by job id, the job ids with all tasks started and the cancelled (job id, task)
+    _processes = {}
+    _started = set()
+    _cancelled = set()
+
+    def _submit(self, arrayScript, nTasks, name, arrayDirectory, workingDirectory, holdJobIds):
+        with FakeBatchExecutor._jobIdLock:
+            jobId = str(FakeBatchExecutor._nextJobId)
+            FakeBatchExecutor._nextJobId = FakeBatchExecutor._nextJobId + 1
+            FakeBatchExecutor._processes[jobId] = {}
+
+        holdJobIds = [str(holdJobId) for holdJobId in holdJobIds] if holdJobIds else []
+        thread = threading.Thread(target=self._runArray, args=(jobId, arrayScript, nTasks, arrayDirectory, workingDirectory, holdJobIds))
+        thread.daemon = True
+        thread.start()
+        return jobId
+
+    def _runArray(self, jobId, arrayScript, nTasks, arrayDirectory, workingDirectory, holdJobIds):
+        # wait for the hold jobs to end
+        while [holdJobId for holdJobId in holdJobIds if self._arrayRunning(holdJobId)]:
+            time.sleep(self.pollInterval)
+
+        for task in range(nTasks):
+            with FakeBatchExecutor._jobIdLock:
+                if (jobId, task) in FakeBatchExecutor._cancelled:
+                    continue
+                # each task in its own process group, cancelled as a whole
+                with open(os.path.join(arrayDirectory, "task{0}.out".format(task)), "w") as output:
+                    process = subprocess.Popen(["/bin/bash", arrayScript, str(task)], cwd=workingDirectory, stdout=output, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+                FakeBatchExecutor._processes[jobId][task] = process
+
+        with FakeBatchExecutor._jobIdLock:
+            FakeBatchExecutor._started.add(jobId)
+
+    def _arrayRunning(self, jobId):
+        with FakeBatchExecutor._jobIdLock:
+            processes = FakeBatchExecutor._processes.get(jobId)
+            if processes is None:
+                return False
+            return jobId not in FakeBatchExecutor._started or [process for process in processes.values() if process.poll() is None]
+
+    def _jobAlive(self, job):
+        with FakeBatchExecutor._jobIdLock:
+            if (job.jobId, job.task) in FakeBatchExecutor._cancelled:
+                return False
+            process = FakeBatchExecutor._processes.get(job.jobId, {}).get(job.task)
+        return process is None or process.poll() is None
+
+    def cancel(self, job):
+        with FakeBatchExecutor._jobIdLock:
+            FakeBatchExecutor._cancelled.add((job.jobId, job.task))
+            process = FakeBatchExecutor._processes.get(job.jobId, {}).get(job.task)
+        if process is not None and process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+executors = {"local" : ChildWatcher, "sge" : SGEExecutor, "condor" : HTCondorExecutor, "fake" : FakeBatchExecutor}
+
+_defaultExecutor = "local"
+
+""" Set the executor created by default (see createExecutor)
+"""
+def setDefaultExecutor(name):
+    global _defaultExecutor
+    if name not in executors:
+        raise KeyError("Unknown executor '{0}'. Options are : {1}".format(name, ", ".join(sorted(executors.keys()))))
+    _defaultExecutor = name
+
+""" Create an executor by name (default executor if None)
+"""
+def createExecutor(name=None):
+    name = name if name is not None else _defaultExecutor
+    if name not in executors:
+        raise KeyError("Unknown executor '{0}'. Options are : {1}".format(name, ", ".join(sorted(executors.keys()))))
+    return executors[name]()
+
+""" Run a single process with the default executor and wait for it. Returns a ProcessResult.
+    Locally, the process waits for admission if a workload name is given (see runProcess)
+"""
+def runJob(args, name=None, outputs=None, workload=None):
+    executor = createExecutor()
+    if executor.usesLocalResources():
+        return runProcess(args, name, outputs, workload)
+    name = name if name is not None else os.path.basename(args[0])
+    executor.start(args, 0, None, name)
+    key, status, wallTime, rusage = executor.wait()
+    return ProcessResult(name, status, wallTime, list(outputs) if outputs else [])
+
+
+
+#
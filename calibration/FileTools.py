@@ -1,5 +1,7 @@
 import linecache
 import os
+import subprocess
+from calibration.ProcessTools import runProcess
 
 def getFileContent(fname, lid, tokenid) :
     line = linecache.getline(fname, lid)
@@ -13,6 +15,18 @@ def removeFile(fname):
     except OSError:
         pass
 
+def getNumberOfEvents(lcioFile):
+    output = subprocess.check_output(["lcio_event_counter", lcioFile])
+    for token in reversed(output.split()):
+        if token.isdigit():
+            return int(token)
+    raise RuntimeError("Couldn't get the number of events in file {0}".format(lcioFile))
+
+def mergeRootFiles(outputFile, inputFiles):
+    args = ["hadd", "-f", outputFile] + list(inputFiles)
+    if runProcess(args).status :
+        raise RuntimeError("Couldn't merge root files into {0}".format(outputFile))
+
 def getHcalBarrelMip(calibFile) :
     return float(getFileContent(calibFile, 7, 5))
 
@@ -0,0 +1,157 @@
+#
+
+""" Content addressed cache of the gear files converted from the DD4hep compact files.
+    The cache key is the digest of the conversion plugin name, of the software
+    environment (lcgeo and DD4hep installations, convertToGear binary), of the compact
+    file and of all the xml files it includes (recursively). Two detector variants with
+    the same compact file name get different gear files, a modified compact file
+    or a software release change triggers a new conversion. The conversion is done
+    under a file lock and the gear file is published with an atomic rename, so
+    concurrent jobs sharing the cache directory convert each compact file only once.
+"""
+
+import os
+import re
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+from distutils.spawn import find_executable
+from calibration.ProcessTools import runProcess
+from calibration.Trace import Tracer
+
+
+class GearCache(object):
+    # the default cache directory, shared by all the calibration campaigns of the user
+    defaultCacheDirectory = os.environ.get("LCCALIBRATION_GEAR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "lccalibration", "gear"))
+
+    # the environment variables defining the software release used for the conversion
+    environmentVariables = ["lcgeo_DIR", "DD4hepINSTALL"]
+
+    _includePattern = re.compile(r"""<include\s+ref\s*=\s*["']([^"']+)["']""")
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    """ Get the shared gear cache (default cache directory if not configured)
+    """
+    @classmethod
+    def instance(cls):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls(cls.defaultCacheDirectory)
+            return cls._instance
+
+    """ Configure the shared gear cache directory (None for the default one)
+    """
+    @classmethod
+    def configure(cls, cacheDirectory=None):
+        with cls._instanceLock:
+            cls._instance = cls(cacheDirectory if cacheDirectory else cls.defaultCacheDirectory)
+            return cls._instance
+
+    def __init__(self, cacheDirectory):
+        self._cacheDirectory = os.path.abspath(cacheDirectory)
+        self._logger = logging.getLogger("gearCache")
+
+        if not os.path.isdir(self._cacheDirectory):
+            try:
+                os.makedirs(self._cacheDirectory)
+            except OSError:
+                # created by a concurrent job
+                if not os.path.isdir(self._cacheDirectory):
+                    raise
+
+    def cacheDirectory(self):
+        return self._cacheDirectory
+
+    """ Get the xml files included by a compact file, recursively (compact file first)
+    """
+    def _getCompactFiles(self, compactFile):
+        compactFiles = []
+        pending = [os.path.abspath(compactFile)]
+
+        while pending:
+            fileName = pending.pop(0)
+            if fileName in compactFiles:
+                continue
+            compactFiles.append(fileName)
+
+            with open(fileName) as f:
+                content = f.read()
+
+            for ref in self._includePattern.findall(content):
+                if not ref.endswith(".xml"):
+                    continue
+                include = ref if os.path.isabs(ref) else os.path.join(os.path.dirname(fileName), ref)
+                if not os.path.isfile(include) and os.path.isfile(ref):
+                    include = ref
+                if os.path.isfile(include):
+                    pending.append(os.path.abspath(include))
+
+        return compactFiles
+
+    """ Compute the cache key of a compact file conversion
+    """
+    def computeKey(self, compactFile, plugin):
+        sha = hashlib.sha1()
+        sha.update(plugin.encode())
+        sha.update(self._environmentDigest().encode())
+
+        for fileName in self._getCompactFiles(compactFile):
+            with open(fileName, "rb") as f:
+                sha.update(hashlib.sha1(f.read()).hexdigest().encode())
+
+        return sha.hexdigest()
+
+    """ Get the gear file of a compact file, converted with the 'convertToGear' binary if not cached.
+        If force is True, the compact file is converted again
+    """
+    def gearFile(self, compactFile, plugin="default", force=False):
+        key = self.computeKey(compactFile, plugin)
+        gearFile = os.path.join(self._cacheDirectory, "gear_{0}_{1}".format(key, os.path.basename(compactFile)))
+
+        if os.path.isfile(gearFile) and not force:
+            return gearFile
+
+        with open(gearFile + ".lock", "a") as lockFile:
+            fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+            try:
+                # converted by a concurrent job while waiting for the lock
+                if os.path.isfile(gearFile) and not force:
+                    return gearFile
+                self._convert(compactFile, plugin, gearFile)
+            finally:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+
+        return gearFile
+
+    def _environmentDigest(self):
+        environment = ["{0}={1}".format(variable, os.environ.get(variable, "")) for variable in self.environmentVariables]
+        convertToGear = find_executable("convertToGear")
+        if convertToGear:
+            environment.append("convertToGear={0}".format(os.path.realpath(convertToGear)))
+        return "\n".join(environment)
+
+    def _convert(self, compactFile, plugin, gearFile):
+        fhandle, tmpGearFile = tempfile.mkstemp(prefix=".tmp_gear_", suffix=".xml", dir=self._cacheDirectory)
+        os.close(fhandle)
+
+        try:
+            args = ['convertToGear', plugin, compactFile, tmpGearFile]
+            with Tracer.instance().span("convertToGear", "gear", {"compactFile" : compactFile, "plugin" : plugin}):
+                status = runProcess(args).status
+            if status :
+                raise RuntimeError("Couldn't convert compact file {0} to gear file".format(compactFile))
+            os.rename(tmpGearFile, gearFile)
+        except:
+            if os.path.isfile(tmpGearFile):
+                os.remove(tmpGearFile)
+            raise
+
+        self._logger.info("Converted {0} to {1}".format(compactFile, gearFile))
+
+
+
+#
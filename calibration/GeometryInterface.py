@@ -1,83 +1,162 @@
 
-
 from math import *
 import os
+import json
+import tempfile
+import logging
 from calibration.XmlTools import *
-import subprocess
+from calibration.GearCache import GearCache
+from calibration.CompactReader import CompactReader
 
+""" GeometryInterface class.
+    The geometry queries are answered from a small summary of the gear file
+    (dimensions and layer sums of each detector, from which the cos theta ranges
+    and geometry factors are derived), computed once per detector and stored as
+    a json file next to the gear file in the gear cache, keyed on the compact file
+    digest. The gear file is only converted and parsed when the summary doesn't exist yet.
+    With the "compact" backend, the summary is read from the compact file directly
+    (see CompactReader), without running convertToGear.
+"""
 class GeometryInterface(object) :
+    # the version of the summary format. Increase when changing the summary content
+    summaryVersion = 1
+    # the summary backends : gear conversion or compact file reader
+    gearBackend = "gear"
+    compactBackend = "compact"
+    backends = [gearBackend, compactBackend]
+    backend = gearBackend
+
     def __init__(self, compactFile):
         self._compactFile = compactFile
-        self._gearFile = self._convertToGear(self._compactFile)
-        parser = createXMLParser()
-        self._xmlTree = etree.parse(self._gearFile, parser)
-    
-    """ Convert the compact file to gear file using 'convertToGear' binary
+        self._logger = logging.getLogger("geometry")
+        self._gearFile = None
+        self._xmlTree = None
+        self._summary = self._loadSummary()
+
+    """ Convert the compact file to gear file using 'convertToGear' binary (see GearCache)
     """
     def _convertToGear(self, compactFile, force=False) :
-        gearFile = "gear_" + os.path.split(compactFile)[1]
+        return GearCache.instance().gearFile(compactFile, 'default', force)
+
+    """ Load the gear file (converted if needed). Only required by getDetectorDimmensions
+        and by the summary computation
+    """
+    def _loadGearFile(self) :
+        if self._xmlTree is None :
+            self._gearFile = self._convertToGear(self._compactFile)
+            parser = createXMLParser()
+            self._xmlTree = etree.parse(self._gearFile, parser)
+        return self._xmlTree
+
+    def _summaryFile(self) :
+        gearCache = GearCache.instance()
+        key = gearCache.computeKey(self._compactFile, 'default')
+        return os.path.join(gearCache.cacheDirectory(), "geometry_v{0}_{1}_{2}.json".format(self.summaryVersion, self.backend, key))
+
+    """ Load the geometry summary from the cache, compute and store it if not found
+    """
+    def _loadSummary(self) :
+        summaryFile = self._summaryFile()
+        if os.path.isfile(summaryFile) :
+            with open(summaryFile) as f :
+                return json.load(f)
+
+        summary = self._computeSummary()
+        fhandle, tmpFile = tempfile.mkstemp(prefix=".tmp_geometry_", dir=os.path.dirname(summaryFile))
+        try :
+            with os.fdopen(fhandle, "w") as f :
+                json.dump(summary, f, indent=1, sort_keys=True)
+            os.rename(tmpFile, summaryFile)
+        except :
+            os.remove(tmpFile)
+            raise
+        self._logger.info("Geometry summary written in {0}".format(summaryFile))
+        return summary
+
+    def _detectorKey(self, dname, dtype) :
+        return "{0}/{1}".format(dname, dtype)
+
+    """ Compute the geometry summary with the configured backend
+    """
+    def _computeSummary(self) :
+        if self.backend == GeometryInterface.compactBackend :
+            return CompactReader(self._compactFile).summary()
+        if self.backend != GeometryInterface.gearBackend :
+            raise RuntimeError("GeometryInterface: unknown backend '{0}'".format(self.backend))
+        return self._computeGearSummary()
+
+    """ Compute the geometry summary from the gear file
+    """
+    def _computeGearSummary(self) :
+        xmlTree = self._loadGearFile()
+        detectors = {}
+
+        for detector in xmlTree.xpath("//gear/detectors/detector") :
+            dimensions = detector.find("dimensions")
+            if dimensions is None :
+                continue
+            layers = [(int(l.get("repeat")), float(l.get("thickness")), l.get("absorberThickness")) for l in detector.findall("layer")]
+            layerThickness = sum([repeat*thickness for repeat, thickness, absorberThickness in layers])
+            summary = {}
+
+            for name in ("inner_r", "inner_z") :
+                value = dimensions.get(name)
+                summary[name] = float(value) if value is not None else None
+
+            # the outer dimensions are the inner dimensions plus the layers if not set
+            for outerName, innerName in (("outer_r", "inner_r"), ("outer_z", "inner_z")) :
+                value = dimensions.get(outerName)
+                if value is not None :
+                    summary[outerName] = float(value)
+                elif summary[innerName] is not None :
+                    summary[outerName] = summary[innerName] + layerThickness
+                else :
+                    summary[outerName] = None
+
+            if layers and None not in [absorberThickness for repeat, thickness, absorberThickness in layers] :
+                summary["absorberSum"] = sum([repeat*float(absorberThickness) for repeat, thickness, absorberThickness in layers])
+                summary["sensitiveSum"] = sum([repeat*(thickness - float(absorberThickness)) for repeat, thickness, absorberThickness in layers])
+            else :
+                summary["absorberSum"] = None
+                summary["sensitiveSum"] = None
+
+            detectors.setdefault(self._detectorKey(detector.get("name"), detector.get("geartype")), summary)
 
-        if os.path.isfile(gearFile) and not force:
-            return gearFile
+        return {"compactFile" : os.path.abspath(self._compactFile), "detectors" : detectors}
+
+    def _getDetectorSummary(self, dname, dtype) :
+        return self._summary["detectors"].get(self._detectorKey(dname, dtype))
 
-        args = ['convertToGear', 'default', compactFile, gearFile]
-        process = subprocess.Popen(args = args)
-        if process.wait() :
-            raise RuntimeError("Couldn't convert compact file to gear file")
-        return gearFile
-    
     def _getGearDetector(self, dname, dtype) :
-        elements = self._xmlTree.xpath("//gear/detectors/detector[@name='{0}'][@geartype='{1}']".format(dname, dtype))
-        return None if not len(elements) else elements[0] 
-    
+        elements = self._loadGearFile().xpath("//gear/detectors/detector[@name='{0}'][@geartype='{1}']".format(dname, dtype))
+        return None if not len(elements) else elements[0]
+
     def getDetectorDimmensions(self, dname, dtype) :
         detector = self._getGearDetector(dname, dtype)
         if detector is not None :
             return detector.find("dimensions")
         return None
-    
+
     def getDetectorInnerR(self, dname, dtype) :
-        dimensions = self.getDetectorDimmensions(dname, dtype)
-        if dimensions is not None :
-            return dimensions.get("inner_r")
-    
+        detector = self._getDetectorSummary(dname, dtype)
+        if detector is not None :
+            return detector["inner_r"]
+
     def getDetectorOuterR(self, dname, dtype) :
-        dimensions = self.getDetectorDimmensions(dname, dtype)
-        if dimensions is not None :
-            outerR = dimensions.get("outer_r")
-            if outerR is not None :
-                return float(outerR)
-            else :
-                innerR = float(self.getDetectorInnerR(dname, dtype))
-                layers = dimensions.getparent().findall("layer")
-                outerR = innerR
-                for l in layers :
-                    repeat = int(l.get("repeat"))
-                    thickness = float(l.get("thickness"))
-                    outerR = outerR + repeat*thickness
-                return outerR
+        detector = self._getDetectorSummary(dname, dtype)
+        if detector is not None :
+            return detector["outer_r"]
         return None
-    
+
     def getDetectorInnerZ(self, dname, dtype) :
-        dimensions = self.getDetectorDimmensions(dname, dtype)
-        if dimensions is not None :
-            return dimensions.get("inner_z")
-        
+        detector = self._getDetectorSummary(dname, dtype)
+        if detector is not None :
+            return detector["inner_z"]
+
     def getDetectorOuterZ(self, dname, dtype) :
-        dimensions = self.getDetectorDimmensions(dname, dtype)
-        if dimensions is not None :
-            outerZ = dimensions.get("outer_z")
-            if outerZ is not None :
-                return float(outerZ)
-            else :
-                innerZ = float(self.getDetectorInnerZ(dname, dtype))
-                layers = dimensions.getparent().findall("layer")
-                outerZ = innerZ
-                for l in layers :
-                    repeat = int(l.get("repeat"))
-                    thickness = float(l.get("thickness"))
-                    outerZ = outerZ + repeat*thickness
-                return outerZ
+        detector = self._getDetectorSummary(dname, dtype)
+        if detector is not None :
+            return detector["outer_z"]
         return None
 
     def getEcalBarrelCosThetaRange(self) :
@@ -85,7 +164,7 @@ class GeometryInterface(object) :
         ecalBarrelOuterZ = float(self.getDetectorOuterZ("EcalBarrel", "CalorimeterParameters"))
         maxCosTheta = cos(atan( ecalBarrelOuterR / ecalBarrelOuterZ ))
         return 0.05, maxCosTheta
-    
+
     def getEcalEndcapCosThetaRange(self) :
         ecalEndcapOuterR = float(self.getDetectorOuterR("EcalEndcap", "CalorimeterParameters"))
         ecalEndcapOuterZ = float(self.getDetectorOuterZ("EcalEndcap", "CalorimeterParameters"))
@@ -109,52 +188,28 @@ class GeometryInterface(object) :
         minCosTheta = cos(atan( hcalEndcapOuterR / hcalEndcapOuterZ ))
         maxCosTheta = cos(atan( hcalEndcapInnerR / hcalEndcapInnerZ ))
         return minCosTheta, maxCosTheta
-    
+
     """ Calculates and returns the following factor :
         f = (Abs_endcap / Abs_ring) * (Sens_ring / Sens_endcap)
     """
     def getCalorimeterGeometryFactor(self, endcapName, ringName):
-        endcapDetector = self._getGearDetector(endcapName, "CalorimeterParameters")
-        plugDetector = self._getGearDetector(ringName, "CalorimeterParameters")
-        endcapAbsorberSum = 0
-        endcapSensitiveSum = 0
-        plugAbsorberSum = 0
-        plugSensitiveSum = 0
-        endcapLayers = endcapDetector.findall("layer")
-        plugLayers = plugDetector.findall("layer")
-        
-        if not len(plugLayers) or not len(endcapLayers):
+        endcapDetector = self._getDetectorSummary(endcapName, "CalorimeterParameters")
+        plugDetector = self._getDetectorSummary(ringName, "CalorimeterParameters")
+
+        if endcapDetector is None or plugDetector is None or endcapDetector["absorberSum"] is None or plugDetector["absorberSum"] is None:
             raise RuntimeError("Couldn't evaluate geometry factory ! Layer list is empty")
-            
-        for layer in endcapLayers:
-            repeat = int(layer.get("repeat"))
-            absorberThickness = float(layer.get("absorberThickness"))
-            thickness = float(layer.get("thickness"))
-            senitiveThickness = thickness - absorberThickness
-            endcapAbsorberSum = endcapAbsorberSum + absorberThickness*repeat
-            endcapSensitiveSum = endcapSensitiveSum + senitiveThickness*repeat
-            
-        for layer in plugLayers:
-            repeat = int(layer.get("repeat"))
-            absorberThickness = float(layer.get("absorberThickness"))
-            thickness = float(layer.get("thickness"))
-            senitiveThickness = thickness - absorberThickness
-            plugAbsorberSum = plugAbsorberSum + absorberThickness*repeat
-            plugSensitiveSum = plugSensitiveSum + senitiveThickness*repeat
-            
-        return (endcapAbsorberSum / plugAbsorberSum) * (plugSensitiveSum / endcapSensitiveSum) 
-        
-        
+
+        return (endcapDetector["absorberSum"] / plugDetector["absorberSum"]) * (plugDetector["sensitiveSum"] / endcapDetector["sensitiveSum"])
+
+
     """ Calculates and returns the following factor in the ecal
         f = (Abs_endcap / Abs_ring) * (Sens_ring / Sens_endcap)
     """
     def getEcalGeometryFactor(self):
         return self.getCalorimeterGeometryFactor("EcalEndcap", "EcalPlug")
-    
+
     """ Calculates and returns the following factor in the hcal
         f = (Abs_endcap / Abs_ring) * (Sens_ring / Sens_endcap)
     """
     def getHcalGeometryFactor(self):
         return self.getCalorimeterGeometryFactor("HcalEndcap", "HcalRing")
-        
-#
\ No newline at end of file
@@ -1,16 +1,21 @@
 
 
 from calibration.CalibrationStep import CalibrationStep
+from calibration.StepMetadata import hcalEnergyMetadata
 from calibration.Marlin import Marlin
 from calibration.PandoraAnalysis import *
 from calibration.FileTools import *
+from calibration.PfoAnalysisEngine import nativeEngineAvailable
+from calibration.RescaleSurrogate import SurrogateIterations
 import os, sys
 from calibration.XmlTools import etree
 
 
 class HcalEnergyStep(CalibrationStep) :
+    metadata = hcalEnergyMetadata
+
     def __init__(self) :
-        CalibrationStep.__init__(self, "HcalEnergy")
+        CalibrationStep.__init__(self)
         self._marlin = None
 
         self._maxNIterations = 5
@@ -29,13 +34,7 @@ class HcalEnergyStep(CalibrationStep) :
         self._outputHcalRingFactors = None
         
         self._runRingCalibration = True
-
-        # command line requirement
-        self._requireSteeringFile()
-        self._requireCompactFile()
-        self._requireIterations()
-        self._requireKaon0LFile()
-        self._requireHCalAccuracy()
+        self._useSurrogate = False
     
     """ Whether to run the hcal ring calibration
     """
@@ -67,9 +66,6 @@ class HcalEnergyStep(CalibrationStep) :
     def setEnergyFactors(self, barrelFactors, endcapFactors):
         pass
         
-    def description(self):
-        return "Calculate the constants related to the energy deposit in a hcal cell (unit GeV). Outputs the hcalBarrelFactor, hcalEndcapFactor and hcalRingFactor values"
-
     def readCmdLine(self, parsed) :
         # setup marlin
         self._marlin = Marlin(parsed.steeringFile)
@@ -78,6 +74,10 @@ class HcalEnergyStep(CalibrationStep) :
         self._marlin.setCompactFile(parsed.compactFile)
         self._marlin.setMaxRecordNumber(int(parsed.maxRecordNumber))
         self._marlin.setInputFiles(self._extractFileList(parsed.lcioKaon0LFile, "slcio"))
+        self._configureMarlin(parsed)
+
+        if parsed.rescaleStrategy:
+            self.setRescaleStrategy(parsed.rescaleStrategy)
 
         self._maxNIterations = int(parsed.maxNIterations)
         self._energyScaleAccuracy = float(parsed.hcalCalibrationAccuracy)
@@ -89,6 +89,10 @@ class HcalEnergyStep(CalibrationStep) :
         self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap = self._getGeometry().getHcalEndcapCosThetaRange()
         
         self._kaon0LEnergy = parsed.kaon0LEnergy
+        self._useSurrogate = parsed.surrogateIterations
+
+        if self._useSurrogate and not nativeEngineAvailable():
+            raise RuntimeError("{0}: surrogate iterations require numpy and uproot".format(self._name))
 
     def init(self, config) :    
         self._cleanupElement(config)
@@ -118,10 +122,45 @@ class HcalEnergyStep(CalibrationStep) :
 
         pfoAnalysisFile = ""
         
-        hcalEnergyCalibrator = HcalCalibrator()
-        hcalEnergyCalibrator.setKaon0LEnergy(self._kaon0LEnergy)
+        barrelCalibrator = HcalCalibrator()
+        barrelCalibrator.setKaon0LEnergy(self._kaon0LEnergy)
+        barrelCalibrator.setDetectorRegion("Barrel")
+        barrelCalibrator.setCosThetaRange(self._inputMinCosThetaBarrel, self._inputMaxCosThetaBarrel)
+
+        endcapCalibrator = HcalCalibrator()
+        endcapCalibrator.setKaon0LEnergy(self._kaon0LEnergy)
+        endcapCalibrator.setDetectorRegion("EndCap")
+        endcapCalibrator.setCosThetaRange(self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap)
+
+        barrelRescale = self._createRescaleStrategy(self._kaon0LEnergy)
+        endcapRescale = self._createRescaleStrategy(self._kaon0LEnergy)
+
+        surrogate = SurrogateIterations("HCal", self._kaon0LEnergy, self._energyScaleAccuracy,
+            {"Barrel" : (self._inputMinCosThetaBarrel, self._inputMaxCosThetaBarrel),
+             "EndCap" : (self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap)}, self._useSurrogate)
+
+        firstIteration = 0
+        state = self._restoreIteration(config)
+
+        if state is not None:
+            firstIteration = state["iteration"] + 1
+            hcalBarrelFactors, hcalEndcapFactors = state["barrelFactors"], state["endcapFactors"]
+            barrelRescaleFactor, endcapRescaleFactor = state["barrelRescale"], state["endcapRescale"]
+            barrelRescaleFactorCumul, endcapRescaleFactorCumul = state["barrelRescaleCumul"], state["endcapRescaleCumul"]
+            barrelCurrentPrecision, endcapCurrentPrecision = state["barrelPrecision"], state["endcapPrecision"]
+            barrelAccuracyReached, endcapAccuracyReached = state["barrelAccuracyReached"], state["endcapAccuracyReached"]
+            newBarrelKaon0LEnergy, newEndcapKaon0LEnergy = state["newBarrelEnergy"], state["newEndcapEnergy"]
+            pfoAnalysisFile = state["pfoAnalysisFile"]
+            barrelRescale.setHistory(state["barrelHistory"])
+            endcapRescale.setHistory(state["endcapHistory"])
+            surrogate.setState(state.get("surrogate"))
+
+            if barrelAccuracyReached:
+                self._outputHcalBarrelFactors = hcalBarrelFactors
+            if endcapAccuracyReached:
+                self._outputHcalEndcapFactors = hcalEndcapFactors
 
-        for iteration in range(self._maxNIterations) :
+        for iteration in range(firstIteration, self._maxNIterations) :
 
             # readjust iteration parameters
             if not barrelAccuracyReached:
@@ -132,7 +171,7 @@ class HcalEnergyStep(CalibrationStep) :
                 for index in range(len(hcalEndcapFactors)):
                     hcalEndcapFactors[index] = hcalEndcapFactors[index]*endcapRescaleFactor
 
-            pfoAnalysisFile = "./PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration)
+            pfoAnalysisFile = self._workspacePath("PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration), iteration)
 
             # run marlin ...
             self.setEnergyFactors(hcalBarrelFactors, hcalEndcapFactors)
@@ -140,29 +179,44 @@ class HcalEnergyStep(CalibrationStep) :
             self._marlin.setProcessorParameter("MyPfoAnalysis"   , "RootFile", pfoAnalysisFile)
             self._marlin.run()
 
-            # run calibration for barrel
+            # run the barrel and endcap calibrations concurrently
+            calibrators = []
+            if not barrelAccuracyReached:
+                barrelCalibrator.setRootFile(pfoAnalysisFile)
+                calibrators.append(barrelCalibrator)
+            if not endcapAccuracyReached:
+                endcapCalibrator.setRootFile(pfoAnalysisFile)
+                calibrators.append(endcapCalibrator)
+            runCalibrators(calibrators)
+
             if not barrelAccuracyReached:
-                hcalEnergyCalibrator.setRootFile(pfoAnalysisFile)
-                hcalEnergyCalibrator.setDetectorRegion("Barrel")
-                hcalEnergyCalibrator.setCosThetaRange(self._inputMinCosThetaBarrel, self._inputMaxCosThetaBarrel)
-                hcalEnergyCalibrator.run()
-                
-                newBarrelKaon0LEnergy = hcalEnergyCalibrator.getHcalDigiMean()
-                barrelRescaleFactor = float(self._kaon0LEnergy) / newBarrelKaon0LEnergy
+                newBarrelKaon0LEnergy = barrelCalibrator.getHcalDigiMean()
+                barrelRescaleFactor = barrelRescale.rescaleFactor(barrelRescaleFactorCumul, newBarrelKaon0LEnergy)
                 barrelRescaleFactorCumul = barrelRescaleFactorCumul*barrelRescaleFactor
-                barrelCurrentPrecision = abs(1 - 1. / barrelRescaleFactor)                
+                barrelCurrentPrecision = abs(1 - newBarrelKaon0LEnergy / float(self._kaon0LEnergy))                
 
-            # run calibration for endcap
             if not endcapAccuracyReached:
-                hcalEnergyCalibrator.setRootFile(pfoAnalysisFile)
-                hcalEnergyCalibrator.setDetectorRegion("EndCap")
-                hcalEnergyCalibrator.setCosThetaRange(self._inputMinCosThetaEndcap, self._inputMaxCosThetaEndcap)
-                hcalEnergyCalibrator.run()
-                
-                newEndcapKaon0LEnergy = hcalEnergyCalibrator.getHcalDigiMean()
-                endcapRescaleFactor = float(self._kaon0LEnergy) / newEndcapKaon0LEnergy
+                newEndcapKaon0LEnergy = endcapCalibrator.getHcalDigiMean()
+                endcapRescaleFactor = endcapRescale.rescaleFactor(endcapRescaleFactorCumul, newEndcapKaon0LEnergy)
                 endcapRescaleFactorCumul = endcapRescaleFactorCumul*endcapRescaleFactor
-                endcapCurrentPrecision = abs(1 - 1. / endcapRescaleFactor)
+                endcapCurrentPrecision = abs(1 - newEndcapKaon0LEnergy / float(self._kaon0LEnergy))
+
+            # predict the next factors by reweighting this reconstruction,
+            # as long as the marlin iterations confirm the predictions
+            measuredEnergies = {}
+            if not barrelAccuracyReached:
+                measuredEnergies["Barrel"] = newBarrelKaon0LEnergy
+            if not endcapAccuracyReached:
+                measuredEnergies["EndCap"] = newEndcapKaon0LEnergy
+            surrogateFactors = surrogate.rescaleFactors(pfoAnalysisFile, measuredEnergies)
+
+            if "Barrel" in surrogateFactors:
+                barrelRescaleFactorCumul = barrelRescaleFactorCumul / barrelRescaleFactor * surrogateFactors["Barrel"]
+                barrelRescaleFactor = surrogateFactors["Barrel"]
+
+            if "EndCap" in surrogateFactors:
+                endcapRescaleFactorCumul = endcapRescaleFactorCumul / endcapRescaleFactor * surrogateFactors["EndCap"]
+                endcapRescaleFactor = surrogateFactors["EndCap"]
 
             self._logger.info("=============================================")
             self._logger.info("======= Barrel output for iteration {0} =======".format(iteration))
@@ -205,6 +259,24 @@ class HcalEnergyStep(CalibrationStep) :
             if barrelAccuracyReached and endcapAccuracyReached :
                 break
 
+            self._checkpointIteration(iteration,
+                {"barrelFactors" : hcalBarrelFactors,
+                 "endcapFactors" : hcalEndcapFactors,
+                 "barrelRescale" : barrelRescaleFactor,
+                 "endcapRescale" : endcapRescaleFactor,
+                 "barrelRescaleCumul" : barrelRescaleFactorCumul,
+                 "endcapRescaleCumul" : endcapRescaleFactorCumul,
+                 "barrelPrecision" : barrelCurrentPrecision,
+                 "endcapPrecision" : endcapCurrentPrecision,
+                 "barrelAccuracyReached" : barrelAccuracyReached,
+                 "endcapAccuracyReached" : endcapAccuracyReached,
+                 "newBarrelEnergy" : newBarrelKaon0LEnergy,
+                 "newEndcapEnergy" : newEndcapKaon0LEnergy,
+                 "pfoAnalysisFile" : pfoAnalysisFile,
+                 "barrelHistory" : barrelRescale.history(),
+                 "endcapHistory" : endcapRescale.history(),
+                 "surrogate" : surrogate.state()})
+
         if not barrelAccuracyReached or not endcapAccuracyReached :
             raise RuntimeError("{0}: Couldn't reach the user accuracy ({1})".format(self._name, self._energyScaleAccuracy))
 
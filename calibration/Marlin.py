@@ -5,16 +5,31 @@ from calibration.XmlTools import etree
 import logging
 import tempfile
 from calibration.MarlinXML import MarlinXML
-import time
+from calibration.FileTools import getNumberOfEvents, mergeRootFiles, removeFile
+from calibration.ProcessTools import ProcessResult
+from calibration.Executors import createExecutor, runJob
+from calibration.AdmissionControl import AdmissionController
+import math
 
 """ Marlin class.
 """
 class Marlin(object) :
+    # pass the modified parameters on the marlin command line instead of writing a steering file per run
+    useCommandLineOverrides = False
+
     """ Constructor
     """
     def __init__(self, steeringFile=None) :
         self._marlinXML = MarlinXML()
         self._logger = logging.getLogger("marlin")
+        self._pfoAnalysisProcessor = "MyPfoAnalysis"
+        self._maxNShards = 1
+        self._minEventsPerShard = 500
+        self._nEventsPerFile = {}
+        self._cache = None
+        self._cacheKey = None
+        self._outputFiles = []
+        self._tmpSteeringFile = None
 
         # set steering file and load it
         if steeringFile is not None :
@@ -28,13 +43,13 @@ class Marlin(object) :
 
     """ Load step output parameters
     """
-    def loadStepOutputParameters(self, xmlTree, stepName):
-        self._marlinXML.loadStepOutputParameters(xmlTree, stepName)
+    def loadStepOutputParameters(self, config, stepName):
+        self._marlinXML.loadStepOutputParameters(config, stepName)
 
     """ Load input parameters
     """
-    def loadInputParameters(self, xmlTree):
-        self._marlinXML.loadInputParameters(xmlTree)
+    def loadInputParameters(self, config):
+        self._marlinXML.loadInputParameters(config)
 
     """ Set a processor parameter.
     """
@@ -92,15 +107,221 @@ class Marlin(object) :
     def setRandomSeed(self, randomSeed) :
         self._marlinXML.setRandomSeed(randomSeed)
 
-    """ Run the marlin process using Popen function of subprocess module
+    """ Set the pfo analysis processor name, used to locate the root output file
+    """
+    def setPfoAnalysisProcessor(self, processor):
+        self._pfoAnalysisProcessor = str(processor)
+
+    """ Set the maximum number of event range shards to run concurrently.
+        With 1 (default), marlin runs in a single process
+    """
+    def setMaxNShards(self, maxNShards):
+        if maxNShards > 0 :
+            self._maxNShards = maxNShards
+
+    """ Set the minimum number of events processed by a shard.
+        Keeps the marlin startup time (geometry loading) small compared to the event processing
+    """
+    def setMinEventsPerShard(self, nEvents):
+        if nEvents > 0 :
+            self._minEventsPerShard = nEvents
+
+    """ Set the cache of the marlin outputs (see MarlinCache). None to disable
+    """
+    def setCache(self, cache):
+        self._cache = cache
+
+    """ Register an additional output file written by the reconstruction, stored in the cache.
+        The pfo analysis root file is always registered
+    """
+    def addOutputFile(self, outputFile):
+        self._outputFiles.append(str(outputFile))
+
+    """ Get the output files of the reconstruction
+    """
+    def getOutputFiles(self):
+        outputFiles = list(self._outputFiles)
+        try:
+            outputFiles.insert(0, self.getProcessorParameter(self._pfoAnalysisProcessor, "RootFile"))
+        except KeyError:
+            pass
+        return outputFiles
+
+    """ Create an independent copy of this marlin instance
+    """
+    def copy(self):
+        marlin = Marlin()
+        marlin._marlinXML = self._marlinXML.copy()
+        marlin._pfoAnalysisProcessor = self._pfoAnalysisProcessor
+        marlin._maxNShards = self._maxNShards
+        marlin._minEventsPerShard = self._minEventsPerShard
+        marlin._nEventsPerFile = self._nEventsPerFile
+        marlin._cache = self._cache
+        marlin._outputFiles = list(self._outputFiles)
+        return marlin
+
+    """ Run the marlin process using Popen function of subprocess module.
+        If sharding is enabled, the input events are split in many marlin processes
+        and the pfo analysis root outputs are merged afterwards
     """
     def run(self) :
+        if self._restoreFromCache() :
+            return
+
+        if self._maxNShards > 1 :
+            shards = self._createShards()
+            if len(shards) > 1 :
+                self._runShards(shards)
+                self._storeInCache()
+                return
+
         args = self.createProcessArgs()
         self._logger.info("Marlin command line : " + " ".join(args))
-        process = subprocess.Popen(args = args)
-        if process.wait() :
-            raise RuntimeError
+        result = runJob(args, "Marlin", self.getOutputFiles(), self.workload())
+        self.removeTmpSteeringFile()
+        if result.status :
+            raise RuntimeError("Marlin ended with status {0}".format(result.status))
         self._logger.info("Marlin ended with status 0")
+        self._storeInCache()
+
+    """ The workload name used to learn the marlin memory usage (see AdmissionControl)
+    """
+    def workload(self):
+        return "Marlin {0}".format(os.path.basename(str(self._marlinXML.getSteeringFile())))
+
+    """ Copy the outputs of an identical previous run from the cache.
+        Returns False if the cache is disabled or doesn't contain this run
+    """
+    def _restoreFromCache(self):
+        self._cacheKey = None
+        if self._cache is None :
+            return False
+        outputFiles = self.getOutputFiles()
+        self._cacheKey = self._cache.computeKey(self._marlinXML, outputFiles)
+        return self._cache.restore(self._cacheKey, outputFiles)
+
+    """ Store the outputs of the last run in the cache
+    """
+    def _storeInCache(self):
+        if self._cache is not None and self._cacheKey is not None :
+            self._cache.store(self._cacheKey, self.getOutputFiles())
+
+    """ Get a global parameter as integer (0 if not set in the steering file)
+    """
+    def _getIntGlobalParameter(self, name):
+        try:
+            value = self._marlinXML.getGlobalParameter(name)
+        except KeyError:
+            return 0
+        return int(value) if value else 0
+
+    """ Get the number of events in a lcio file. Cached, as input files don't change between iterations
+    """
+    def _getNumberOfEvents(self, lcioFile):
+        if lcioFile not in self._nEventsPerFile:
+            self._nEventsPerFile[lcioFile] = getNumberOfEvents(lcioFile)
+        return self._nEventsPerFile[lcioFile]
+
+    """ Split the lcio input in event ranges.
+        Small files are grouped together, large files are split in skip/max-record windows.
+        Returns a list of (files, skipNEvents, maxRecordNumber) tuples, one per shard.
+        MaxRecordNumber counts the run headers with the events : the record numbers assume
+        exactly one run header per lcio file (as written by ddsim), i.e one extra record per file
+        of a shard. Input files with several runs would get their last events cut
+    """
+    def _createShards(self):
+        if self._getIntGlobalParameter("SkipNEvents") > 0 :
+            self._logger.warning("SkipNEvents is set, running marlin without sharding")
+            return []
+
+        maxRecordNumber = self._getIntGlobalParameter("MaxRecordNumber")
+        fileEvents = []
+        remainingEvents = maxRecordNumber if maxRecordNumber > 0 else None
+
+        for lcioFile in self._marlinXML.getGlobalParameter("LCIOInputFiles").split():
+            nEvents = self._getNumberOfEvents(lcioFile)
+            if remainingEvents is not None :
+                nEvents = min(nEvents, remainingEvents)
+                remainingEvents = remainingEvents - nEvents
+            if nEvents > 0 :
+                fileEvents.append((lcioFile, nEvents, nEvents == self._getNumberOfEvents(lcioFile)))
+
+        totalEvents = sum([nEvents for lcioFile, nEvents, complete in fileEvents])
+        nShards = min(self._maxNShards, totalEvents // self._minEventsPerShard)
+
+        if nShards < 2 :
+            return []
+
+        eventsPerShard = int(math.ceil(float(totalEvents) / nShards))
+        shards = []
+        currentFiles = []
+        currentEvents = 0
+        currentComplete = True
+
+        # ATTN : one run header per file, see above
+        for lcioFile, nEvents, complete in fileEvents :
+            if currentFiles and currentEvents + nEvents > eventsPerShard :
+                shards.append((currentFiles, 0, 0 if currentComplete else currentEvents + len(currentFiles)))
+                currentFiles, currentEvents, currentComplete = [], 0, True
+
+            if nEvents > eventsPerShard :
+                nWindows = int(math.ceil(float(nEvents) / eventsPerShard))
+                windowSize = int(math.ceil(float(nEvents) / nWindows))
+                for window in range(nWindows) :
+                    skipNEvents = window*windowSize
+                    windowEvents = min(windowSize, nEvents - skipNEvents)
+                    shards.append(([lcioFile], skipNEvents, windowEvents + 1))
+            else :
+                currentFiles.append(lcioFile)
+                currentEvents = currentEvents + nEvents
+                currentComplete = currentComplete and complete
+
+        if currentFiles :
+            shards.append((currentFiles, 0, 0 if currentComplete else currentEvents + len(currentFiles)))
+
+        return shards
+
+    """ Run the shards concurrently and merge the pfo analysis root files
+    """
+    def _runShards(self, shards):
+        rootFile = self.getProcessorParameter(self._pfoAnalysisProcessor, "RootFile")
+        rootFileBase = rootFile[:-5] if rootFile.endswith(".root") else rootFile
+        shardRootFiles = []
+        parallelMarlin = ParallelMarlin()
+
+        if Marlin.useCommandLineOverrides :
+            # write the base steering shared by the shards, with all the shard parameters
+            self.setSkipNEvents(0)
+            self._marlinXML.writeWithOverrides()
+        parallelMarlin.setMaxNParallelInstances(min(len(shards), self._maxNShards))
+
+        for shardId, (lcioFiles, skipNEvents, maxRecordNumber) in enumerate(shards) :
+            shardRootFile = "{0}_shard{1}.root".format(rootFileBase, shardId)
+            shardRootFiles.append(shardRootFile)
+            marlin = self.copy()
+            # the shards are not split again, only the merged output is cached
+            marlin.setMaxNShards(1)
+            marlin.setCache(None)
+            marlin.setInputFiles(lcioFiles)
+            marlin.setSkipNEvents(skipNEvents)
+            marlin.setMaxRecordNumber(maxRecordNumber)
+            marlin.setProcessorParameter(self._pfoAnalysisProcessor, "RootFile", shardRootFile)
+            parallelMarlin.addMarlinInstance(marlin, "shard{0}".format(shardId))
+
+        self._logger.info("Running marlin in {0} shards".format(len(shards)))
+        parallelMarlin.setFailurePolicy(ParallelMarlin.failFast)
+        results = parallelMarlin.run()
+        failedShards = [result.name for result in results if result.status != 0]
+
+        if failedShards :
+            raise RuntimeError("Marlin shard(s) {0} failed while producing {1}".format(", ".join(failedShards), rootFile))
+
+        mergeRootFiles(rootFile, shardRootFiles)
+
+        for shardRootFile in shardRootFiles :
+            removeFile(shardRootFile)
+
+        self._logger.info("Marlin ended with status 0 ({0} shards merged in {1})".format(len(shards), rootFile))
 
     """ Convert the compact file to gear file using 'convertToGear' binary
     """
@@ -111,12 +332,25 @@ class Marlin(object) :
     """
     def createProcessArgs(self) :
         args = ['Marlin']
+        if Marlin.useCommandLineOverrides :
+            steeringFile, overrides = self._marlinXML.writeWithOverrides()
+            args.append(steeringFile)
+            args.extend(overrides)
+            return args
+
         # generate temporary steering file for running marlin
-        tmpSteeringFile = self._marlinXML.writeTmp(False)
-        print "Wrote marlin xml file in " + tmpSteeringFile
-        args.append(tmpSteeringFile)
+        self._tmpSteeringFile = self._marlinXML.writeTmp(False)
+        print "Wrote marlin xml file in " + self._tmpSteeringFile
+        args.append(self._tmpSteeringFile)
         return args
 
+    """ Remove the temporary steering file written by createProcessArgs (if any)
+    """
+    def removeTmpSteeringFile(self) :
+        if self._tmpSteeringFile is not None :
+            removeFile(self._tmpSteeringFile)
+            self._tmpSteeringFile = None
+
     """ Turn off the target list of processors
         This method removes entries in the <execute> marlin xml element
     """
@@ -140,9 +374,16 @@ class Marlin(object) :
     instance and run() to process
 """
 class ParallelMarlin(object):
+    # failure policies : stop launching new instances after the first failure or run all instances
+    failFast = "failFast"
+    continueOnError = "continueOnError"
+
     def __init__(self):
         self._marlinInstances = []
+        self._names = []
         self._maxNParallelInstances = 3
+        self._failurePolicy = ParallelMarlin.continueOnError
+        self._logger = logging.getLogger("parallelMarlin")
 
     """ Load processor parameters from a xml tree
         Usage : loadParameter(xmlTree, "//input")
@@ -153,21 +394,23 @@ class ParallelMarlin(object):
 
     """ Load step output parameters
     """
-    def loadStepOutputParameters(self, xmlTree, stepName):
+    def loadStepOutputParameters(self, config, stepName):
         for m in self._marlinInstances:
-            m.loadStepOutputParameters(xmlTree, stepName)
+            m.loadStepOutputParameters(config, stepName)
 
     """ Load input parameters
     """
-    def loadInputParameters(self, xmlTree):
+    def loadInputParameters(self, config):
         for m in self._marlinInstances:
-            m.loadInputParameters(xmlTree)
+            m.loadInputParameters(config)
 
-    """ Add a marlin instance to run in parallel
+    """ Add a marlin instance to run in parallel.
+        The name identifies the instance in the run results (i.e the particle energy)
     """
-    def addMarlinInstance(self, marlin):
+    def addMarlinInstance(self, marlin, name=None):
         if isinstance(marlin, Marlin):
             self._marlinInstances.append(marlin)
+            self._names.append(str(name) if name is not None else "marlin{0}".format(len(self._names)))
 
     """ Set the maximum number of concurrent marlin instance to run
     """
@@ -175,35 +418,72 @@ class ParallelMarlin(object):
         if maxInstances > 0 :
             self._maxNParallelInstances = maxInstances
 
-    """ Run the registered marlin concurrently
+    """ Set the failure policy : ParallelMarlin.failFast or ParallelMarlin.continueOnError (default).
+        With failFast, no new instance is started after a failure (running instances are completed)
+    """
+    def setFailurePolicy(self, policy):
+        if policy not in (ParallelMarlin.failFast, ParallelMarlin.continueOnError):
+            raise ValueError("ParallelMarlin.setFailurePolicy: unknown policy '{0}'".format(policy))
+        self._failurePolicy = policy
+
+    """ Run the registered marlin concurrently with the default executor (see Executors).
+        A new instance is started as soon as one ends, the instances started together
+        are submitted as one job array to the batch executors.
+        Returns the list of results (ProcessResult) in the order of registration.
+        The status of the instances not started (failFast policy) is None
     """
     def run(self):
-        marlinQueue = list(self._marlinInstances)
-        runningMarlinInstances = {}
-        marlinEndStatus = {m : None for m in marlinQueue}
+        marlinQueue = list(range(len(self._marlinInstances)))
+        results = [ProcessResult(name, None, 0., marlin.getOutputFiles()) for name, marlin in zip(self._names, self._marlinInstances)]
+        admissionController = AdmissionController.instance()
+        executor = createExecutor()
+        failed = False
 
         while 1:
-
-            if len(marlinQueue) == 0 and len(runningMarlinInstances) == 0:
+            jobs = []
+            while marlinQueue and not failed and executor.nRunning() + len(jobs) < self._maxNParallelInstances:
+                index = marlinQueue.pop(0)
+                marlin = self._marlinInstances[index]
+                if marlin._restoreFromCache():
+                    results[index] = results[index]._replace(status=0)
+                    continue
+                admission = None
+                if executor.usesLocalResources() :
+                    # queue the instance if the node is full. Wait only if none of ours is running
+                    if executor.nRunning() or jobs :
+                        admission = admissionController.tryAcquire(marlin.workload())
+                    else :
+                        admission = admissionController.acquire(marlin.workload())
+                    if admission is None :
+                        marlinQueue.insert(0, index)
+                        break
+                jobs.append((marlin.createProcessArgs(), index, "Marlin {0}".format(self._names[index]), admission))
+            executor.startArray(jobs)
+
+            if executor.nRunning() == 0:
                 break
 
-            if len(runningMarlinInstances) < self._maxNParallelInstances and len(marlinQueue):
-                marlin = marlinQueue.pop(0)
-                args = marlin.createProcessArgs()
-                process = subprocess.Popen(args = args)
-                runningMarlinInstances[process] = marlin
-            else:
-                time.sleep(1)
-
-            for proc, marlin in runningMarlinInstances.items():
-                status = proc.poll()
-                if status is not None :
-                    marlinEndStatus[marlin] = status
-                    del runningMarlinInstances[proc]
-
-        print "ParallelMarlin ended with the following status ({0} instances):".format(len(marlinEndStatus))
-        for marlin, status in marlinEndStatus.items():
-            print "  -> {0} ended with status {1}".format(marlin, status)
+            index, status, wallTime, rusage = executor.wait()
+            results[index] = results[index]._replace(status=status, wallTime=wallTime)
+            self._marlinInstances[index].removeTmpSteeringFile()
+
+            if status == 0 :
+                self._marlinInstances[index]._storeInCache()
+            else :
+                self._logger.error("Marlin instance '{0}' failed with status {1}".format(self._names[index], status))
+                if self._failurePolicy == ParallelMarlin.failFast and not failed :
+                    failed = True
+                    if marlinQueue :
+                        self._logger.error("Fail fast: {0} instance(s) not started".format(len(marlinQueue)))
+
+        print "ParallelMarlin ended with the following status ({0} instances):".format(len(results))
+        for result in results:
+            if result.status is None :
+                print "  -> {0} not started".format(result.name)
+            else :
+                print "  -> {0} ended with status {1} ({2:.1f} s)".format(result.name, result.status, result.wallTime)
+
+        return results
 
 
 
@@ -0,0 +1,167 @@
+#
+
+""" Content addressed cache of the marlin reconstruction outputs.
+    A marlin run is identified by the hash of its effective steering file
+    (output file names excluded, xml files referenced by parameters hashed by content),
+    the identity of the lcio input files (path, size, modification time) and the
+    software environment. On a cache hit, the stored output files are copied
+    to the requested locations instead of running marlin.
+    Only the registered output files (pfo analysis root file by default) are cached.
+    The cache directory may be shared by concurrent processes : an entry evicted
+    while being restored is a cache miss.
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from distutils.spawn import find_executable
+from calibration.XmlTools import etree
+
+
+class MarlinCache(object):
+    # environment variables affecting the marlin reconstruction
+    environmentVariables = ["MARLIN_DLL", "LD_LIBRARY_PATH"]
+
+    def __init__(self, cacheDirectory, maxSize):
+        self._cacheDirectory = os.path.abspath(cacheDirectory)
+        self._maxSize = int(maxSize)
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger("marlinCache")
+
+        if not os.path.isdir(self._cacheDirectory):
+            os.makedirs(self._cacheDirectory)
+
+    """ Compute the cache key of a marlin run.
+        The output file parameters are blanked in the hashed steering
+    """
+    def computeKey(self, marlinXml, outputFiles):
+        xmlTree = marlinXml.materialize()
+        outputFiles = set(outputFiles)
+        inputFiles = []
+        sha = hashlib.sha1()
+
+        for parameter in xmlTree.iter("parameter"):
+            value = parameter.get("value")
+            if value is None:
+                value = parameter.text
+            if value is None:
+                continue
+            value = value.strip()
+
+            if value in outputFiles:
+                value = ""
+            elif parameter.get("name") == "LCIOInputFiles":
+                inputFiles = value.split()
+            elif value.endswith(".xml") and os.path.isfile(value):
+                value = self._fileDigest(value)
+
+            if parameter.get("value") is not None:
+                parameter.set("value", value)
+            else:
+                parameter.text = value
+
+        sha.update(etree.tostring(xmlTree, method="c14n"))
+
+        for lcioFile in inputFiles:
+            stat = os.stat(lcioFile)
+            sha.update("{0}:{1}:{2}\n".format(os.path.abspath(lcioFile), stat.st_size, int(stat.st_mtime)).encode())
+
+        sha.update(self._environmentDigest().encode())
+        return sha.hexdigest()
+
+    """ Copy the cached outputs of the given key to the output files.
+        Returns False if the key is not in the cache or if the entry couldn't be read
+        (i.e evicted by another process)
+    """
+    def restore(self, key, outputFiles):
+        entryDirectory = os.path.join(self._cacheDirectory, key)
+
+        with self._lock:
+            if not os.path.isdir(entryDirectory):
+                self._logger.info("Cache miss ({0})".format(key))
+                return False
+
+            try:
+                for index, outputFile in enumerate(outputFiles):
+                    cachedFile = os.path.join(entryDirectory, str(index))
+                    if not os.path.isfile(cachedFile):
+                        self._logger.warning("Incomplete cache entry {0}, ignoring it".format(key))
+                        return False
+                    shutil.copyfile(cachedFile, outputFile)
+
+                # mark the entry as recently used
+                os.utime(entryDirectory, None)
+            except (IOError, OSError) as e:
+                self._logger.warning("Couldn't restore cache entry {0}, ignoring it: {1}".format(key, e))
+                return False
+
+        self._logger.info("Cache hit ({0}), marlin outputs restored: {1}".format(key, ", ".join(outputFiles)))
+        return True
+
+    """ Store the output files of a successful marlin run and evict the least recently used entries
+    """
+    def store(self, key, outputFiles):
+        entryDirectory = os.path.join(self._cacheDirectory, key)
+
+        with self._lock:
+            if os.path.isdir(entryDirectory):
+                return
+
+            tmpDirectory = tempfile.mkdtemp(prefix=".tmp_", dir=self._cacheDirectory)
+            try:
+                for index, outputFile in enumerate(outputFiles):
+                    shutil.copyfile(outputFile, os.path.join(tmpDirectory, str(index)))
+                os.rename(tmpDirectory, entryDirectory)
+            except (IOError, OSError) as e:
+                shutil.rmtree(tmpDirectory, ignore_errors=True)
+                self._logger.warning("Couldn't store marlin outputs in cache: {0}".format(e))
+                return
+
+            self._logger.info("Marlin outputs stored in cache ({0})".format(key))
+            self._evict()
+
+    """ Remove the least recently used entries until the cache size is below the maximum size
+    """
+    def _evict(self):
+        entries = []
+        totalSize = 0
+
+        for entry in os.listdir(self._cacheDirectory):
+            entryDirectory = os.path.join(self._cacheDirectory, entry)
+            if entry.startswith(".") or not os.path.isdir(entryDirectory):
+                continue
+            try:
+                size = sum([os.path.getsize(os.path.join(entryDirectory, f)) for f in os.listdir(entryDirectory)])
+                entries.append((os.path.getmtime(entryDirectory), size, entryDirectory))
+            except OSError:
+                # evicted by another process
+                continue
+            totalSize = totalSize + size
+
+        for mtime, size, entryDirectory in sorted(entries):
+            if totalSize <= self._maxSize:
+                break
+            shutil.rmtree(entryDirectory, ignore_errors=True)
+            totalSize = totalSize - size
+            self._logger.info("Evicted cache entry {0}".format(os.path.basename(entryDirectory)))
+
+    def _fileDigest(self, fileName):
+        sha = hashlib.sha1()
+        with open(fileName, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _environmentDigest(self):
+        environment = ["{0}={1}".format(variable, os.environ.get(variable, "")) for variable in self.environmentVariables]
+        marlinExecutable = find_executable("Marlin")
+        if marlinExecutable:
+            environment.append("Marlin={0}:{1}".format(os.path.realpath(marlinExecutable), int(os.path.getmtime(marlinExecutable))))
+        return "\n".join(environment)
+
+
+
+#
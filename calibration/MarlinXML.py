@@ -2,34 +2,90 @@
 import os
 from calibration.XmlTools import *
 import tempfile
-import subprocess
-
-
-class MarlinXML(object):
-    gearConversionPlugin = "default"
-    
-    def __init__(self, steeringFile=None):
-        self._steeringFile = steeringFile
-        self._xmlTree = None
-        
-
-    def setSteeringFile(self, steeringFile, load=False):
+from calibration.Workspace import Workspace
+import copy
+import shutil
+import atexit
+import threading
+
+
+""" Convert a parameter value to the element text
+"""
+def _toText(value):
+    if type(value) is list:
+        return ("".join(value)).strip()
+    return str(value).strip()
+
+
+""" SteeringIndex class.
+    Index of the processor parameters (top level and group processors),
+    the global parameters and the <execute> processor entries of a steering tree
+"""
+class SteeringIndex(object):
+    def __init__(self, xmlTree):
+        root = xmlTree.getroot()
+        self.processorParameters = {}
+        self.globalParameters = {}
+        self.executeEntries = {}
+
+        # top level processors first, as the first match wins
+        for processor in root.findall("processor") + root.findall("group/processor"):
+            processorName = processor.get("name")
+            for parameter in processor.findall("parameter"):
+                self.processorParameters.setdefault((processorName, parameter.get("name")), parameter)
+
+        self.globalElement = root.find("global")
+        if self.globalElement is not None:
+            for parameter in self.globalElement.findall("parameter"):
+                self.globalParameters.setdefault(parameter.get("name"), parameter)
+
+        self.executeElement = root.find("execute")
+        if self.executeElement is not None:
+            for entry in _getExecuteProcessors(self.executeElement):
+                self.executeEntries.setdefault(entry.get("name"), []).append(entry)
+
+
+def _getExecuteProcessors(element):
+    processors = element.findall("processor")
+    ifelements = element.findall("if")
+    for elt in ifelements:
+        processors.extend( _getExecuteProcessors(elt) )
+    return processors
+
+
+""" SteeringTemplate class.
+    A parsed steering file, includes resolved, with its index.
+    Templates are read only and shared by all the MarlinXML instances
+    of the same steering file. Use SteeringTemplate.load() to get one
+"""
+class SteeringTemplate(object):
+    _templates = {}
+    _templatesLock = threading.Lock()
+
+    """ Get the template of a steering file, parsed once as long as the file is not modified
+    """
+    @classmethod
+    def load(cls, steeringFile):
+        stat = os.stat(steeringFile)
+        key = (os.path.abspath(steeringFile), stat.st_size, stat.st_mtime)
+
+        with cls._templatesLock:
+            template = cls._templates.get(key)
+        if template is None:
+            template = cls(steeringFile)
+            with cls._templatesLock:
+                template = cls._templates.setdefault(key, template)
+        return template
+
+    def __init__(self, steeringFile):
         self._steeringFile = steeringFile
-        self._xmlTree = None
-
-        if self._steeringFile and load:
-            self.loadSteeringFile()
-
-    def loadSteeringFile(self):
-        if not self._steeringFile:
-            raise RuntimeError("MarlinXML.loadSteeringfile: steering file not set !")
-
         xmlParser = createXMLParser()
-        self._xmlTree = etree.parse(self._steeringFile, xmlParser)
+        self.xmlTree = etree.parse(self._steeringFile, xmlParser)
         
         # process include elements
-        self._processIncludes(self._xmlTree.getroot())
-        
+        self._processIncludes(self.xmlTree.getroot())
+        self.index = SteeringIndex(self.xmlTree)
+
     def _processIncludes(self, element):
         childs = list(element.getchildren())
         for child in childs:
@@ -58,83 +114,194 @@ class MarlinXML(object):
             else:
                 self._processIncludes(child)
 
+
+""" MarlinXML class.
+    A steering file template (see SteeringTemplate) plus the modifications of this
+    instance (processor parameters, global parameters, turned off processors).
+    The template is shared, the modified steering tree is only created when
+    written to disk (see materialize()). The get/set methods are dictionary lookups
+"""
+class MarlinXML(object):
+    gearConversionPlugin = "default"
+    # where the temporary steering files are written (i.e /dev/shm). Default system temporary directory
+    steeringDirectory = None
+
+    _managedDirectory = None
+    _managedDirectoryLock = threading.Lock()
+    
+    def __init__(self, steeringFile=None):
+        self._steeringFile = steeringFile
+        self._template = None
+        self._clearOverrides()
+        
+
+    def setSteeringFile(self, steeringFile, load=False):
+        self._steeringFile = steeringFile
+        self._template = None
+        self._clearOverrides()
+
+        if self._steeringFile and load:
+            self.loadSteeringFile()
+
+    def getSteeringFile(self):
+        return self._steeringFile
+
+    def loadSteeringFile(self):
+        if not self._steeringFile:
+            raise RuntimeError("MarlinXML.loadSteeringfile: steering file not set !")
+
+        self._template = SteeringTemplate.load(self._steeringFile)
+        self._clearOverrides()
+
+    def _clearOverrides(self):
+        self._parameterOverrides = {}
+        self._globalOverrides = {}
+        self._turnedOffProcessors = set()
+        # (file, parameters, globals, turned off processors) of the last written base steering
+        self._base = None
+
+    """ Get the directory of the temporary steering files, created in steeringDirectory
+        (default workspace tmp directory) on first use and removed when the program exits
+    """
+    @classmethod
+    def managedDirectory(cls):
+        with cls._managedDirectoryLock:
+            if cls._managedDirectory is None:
+                parentDirectory = cls.steeringDirectory if cls.steeringDirectory else Workspace.instance().tmpDirectory()
+                cls._managedDirectory = tempfile.mkdtemp(prefix="marlin_steering_", dir=parentDirectory)
+                atexit.register(shutil.rmtree, cls._managedDirectory, True)
+            return cls._managedDirectory
+
+    """ Create the steering tree of this instance : a copy of the template with the modifications applied
+    """
+    def materialize(self):
+        if self._template is None:
+            raise RuntimeError("MarlinXML.materialize: Steering file not loaded")
+
+        xmlTree = copy.deepcopy(self._template.xmlTree)
+        index = SteeringIndex(xmlTree)
+
+        for key, value in self._parameterOverrides.items():
+            self._setElementValue(index.processorParameters[key], value)
+
+        # sorted to create the new global parameters in a reproducible order
+        for name, value in sorted(self._globalOverrides.items()):
+            element = index.globalParameters.get(name)
+            if element is None:
+                element = etree.Element("parameter", name=name)
+                index.globalElement.append(element)
+            self._setElementValue(element, value)
+
+        for name in self._turnedOffProcessors:
+            for entry in index.executeEntries[name]:
+                entry.getparent().remove(entry)
+
+        return xmlTree
+
+    def _setElementValue(self, element, value):
+        if element.get("value") is not None:
+            del element.attrib["value"]
+        element.text = value
+
     """ Load processor parameters from a calibration xml tree
         Usage : loadParameter(xmlTree, "//input")
     """
     def loadParameters(self, xmlTree, path):
-        for elt in xmlTree.xpath(path):
+        self.loadElementParameters(xmlTree.xpath(path))
+
+    """ Load processor parameters from calibration xml elements (i.e a step output element)
+    """
+    def loadElementParameters(self, elements):
+        parameters = []
+        for elt in elements:
+            if elt is None:
+                continue
             for parameter in elt.iter("parameter"):
-                processor = parameter.get("processor")
-                name = parameter.get("name")
-                value = parameter.text
-                self.setProcessorParameter(processor, name, value)
+                parameters.append((parameter.get("processor"), parameter.get("name"), parameter.text))
+        self.setProcessorParameters(parameters)
+
+    """ Set many processor parameters in one pass.
+        parameters is a list of (processor, parameter, value).
+        Nothing is modified if one of the processor/parameter doesn't exist
+    """
+    def setProcessorParameters(self, parameters):
+        if self._template is None:
+            raise RuntimeError("MarlinXML.setProcessorParameters: Steering file not loaded, couldn't set parameters")
+
+        parameters = list(parameters)
+        processorParameters = self._template.index.processorParameters
+        missing = [(processor, name) for processor, name, value in parameters if (processor, name) not in processorParameters]
+        if missing:
+            raise KeyError("MarlinXML.setProcessorParameters: processor/parameter doesn't exists ({0})".format(", ".join(["{0}, {1}".format(p, n) for p, n in missing])))
+
+        for processor, name, value in parameters:
+            self._parameterOverrides[(processor, name)] = _toText(value)
                 
-    """ Load step output parameters
+    """ Load step output parameters from the calibration store
     """
-    def loadStepOutputParameters(self, xmlTree, stepName):
-        self.loadParameters(xmlTree, "//step[@name='{0}']/output".format(stepName))
+    def loadStepOutputParameters(self, config, stepName):
+        self.loadElementParameters([config.stepOutput(stepName)])
     
-    """ Load input parameters
+    """ Load input parameters from the calibration store
     """
-    def loadInputParameters(self, xmlTree):
-        self.loadParameters(xmlTree, "//input")
+    def loadInputParameters(self, config):
+        self.loadElementParameters([config.input()])
         
     """ Set a processor parameter.
     """
     def setProcessorParameter(self, processor, parameter, value):
-        if not self._xmlTree:
+        if self._template is None:
             raise RuntimeError("MarlinXML.setProcessorParameter: Steering file not loaded, couldn't set parameter")
 
-        element = self._xmlTree.xpath("//marlin/processor[@name='{0}']/parameter[@name='{1}']".format(processor, parameter))
-        element.extend( self._xmlTree.xpath("//marlin/group/processor[@name='{0}']/parameter[@name='{1}']".format(processor, parameter)) )
-        if element:
-            element = element[0]
-        else:
+        if (processor, parameter) not in self._template.index.processorParameters:
             raise KeyError("MarlinXML.setProcessorParameter: processor/parameter doesn't exists ({0}, {1})".format(processor, parameter))
 
-        if element.get("value") is not None:
-            del element.attrib["value"]
-
-        if type(value) is list:
-            element.text = ("".join(value)).strip()
-        else:
-            element.text = str(value).strip()
+        self._parameterOverrides[(processor, parameter)] = _toText(value)
 
     """ Get a processor parameter.
     """
     def getProcessorParameter(self, processor, parameter):
-        if not self._xmlTree:
+        if self._template is None:
             raise RuntimeError("MarlinXML.getProcessorParameter: Steering file not loaded, couldn't get parameter")
 
-        element = self._xmlTree.xpath("//marlin/processor[@name='{0}']/parameter[@name='{1}']".format(processor, parameter))
-        element.extend(self._xmlTree.xpath("//marlin/group/processor[@name='{0}']/parameter[@name='{1}']".format(processor, parameter)))
-        
-        if element:
-            element = element[0]
-        else:
+        if (processor, parameter) in self._parameterOverrides:
+            return self._parameterOverrides[(processor, parameter)]
+
+        element = self._template.index.processorParameters.get((processor, parameter))
+        if element is None:
             raise KeyError("MarlinXML.getProcessorParameter: processor/parameter doesn't exists ({0}, {1})".format(processor, parameter))
 
         return element.text
 
+    """ Set a global parameter.
+        If create is True, the parameter is added to the <global> section when missing
     """
-    """
-    def setGlobalParameter(self, name, value):
-        if not self._xmlTree:
+    def setGlobalParameter(self, name, value, create=False):
+        if self._template is None:
             raise RuntimeError("MarlinXML.setGlobalParameter: Steering file not loaded, couldn't set parameter")
 
-        element = self._xmlTree.xpath("//marlin/global/parameter[@name='{0}']".format(name))
-        if element:
-            element = element[0]
-        else:
-            raise KeyError("MarlinXML.setGlobalParameter: global parameter doesn't exists ({0})".format(name))
+        index = self._template.index
+        if name not in index.globalParameters and name not in self._globalOverrides:
+            if not create or index.globalElement is None:
+                raise KeyError("MarlinXML.setGlobalParameter: global parameter doesn't exists ({0})".format(name))
 
-        if element.get("value") is not None:
-            del element.attrib["value"]
+        self._globalOverrides[name] = _toText(value)
+
+    """ Get a global parameter.
+    """
+    def getGlobalParameter(self, name):
+        if self._template is None:
+            raise RuntimeError("MarlinXML.getGlobalParameter: Steering file not loaded, couldn't get parameter")
+
+        if name in self._globalOverrides:
+            return self._globalOverrides[name]
 
-        if type(value) is list:
-            element.text = ("".join(value)).strip()
-        else:
-            element.text = str(value).strip()
+        element = self._template.index.globalParameters.get(name)
+        if element is None:
+            raise KeyError("MarlinXML.getGlobalParameter: global parameter doesn't exists ({0})".format(name))
+
+        value = element.get("value")
+        return value if value is not None else element.text
 
     """ Set the lcio input file(s)
         String list or string accepted
@@ -163,7 +330,7 @@ class MarlinXML(object):
     """ Set the number of events to skip
     """
     def setSkipNEvents(self, nEvents) :
-        self.setGlobalParameter("LCIOInputFiles", inputFiles)
+        self.setGlobalParameter("SkipNEvents", nEvents, True)
 
     """ Set the global verbosity
     """
@@ -180,28 +347,12 @@ class MarlinXML(object):
     def setRandomSeed(self, randomSeed) :
         self.setGlobalParameter("RandomSeed", randomSeed)
 
-    """ Convert the compact file to gear file using 'convertToGear' binary
+    """ Convert the compact file to gear file using 'convertToGear' binary (see GearCache)
     """
     def convertToGear(self, compactFile, force=False) :
-        gearFile = "gear_" + os.path.split(compactFile)[1]
-
-        if os.path.isfile(gearFile) and not force:
-            return gearFile
-
-        args = ['convertToGear', gearConversionPlugin, compactFile, gearFile]
-        process = subprocess.Popen(args = args)
-        if process.wait() :
-            raise RuntimeError("Couldn't convert compact file to gear file")
-        return gearFile
+        from calibration.GearCache import GearCache
+        return GearCache.instance().gearFile(compactFile, self.gearConversionPlugin, force)
     
-    def _getExecuteProcessors(self, element):
-        processors = element.findall("processor")
-        ifelements = element.findall("if")
-        for elt in ifelements:
-            processors.extend( self._getExecuteProcessors(elt) )
-        return processors
-        
-
     """ Turn off the target list of processors
         This method removes entries in the <execute> marlin xml element
     """
@@ -209,24 +360,10 @@ class MarlinXML(object):
         if type(processors) is not list:
             raise TypeError("MarlinXML.turnOffProcessors: excepted list type for processors")
 
-        if not self._xmlTree:
+        if self._template is None:
             raise RuntimeError("MarlinXML.turnOffProcessors: Steering file not loaded, couldn't turn off processors")
 
-        execute = self._xmlTree.xpath("//marlin/execute")[0]
-        registeredProcessors = self._getExecuteProcessors(execute)
-        processorsToRemove = []
-
-        for regProcessor in registeredProcessors:
-            procName = regProcessor.get("name")
-
-            try:
-                index = processors.index(procName) # raise ValueError if not in list
-                processorsToRemove.append(regProcessor)
-            except ValueError:                
-                continue
-
-        for proc in processorsToRemove:
-            proc.getparent().remove(proc)
+        self._turnedOffProcessors.update(set(processors) & set(self._template.index.executeEntries.keys()))
 
     """ Turn off all processors except the ones ine the spcified list
         This method removes entries in the <execute> marlin xml element
@@ -235,38 +372,61 @@ class MarlinXML(object):
         if type(processors) is not list:
             raise TypeError("MarlinXML.turnOffProcessorsExcept: excepted list type for processors")
 
-        if not self._xmlTree:
+        if self._template is None:
             raise RuntimeError("MarlinXML.turnOffProcessorsExcept: Steering file not loaded, couldn't turn off processors")
 
-        execute = self._xmlTree.xpath("//marlin/execute")[0]
-        registeredProcessors = self._getExecuteProcessors(execute)
-        processorsToRemove = []
-
-        for regProcessor in registeredProcessors:
-            procName = regProcessor.get("name")
+        self._turnedOffProcessors.update(set(self._template.index.executeEntries.keys()) - set(processors))
 
-            try:
-                index = processors.index(procName)
-            except ValueError:
-                processorsToRemove.append(regProcessor)
-                continue
-
-        for proc in processorsToRemove:
-            proc.getparent().remove(proc)
+    """ Create an independent copy of the loaded steering file.
+        Modifying the copy doesn't affect the original steering.
+        The copy shares the template, only the modifications are copied
+    """
+    def copy(self):
+        marlinXml = MarlinXML(self._steeringFile)
+        marlinXml._template = self._template
+        marlinXml._parameterOverrides = dict(self._parameterOverrides)
+        marlinXml._globalOverrides = dict(self._globalOverrides)
+        marlinXml._turnedOffProcessors = set(self._turnedOffProcessors)
+        marlinXml._base = self._base
+        return marlinXml
 
     """ Write the current loaded steering file to the specified file location
     """
     def write(self, filen, pretty_print=True):
-        if not self._xmlTree:
+        if self._template is None:
             raise RuntimeError("MarlinXML.write: no steering file loaded, couldn't write to file")
 
-        self._xmlTree.write(filen, pretty_print=pretty_print)
+        self.materialize().write(filen, pretty_print=pretty_print)
 
-    """ Write the current loaded steering file in a temporary file.
+    """ Write the current loaded steering file in a temporary file (see managedDirectory).
         The created file name is returned. The user has the responsability to delete it
     """
     def writeTmp(self, pretty_print=True):
-        fhandle, fileName = tempfile.mkstemp(suffix=".xml")
-        # print type(fhandle)
+        fhandle, fileName = tempfile.mkstemp(suffix=".xml", dir=MarlinXML.managedDirectory())
+        os.close(fhandle)
         self.write(fileName, pretty_print)
         return fileName
+
+    """ Get a steering file and the marlin command line overrides (--Processor.Parameter=value)
+        to run this steering. The base steering file is written once and shared by the copies,
+        only the parameters modified since are passed on the command line. The base is
+        written again if the execute section changed or if a new global parameter was created
+    """
+    def writeWithOverrides(self):
+        if self._template is None:
+            raise RuntimeError("MarlinXML.writeWithOverrides: no steering file loaded, couldn't write to file")
+
+        base = self._base
+        newGlobals = [name for name in self._globalOverrides if name not in self._template.index.globalParameters]
+        if base is None or base[3] != self._turnedOffProcessors or [name for name in newGlobals if name not in base[2]]:
+            base = (self.writeTmp(False), dict(self._parameterOverrides), dict(self._globalOverrides), set(self._turnedOffProcessors))
+            self._base = base
+
+        overrides = []
+        for (processor, parameter), value in sorted(self._parameterOverrides.items()):
+            if base[1].get((processor, parameter)) != value:
+                overrides.append("--{0}.{1}={2}".format(processor, parameter, value))
+        for name, value in sorted(self._globalOverrides.items()):
+            if base[2].get(name) != value:
+                overrides.append("--global.{0}={1}".format(name, value))
+        return base[0], overrides
@@ -2,6 +2,7 @@
 """
 
 from calibration.CalibrationStep import CalibrationStep
+from calibration.StepMetadata import mipScaleMetadata
 from calibration.Marlin import Marlin
 from calibration.PandoraAnalysis import *
 from calibration.FileTools import *
@@ -13,8 +14,10 @@ from subprocess import call
 """ Base class for mip scale calibration
 """
 class MipScaleStep(CalibrationStep) :
+    metadata = mipScaleMetadata
+
     def __init__(self) :
-        CalibrationStep.__init__(self, "MipScale")
+        CalibrationStep.__init__(self)
         self._marlin = None
         self._pfoOutputFile = "./PfoAnalysis_" + self._name + ".root"
         self._hcalBarrelMip = 0.
@@ -22,16 +25,6 @@ class MipScaleStep(CalibrationStep) :
         self._hcalRingMip = 0.
         self._ecalMip = 0.
         self._muonEnergy = 0
-        
-        # set requirements
-        self._requireMuonFile()
-        self._requireCompactFile()
-        self._requireSteeringFile()
-
-    """ Get the step description
-    """
-    def description(self) :
-        return "Calculate the mip values from SimCalorimeter collections in the muon lcio file. Outputs ecal mip, hcal barrel mip, hcal endcap mip and hcal ring mip values"
 
     """ Read command line parsing
     """
@@ -43,7 +36,9 @@ class MipScaleStep(CalibrationStep) :
         self._marlin.setCompactFile(parsed.compactFile)
         self._marlin.setMaxRecordNumber(parsed.maxRecordNumber)
         self._marlin.setInputFiles(self._extractFileList(parsed.lcioMuonFile, "slcio"))
+        self._pfoOutputFile = self._workspacePath("PfoAnalysis_" + self._name + ".root")
         self._marlin.setProcessorParameter(self._pfoAnalysisProcessor, "RootFile", self._pfoOutputFile)
+        self._configureMarlin(parsed)
         self._muonEnergy = parsed.muonEnergy
 
     """ Initialize the step
@@ -1,20 +1,48 @@
 
 
 import os
-import subprocess
-import linecache
+import shutil
+import logging
+import tempfile
+from calibration.ProcessTools import runProcess, currentResourceAccounting, setResourceAccounting
+from multiprocessing.pool import ThreadPool
+from calibration.Workspace import Workspace
+from calibration.PfoAnalysisEngine import PfoAnalysisTree
+
+_logger = logging.getLogger("pandoraAnalysis")
 
 ############################################################
 ############################################################
 class PandoraAnalysisBinary(object) :
+    # use the in-process analysis engine instead of the binary when supported
+    useNativeEngine = False
+    # use the in-process analysis engine for the detector region calibrations too (barrel, endcap)
+    nativeRegions = False
+    # run the binaries and compare their outputs with the in-process analysis engine (all the
+    # calibrators supported by the engine, detector regions included). The binary outputs are used
+    validateNativeEngine = False
+    # the relative difference above which a native output is reported as different
+    validationTolerance = 0.01
+    # base directory of the per-invocation output directories (system temporary directory if None)
+    outputDirectory = None
+    # maximum number of calibrators running concurrently in runCalibrators()
+    maxNConcurrentRuns = 4
+    # persistent memo of the calibrator results (see CalibratorMemo), None to disable
+    memo = None
+    # the output attributes stored in the memo. Calibrators without outputs are not memoized
+    _outputNames = []
+
     def __init__(self, name) :
-        self._pandoraAnalysisDir = os.environ["PANDORA_ANALYSIS_DIR"]
+        self._pandoraAnalysisDir = os.environ.get("PANDORA_ANALYSIS_DIR", "")
         self._name = name
         self._executable = os.path.join(self._pandoraAnalysisDir, "bin", self._name)
         self._arguments = {}
         self._calibrationFile = ""
         self._outputPath = ""
+        self._outputArgument = None
+        self._requestedOutputPath = ""
         self._deleteOutputFile = True
+        self._memoKey = None
 
     def _createProcessArgs(self) :
         args = [self._executable]
@@ -38,25 +66,125 @@ class PandoraAnalysisBinary(object) :
             pass
     
     def _getFileContent(self, fname, lid, tokenid):
-        line = linecache.getline(fname, lid)
-        lineTokens = line.split()
-        linecache.clearcache()
-        return lineTokens[tokenid]
+        with open(fname) as f:
+            lines = f.readlines()
+        return lines[lid-1].split()[tokenid]
 
     def _setOutputPath(self, arg, path):
+        self._outputArgument = arg
+        self._requestedOutputPath = path
         self._outputPath = path
         self._calibrationFile = path + "Calibration.txt"
         self._setArgument(arg, self._outputPath)
+
+    """ Redirect the binary outputs to a new unique directory.
+        Calibrators running in the same working directory can then run concurrently
+    """
+    def _createOutputDirectory(self):
+        if self._outputArgument is None:
+            return
+        parentDirectory = self.outputDirectory if self.outputDirectory else Workspace.instance().tmpDirectory()
+        outputDirectory = tempfile.mkdtemp(prefix=self._name + "_", dir=parentDirectory)
+        self._outputPath = os.path.join(outputDirectory, os.path.basename(self._requestedOutputPath))
+        self._calibrationFile = self._outputPath + "Calibration.txt"
+        self._setArgument(self._outputArgument, self._outputPath)
+
+    """ Remove the output directory of the last run.
+        If the output files are kept, move them to the requested output path first
+    """
+    def _cleanupOutput(self):
+        outputDirectory = os.path.dirname(self._outputPath)
+        if self._outputPath == self._requestedOutputPath or not os.path.isdir(outputDirectory):
+            return
+        if not self._deleteOutputFile:
+            targetDirectory = Workspace.instance().resolve(os.path.dirname(self._requestedOutputPath) or ".")
+            for fname in os.listdir(outputDirectory):
+                shutil.move(os.path.join(outputDirectory, fname), os.path.join(targetDirectory, fname))
+        shutil.rmtree(outputDirectory, ignore_errors=True)
     
     def setDeleteOutputFile(self, deleteFile):
         self._deleteOutputFile = deleteFile
 
+    """ Whether this invocation runs in the native engine. The detector region
+        calibrations run the binary unless nativeRegions is set
+    """
+    def _useNativeEngine(self):
+        if not self.useNativeEngine or self.validateNativeEngine:
+            return False
+        if getattr(self, "_region", None) is not None and not self.nativeRegions:
+            _logger.info("{0}: native engine not enabled for the detector regions (nativeRegions), running the binary".format(self._name))
+            return False
+        return True
+
+    """ Compute the outputs with the native engine. Implemented by the calibrators supported by the engine
+    """
+    def _runNative(self):
+        raise NotImplementedError("PandoraAnalysisBinary '{0}': no native engine implementation".format(self._name))
+
+    """ Compare the outputs of the binary with the native engine ones (validateNativeEngine).
+        Returns the list of (output, binary value, native value) differing by more than the
+        validation tolerance. The binary outputs are kept
+    """
+    def _validateNativeEngine(self):
+        if not self.validateNativeEngine:
+            return []
+        binaryOutputs = [(name, getattr(self, name)) for name in self._outputNames]
+        self._runNative()
+        differences = []
+
+        for name, binaryValue in binaryOutputs:
+            nativeValue = getattr(self, name)
+            setattr(self, name, binaryValue)
+            difference = abs(nativeValue - binaryValue) / abs(binaryValue) if binaryValue else abs(nativeValue)
+            if difference > self.validationTolerance:
+                differences.append((name, binaryValue, nativeValue))
+                _logger.warning("{0} ({1}): native engine {2} = {3}, binary {4} (relative difference {5:.4f})".format(self._name, " ".join(self._createProcessArgs()[1:]), name, nativeValue, binaryValue, difference))
+            else:
+                _logger.info("{0}: native engine {1} = {2} agrees with the binary ({3})".format(self._name, name, nativeValue, binaryValue))
+        return differences
+
+    """ The binary arguments identifying the result (output path excluded)
+    """
+    def _memoArguments(self):
+        arguments = dict(self._arguments)
+        arguments.pop(self._outputArgument, None)
+        return arguments
+
+    """ Load the outputs of an identical previous invocation from the memo.
+        Returns False if the memo is disabled or doesn't contain this invocation
+    """
+    def _loadFromMemo(self):
+        self._memoKey = None
+        if self.memo is None or not self._outputNames:
+            return False
+
+        self._memoKey = self.memo.computeKey(self._name, self._memoArguments())
+        outputs = self.memo.load(self._memoKey)
+        if outputs is None:
+            return False
+
+        for name in self._outputNames:
+            setattr(self, name, outputs[name])
+        print "PandoraAnalysisBinary '" + self._name + "' result loaded from memo"
+        return True
+
+    """ Store the outputs of the last invocation in the memo
+    """
+    def _saveToMemo(self):
+        if self.memo is None or self._memoKey is None:
+            return
+        outputs = dict([(name, getattr(self, name)) for name in self._outputNames])
+        self.memo.save(self._memoKey, self._name, self._memoArguments(), outputs)
+
     def run(self) :
+        if not self._pandoraAnalysisDir:
+            raise RuntimeError("PandoraAnalysisBinary: PANDORA_ANALYSIS_DIR environment variable not set")
+        self._createOutputDirectory()
         args = self._createProcessArgs()
         print "Running: {0}".format(" ".join(args))
-        process = subprocess.Popen(args = args)#, stdin = None, stdout = None, stderr = None)
-        if process.wait() :
-            raise RuntimeError
+        if runProcess(args, self._name).status :
+            self._cleanupOutput()
+            raise RuntimeError("PandoraAnalysisBinary '" + self._name + "' failed")
         print "PandoraAnalysisBinary '" + self._name + "' ended with status 0"
 
 ############################################################
@@ -66,6 +194,8 @@ class PandoraAnalysisBinary(object) :
     from LCPandoraAnalysis package
 """
 class MipCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_hcalBarrelMip", "_hcalEndcapMip", "_hcalRingMip", "_ecalMip"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "SimCaloHitEnergyDistribution")
         
@@ -97,18 +227,20 @@ class MipCalibrator(PandoraAnalysisBinary):
         self._setArgument("-b", energy)    
     
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run binary
-        super(MipCalibrator, self).run()
-        # extract variables
-        self._hcalBarrelMip = float(self._getFileContent(self._calibrationFile, 7, 5))
-        self._hcalEndcapMip = float(self._getFileContent(self._calibrationFile, 8, 5))
-        self._hcalRingMip = float(self._getFileContent(self._calibrationFile, 9, 5))
-        self._ecalMip = float(self._getFileContent(self._calibrationFile, 10, 4))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run binary in a new output directory
+        try:
+            super(MipCalibrator, self).run()
+            # extract variables
+            self._hcalBarrelMip = float(self._getFileContent(self._calibrationFile, 7, 5))
+            self._hcalEndcapMip = float(self._getFileContent(self._calibrationFile, 8, 5))
+            self._hcalRingMip = float(self._getFileContent(self._calibrationFile, 9, 5))
+            self._ecalMip = float(self._getFileContent(self._calibrationFile, 10, 4))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
         
 ############################################################
 ############################################################
@@ -117,43 +249,70 @@ class MipCalibrator(PandoraAnalysisBinary):
     from LCPandoraAnalysis package
 """
 class EcalCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_ecalDigiMean"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "ECalDigitisation_ContainedEvents")
         
         # set default values
+        self._rootFile = None
+        self._region = None
+        self._cosThetaRange = (0, 1)
         self.setPhotonEnergy(10)
         self._setOutputPath("-d", "./EcalEnergyCalibration_")
         self.setCosThetaRange(0, 1)
         
         # outputs
         self._ecalDigiMean = 0.
+        self._result = None
 
     def setRootFile(self, rootFile):
+        self._rootFile = rootFile
         self._setArgument("-a", rootFile)
         
     def setPhotonEnergy(self, energy):
+        self._energy = energy
         self._setArgument("-b", energy)
     
     def setDetectorRegion(self, region):
+        self._region = region
         self._setArgument("-g", region)
     
     def setCosThetaRange(self, minVal, maxVal):
+        self._cosThetaRange = (minVal, maxVal)
         self._setArgument("-i", minVal)
         self._setArgument("-j", maxVal)
     
     def getEcalDigiMean(self):
         return self._ecalDigiMean
+
+    """ Get the full analysis result (native engine only, None otherwise)
+    """
+    def getResult(self):
+        return self._result
         
+    """ Compute the outputs with the native engine (see PfoAnalysisEngine)
+    """
+    def _runNative(self):
+        self._result = PfoAnalysisTree.open(self._rootFile).ecalContainedEvents(self._cosThetaRange[0], self._cosThetaRange[1], self._region, self._energy)
+        self._ecalDigiMean = self._result.mean
+
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run
-        super(EcalCalibrator, self).run()
-        # extract variables
-        self._ecalDigiMean = float(self._getFileContent(self._calibrationFile, 11, 4))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)
+        if self._useNativeEngine():
+            self._runNative()
+            return
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run in a new output directory
+        try:
+            super(EcalCalibrator, self).run()
+            # extract variables
+            self._ecalDigiMean = float(self._getFileContent(self._calibrationFile, 11, 4))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
+        self._validateNativeEngine()
 
 
 
@@ -166,18 +325,23 @@ class EcalCalibrator(PandoraAnalysisBinary):
     from LCPandoraAnalysis package
 """
 class EcalRingCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_endcapMeanDirectionCorrection", "_ringMeanDirectionCorrection"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "ECalDigitisation_DirectionCorrectionDistribution")
         
         # set default values
+        self._rootFile = None
         self.setPhotonEnergy(10)
         self._setOutputPath("-c", "./EcalRingEnergyCalibration_")
         
         # outputs
         self._endcapMeanDirectionCorrection = 0.
         self._ringMeanDirectionCorrection = 0.
+        self._result = None
 
     def setRootFile(self, rootFile):
+        self._rootFile = rootFile
         self._setArgument("-a", rootFile)
         
     def setPhotonEnergy(self, energy):
@@ -189,17 +353,35 @@ class EcalRingCalibrator(PandoraAnalysisBinary):
     def getRingMeanDirectionCorrection(self):
         return self._ringMeanDirectionCorrection
 
+    """ Get the full analysis result (native engine only, None otherwise)
+    """
+    def getResult(self):
+        return self._result
+
+    """ Compute the outputs with the native engine (see PfoAnalysisEngine)
+    """
+    def _runNative(self):
+        self._result = PfoAnalysisTree.open(self._rootFile).ecalDirectionCorrections()
+        self._endcapMeanDirectionCorrection = self._result.endcapMean
+        self._ringMeanDirectionCorrection = self._result.ringMean
+
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run
-        super(EcalRingCalibrator, self).run()
-        # extract variables
-        self._endcapMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 4, 5))
-        self._ringMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 9, 5))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)
+        if self._useNativeEngine():
+            self._runNative()
+            return
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run in a new output directory
+        try:
+            super(EcalRingCalibrator, self).run()
+            # extract variables
+            self._endcapMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 4, 5))
+            self._ringMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 9, 5))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
+        self._validateNativeEngine()
     
 
 
@@ -210,43 +392,70 @@ class EcalRingCalibrator(PandoraAnalysisBinary):
     from LCPandoraAnalysis package
 """
 class HcalCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_hcalDigiMean"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "HCalDigitisation_ContainedEvents")
         
         # set default values
+        self._rootFile = None
+        self._region = None
+        self._cosThetaRange = (0, 1)
         self.setKaon0LEnergy(20)
         self._setOutputPath("-d", "./HcalEnergyCalibration_")
         self.setCosThetaRange(0, 1)
         
         # outputs
         self._hcalDigiMean = 0.
+        self._result = None
 
     def setRootFile(self, rootFile):
+        self._rootFile = rootFile
         self._setArgument("-a", rootFile)
         
     def setKaon0LEnergy(self, energy):
+        self._energy = energy
         self._setArgument("-b", energy)
     
     def setDetectorRegion(self, region):
+        self._region = region
         self._setArgument("-g", region)
     
     def setCosThetaRange(self, minVal, maxVal):
+        self._cosThetaRange = (minVal, maxVal)
         self._setArgument("-i", minVal)
         self._setArgument("-j", maxVal)
     
     def getHcalDigiMean(self):
         return self._hcalDigiMean
+
+    """ Get the full analysis result (native engine only, None otherwise)
+    """
+    def getResult(self):
+        return self._result
         
+    """ Compute the outputs with the native engine (see PfoAnalysisEngine)
+    """
+    def _runNative(self):
+        self._result = PfoAnalysisTree.open(self._rootFile).hcalContainedEvents(self._cosThetaRange[0], self._cosThetaRange[1], self._region, self._energy)
+        self._hcalDigiMean = self._result.mean
+
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run
-        super(HcalCalibrator, self).run()
-        # extract variables
-        self._hcalDigiMean = float(self._getFileContent(self._calibrationFile, 9, 5))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)
+        if self._useNativeEngine():
+            self._runNative()
+            return
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run in a new output directory
+        try:
+            super(HcalCalibrator, self).run()
+            # extract variables
+            self._hcalDigiMean = float(self._getFileContent(self._calibrationFile, 9, 5))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
+        self._validateNativeEngine()
         
 
 ############################################################
@@ -256,18 +465,23 @@ class HcalCalibrator(PandoraAnalysisBinary):
     from LCPandoraAnalysis package
 """
 class HcalRingCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_endcapMeanDirectionCorrection", "_ringMeanDirectionCorrection"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "HCalDigitisation_DirectionCorrectionDistribution")
         
         # set default values
+        self._rootFile = None
         self.setKaon0LEnergy(20)
         self._setOutputPath("-c", "./HcalRingEnergyCalibration_")
         
         # outputs
         self._endcapMeanDirectionCorrection = 0.
         self._ringMeanDirectionCorrection = 0.
+        self._result = None
 
     def setRootFile(self, rootFile):
+        self._rootFile = rootFile
         self._setArgument("-a", rootFile)
         
     def setKaon0LEnergy(self, energy):
@@ -279,17 +493,35 @@ class HcalRingCalibrator(PandoraAnalysisBinary):
     def getRingMeanDirectionCorrection(self):
         return self._ringMeanDirectionCorrection
 
+    """ Get the full analysis result (native engine only, None otherwise)
+    """
+    def getResult(self):
+        return self._result
+
+    """ Compute the outputs with the native engine (see PfoAnalysisEngine)
+    """
+    def _runNative(self):
+        self._result = PfoAnalysisTree.open(self._rootFile).hcalDirectionCorrections()
+        self._endcapMeanDirectionCorrection = self._result.endcapMean
+        self._ringMeanDirectionCorrection = self._result.ringMean
+
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run
-        super(HcalRingCalibrator, self).run()
-        # extract variables
-        self._endcapMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 4, 5))
-        self._ringMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 9, 5))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)    
+        if self._useNativeEngine():
+            self._runNative()
+            return
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run in a new output directory
+        try:
+            super(HcalRingCalibrator, self).run()
+            # extract variables
+            self._endcapMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 4, 5))
+            self._ringMeanDirectionCorrection = float(self._getFileContent(self._calibrationFile, 9, 5))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
+        self._validateNativeEngine()
 
 ############################################################
 ############################################################
@@ -298,6 +530,8 @@ class HcalRingCalibrator(PandoraAnalysisBinary):
     from LCPandoraAnalysis package
 """
 class PandoraMipScaleCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_ecalToGeVMip", "_hcalToGeVMip", "_muonToGeVMip"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "PandoraPFACalibrate_MipResponse")
         
@@ -324,17 +558,19 @@ class PandoraMipScaleCalibrator(PandoraAnalysisBinary):
         return self._muonToGeVMip 
 
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run
-        super(PandoraMipScaleCalibrator, self).run()
-        # extract variables
-        self._ecalToGeVMip = float(self._getFileContent(self._calibrationFile, 8, 2))
-        self._hcalToGeVMip = float(self._getFileContent(self._calibrationFile, 16, 2))
-        self._muonToGeVMip = float(self._getFileContent(self._calibrationFile, 24, 2))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)  
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run in a new output directory
+        try:
+            super(PandoraMipScaleCalibrator, self).run()
+            # extract variables
+            self._ecalToGeVMip = float(self._getFileContent(self._calibrationFile, 8, 2))
+            self._hcalToGeVMip = float(self._getFileContent(self._calibrationFile, 16, 2))
+            self._muonToGeVMip = float(self._getFileContent(self._calibrationFile, 24, 2))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
         
 
 ############################################################
@@ -344,6 +580,8 @@ class PandoraMipScaleCalibrator(PandoraAnalysisBinary):
     from LCPandoraAnalysis package
 """
 class PandoraEMScaleCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_ecalEMMean"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "PandoraPFACalibrate_EMScale")
         
@@ -364,15 +602,17 @@ class PandoraEMScaleCalibrator(PandoraAnalysisBinary):
         return self._ecalEMMean
 
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run
-        super(PandoraEMScaleCalibrator, self).run()
-        # extract variables
-        self._ecalEMMean = float(self._getFileContent(self._calibrationFile, 9, 3))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)  
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run in a new output directory
+        try:
+            super(PandoraEMScaleCalibrator, self).run()
+            # extract variables
+            self._ecalEMMean = float(self._getFileContent(self._calibrationFile, 9, 3))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
 
 
 ############################################################
@@ -382,6 +622,8 @@ class PandoraEMScaleCalibrator(PandoraAnalysisBinary):
     from LCPandoraAnalysis package
 """
 class PandoraHadScaleCalibrator(PandoraAnalysisBinary):
+    _outputNames = ["_ecalToHadGeV", "_hcalToHadGeV"]
+
     def __init__(self):
         PandoraAnalysisBinary.__init__(self, "PandoraPFACalibrate_HadronicScale_ChiSquareMethod")
         
@@ -406,16 +648,18 @@ class PandoraHadScaleCalibrator(PandoraAnalysisBinary):
         return self._hcalToHadGeV
 
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
-        # run
-        super(PandoraHadScaleCalibrator, self).run()
-        # extract variables
-        self._ecalToHadGeV = float(self._getFileContent(self._calibrationFile, 5, 2))
-        self._hcalToHadGeV = float(self._getFileContent(self._calibrationFile, 6, 2))
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)  
+        # load the result of an identical previous run
+        if self._loadFromMemo():
+            return
+        # run in a new output directory
+        try:
+            super(PandoraHadScaleCalibrator, self).run()
+            # extract variables
+            self._ecalToHadGeV = float(self._getFileContent(self._calibrationFile, 5, 2))
+            self._hcalToHadGeV = float(self._getFileContent(self._calibrationFile, 6, 2))
+            self._saveToMemo()
+        finally:
+            self._cleanupOutput()
 
 
 ############################################################
@@ -454,22 +698,50 @@ class PandoraSoftCompCalibrator(PandoraAnalysisBinary):
         self._runWithClusterEnergy = runWithCluster
 
     def run(self):
-        # cleanup file
-        self._removeFile(self._calibrationFile)
         # last argument added on the fly ...
         if self._runWithClusterEnergy:
             self._setArgument("-g")
-        # run            
-        super(PandoraSoftCompCalibrator, self).run()
-        # extract variables
-        self._softCompWeights  = []
-        for w in range(0, 9):
-            weight = float(self._getFileContent(self._calibrationFile, 8+w, 3))
-            self._softCompWeights.append(weight)
-        # cleanup again
-        if self._deleteOutputFile:
-            self._removeFile(self._calibrationFile)  
-        
-        
-        
-#
\ No newline at end of file
+        # run in a new output directory
+        try:
+            super(PandoraSoftCompCalibrator, self).run()
+            # extract variables
+            self._softCompWeights  = []
+            for w in range(0, 9):
+                weight = float(self._getFileContent(self._calibrationFile, 8+w, 3))
+                self._softCompWeights.append(weight)
+        finally:
+            self._cleanupOutput()
+
+
+
+############################################################
+############################################################
+""" Run independent calibrators concurrently (i.e the barrel and endcap
+    analyses of an iteration). Each calibrator must be a separate instance.
+    An exception raised by a calibrator is raised again here
+"""
+def runCalibrators(calibrators):
+    if len(calibrators) < 2 or PandoraAnalysisBinary.maxNConcurrentRuns < 2:
+        for calibrator in calibrators:
+            calibrator.run()
+        return
+
+    # the pool threads record the process usages in the accounting of the caller
+    accounting = currentResourceAccounting()
+    def runCalibrator(calibrator):
+        setResourceAccounting(accounting)
+        try:
+            calibrator.run()
+        finally:
+            setResourceAccounting(None)
+
+    pool = ThreadPool(min(len(calibrators), PandoraAnalysisBinary.maxNConcurrentRuns))
+    try:
+        pool.map(runCalibrator, calibrators)
+    finally:
+        pool.close()
+        pool.join()
+
+
+
+#
@@ -3,6 +3,7 @@
 
 
 from calibration.CalibrationStep import *
+from calibration.StepMetadata import pandoraEMScaleMetadata
 from calibration.Marlin import Marlin
 from calibration.PandoraAnalysis import *
 from calibration.FileTools import *
@@ -13,8 +14,10 @@ from subprocess import call
 
 
 class PandoraEMScaleStep(CalibrationStep) :
+    metadata = pandoraEMScaleMetadata
+
     def __init__(self) :
-        CalibrationStep.__init__(self, "PandoraEMScale")
+        CalibrationStep.__init__(self)
         self._marlin = None
 
         self._maxNIterations = 5
@@ -28,16 +31,6 @@ class PandoraEMScaleStep(CalibrationStep) :
         # step output
         self._outputEcalToEMGeV = None
         self._outputHcalToEMGeV = None
-        
-        # command line requirement
-        self._requireSteeringFile()
-        self._requireCompactFile()
-        self._requireIterations()
-        self._requirePhotonFile()
-        self._requireECalAccuracy()
-
-    def description(self):
-        return "Calibrate the electromagnetic scale of the ecal and the hcal. Outputs the constants ECalToEMGeVCalibration and HCalToEMGeVCalibration"
 
     def readCmdLine(self, parsed) :
         # setup marlin
@@ -47,6 +40,10 @@ class PandoraEMScaleStep(CalibrationStep) :
         self._marlin.setCompactFile(parsed.compactFile)
         self._marlin.setMaxRecordNumber(parsed.maxRecordNumber)
         self._marlin.setInputFiles(self._extractFileList(parsed.lcioPhotonFile, "slcio"))
+        self._configureMarlin(parsed)
+
+        if parsed.rescaleStrategy:
+            self.setRescaleStrategy(parsed.rescaleStrategy)
 
         self._maxNIterations = int(parsed.maxNIterations)
         self._energyScaleAccuracy = float(parsed.ecalCalibrationAccuracy)
@@ -85,13 +82,24 @@ class PandoraEMScaleStep(CalibrationStep) :
         
         emScaleCalibrator = PandoraEMScaleCalibrator()
         emScaleCalibrator.setPhotonEnergy(self._photonEnergy)
+        rescaleStrategy = self._createRescaleStrategy(self._photonEnergy)
 
-        for iteration in range(self._maxNIterations) :
+        firstIteration = 0
+        state = self._restoreIteration(config)
+
+        if state is not None:
+            firstIteration = state["iteration"] + 1
+            ecalToEMGeV, hcalToEMGeV = state["ecalToEMGeV"], state["hcalToEMGeV"]
+            calibrationRescaleFactor = state["rescale"]
+            calibrationRescaleFactorCumul = state["rescaleCumul"]
+            rescaleStrategy.setHistory(state["history"])
+
+        for iteration in range(firstIteration, self._maxNIterations) :
 
             # readjust iteration parameters
             ecalToEMGeV = ecalToEMGeV*calibrationRescaleFactor
             hcalToEMGeV = hcalToEMGeV*calibrationRescaleFactor
-            pfoAnalysisFile = "./PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration)
+            pfoAnalysisFile = self._workspacePath("PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration), iteration)
 
             # run marlin ...
             self._marlin.setProcessorParameter(self._marlinPandoraProcessor, "ECalToEMGeVCalibration", str(ecalToEMGeV))
@@ -105,9 +113,9 @@ class PandoraEMScaleStep(CalibrationStep) :
             emScaleCalibrator.run()
 
             newPhotonEnergy = emScaleCalibrator.getEcalToEMMean()
-            calibrationRescaleFactor = float(self._photonEnergy) / newPhotonEnergy
+            calibrationRescaleFactor = rescaleStrategy.rescaleFactor(calibrationRescaleFactorCumul, newPhotonEnergy)
             calibrationRescaleFactorCumul = calibrationRescaleFactorCumul*calibrationRescaleFactor
-            currentPrecision = abs(1 - 1. / calibrationRescaleFactor)
+            currentPrecision = abs(1 - newPhotonEnergy / float(self._photonEnergy))
 
             # write down iteration results
             self._writeIterationOutput(config, iteration, {"precision" : currentPrecision, "rescale" : calibrationRescaleFactor, "newPhotonEnergy" : newPhotonEnergy})
@@ -123,6 +131,13 @@ class PandoraEMScaleStep(CalibrationStep) :
 
                 break
 
+            self._checkpointIteration(iteration,
+                {"ecalToEMGeV" : ecalToEMGeV,
+                 "hcalToEMGeV" : hcalToEMGeV,
+                 "rescale" : calibrationRescaleFactor,
+                 "rescaleCumul" : calibrationRescaleFactorCumul,
+                 "history" : rescaleStrategy.history()})
+
         if not accuracyReached :
             raise RuntimeError("{0}: Couldn't reach the user accuracy ({1})".format(self._name, self._energyScaleAccuracy))
 
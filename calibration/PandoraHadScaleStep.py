@@ -3,6 +3,7 @@
 
 
 from calibration.CalibrationStep import CalibrationStep
+from calibration.StepMetadata import pandoraHadScaleMetadata
 from calibration.Marlin import Marlin
 from calibration.PandoraAnalysis import *
 from calibration.FileTools import *
@@ -13,8 +14,10 @@ from subprocess import call
 
 
 class PandoraHadScaleStep(CalibrationStep) :
+    metadata = pandoraHadScaleMetadata
+
     def __init__(self) :
-        CalibrationStep.__init__(self, "PandoraHadScale")
+        CalibrationStep.__init__(self)
         self._marlin = None
         self._hadScaleCalibrator = None
 
@@ -32,17 +35,6 @@ class PandoraHadScaleStep(CalibrationStep) :
         self._outputEcalToHadGeVBarrel = None
         self._outputEcalToHadGeVEndcap = None
         self._outputHcalToHadGeV = None
-        
-        # command line requirement
-        self._requireSteeringFile()
-        self._requireCompactFile()
-        self._requireIterations()
-        self._requireKaon0LFile()
-        self._requireHCalAccuracy()
-        self._requireECalAccuracy()
-
-    def description(self):
-        return "Calibrate the hadronic scale of the ecal and the hcal. Outputs the constants ECalToHadGeVCalibrationBarrel, ECalToHadGeVCalibrationEndCap and HCalToHadGeVCalibration"
 
     def readCmdLine(self, parsed) :
         # setup marlin
@@ -52,6 +44,10 @@ class PandoraHadScaleStep(CalibrationStep) :
         self._marlin.setCompactFile(parsed.compactFile)
         self._marlin.setMaxRecordNumber(parsed.maxRecordNumber)
         self._marlin.setInputFiles(self._extractFileList(parsed.lcioKaon0LFile, "slcio"))
+        self._configureMarlin(parsed)
+
+        if parsed.rescaleStrategy:
+            self.setRescaleStrategy(parsed.rescaleStrategy)
 
         self._maxNIterations = int(parsed.maxNIterations)
         self._ecalEnergyScaleAccuracy = float(parsed.ecalCalibrationAccuracy)
@@ -94,8 +90,30 @@ class PandoraHadScaleStep(CalibrationStep) :
         
         hadScaleCalibrator = PandoraHadScaleCalibrator()
         hadScaleCalibrator.setKaon0LEnergy(self._kaon0LEnergy)
+        ecalRescale = self._createRescaleStrategy(self._kaon0LEnergy)
+        hcalRescale = self._createRescaleStrategy(self._kaon0LEnergy)
+
+        firstIteration = 0
+        state = self._restoreIteration(config)
+
+        if state is not None:
+            firstIteration = state["iteration"] + 1
+            ecalToHadGeVBarrel, ecalToHadGeVEndcap, hcalToHadGeV = state["ecalToHadGeVBarrel"], state["ecalToHadGeVEndcap"], state["hcalToHadGeV"]
+            ecalRescaleFactor, hcalRescaleFactor = state["ecalRescale"], state["hcalRescale"]
+            ecalRescaleFactorCumul, hcalRescaleFactorCumul = state["ecalRescaleCumul"], state["hcalRescaleCumul"]
+            currentEcalPrecision, currentHcalPrecision = state["ecalPrecision"], state["hcalPrecision"]
+            ecalAccuracyReached, hcalAccuracyReached = state["ecalAccuracyReached"], state["hcalAccuracyReached"]
+            newEcalKaon0LEnergy, newHcalKaon0LEnergy = state["newEcalEnergy"], state["newHcalEnergy"]
+            ecalRescale.setHistory(state["ecalHistory"])
+            hcalRescale.setHistory(state["hcalHistory"])
+
+            if ecalAccuracyReached:
+                self._outputEcalToHadGeVBarrel = ecalToHadGeVBarrel
+                self._outputEcalToHadGeVEndcap = ecalToHadGeVEndcap
+            if hcalAccuracyReached:
+                self._outputHcalToHadGeV = hcalToHadGeV
         
-        for iteration in range(self._maxNIterations) :
+        for iteration in range(firstIteration, self._maxNIterations) :
 
             # readjust iteration parameters
             if not ecalAccuracyReached:
@@ -105,7 +123,7 @@ class PandoraHadScaleStep(CalibrationStep) :
             if not hcalAccuracyReached:
                 hcalToHadGeV = hcalToHadGeV*hcalRescaleFactor
                 
-            pfoAnalysisFile = "./PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration)
+            pfoAnalysisFile = self._workspacePath("PfoAnalysis_{0}_iter{1}.root".format(self._name, iteration), iteration)
 
             # run marlin ...
             self._marlin.setProcessorParameter(self._marlinPandoraProcessor, "ECalToHadGeVCalibrationBarrel", str(ecalToHadGeVBarrel))
@@ -120,15 +138,15 @@ class PandoraHadScaleStep(CalibrationStep) :
 
             if not ecalAccuracyReached :
                 newEcalKaon0LEnergy = hadScaleCalibrator.getEcalToHad()    
-                ecalRescaleFactor = float(self._kaon0LEnergy) / newEcalKaon0LEnergy
+                ecalRescaleFactor = ecalRescale.rescaleFactor(ecalRescaleFactorCumul, newEcalKaon0LEnergy)
                 ecalRescaleFactorCumul = ecalRescaleFactorCumul*ecalRescaleFactor
-                currentEcalPrecision = abs(1 - 1. / ecalRescaleFactor)
+                currentEcalPrecision = abs(1 - newEcalKaon0LEnergy / float(self._kaon0LEnergy))
                 
             if not hcalAccuracyReached :
                 newHcalKaon0LEnergy = hadScaleCalibrator.getHcalToHad()
-                hcalRescaleFactor = float(self._kaon0LEnergy) / newHcalKaon0LEnergy
+                hcalRescaleFactor = hcalRescale.rescaleFactor(hcalRescaleFactorCumul, newHcalKaon0LEnergy)
                 hcalRescaleFactorCumul = hcalRescaleFactorCumul*hcalRescaleFactor
-                currentHcalPrecision = abs(1 - 1. / hcalRescaleFactor)
+                currentHcalPrecision = abs(1 - newHcalKaon0LEnergy / float(self._kaon0LEnergy))
 
             # write down iteration results
             self._writeIterationOutput(config, iteration, 
@@ -153,6 +171,23 @@ class PandoraHadScaleStep(CalibrationStep) :
             if ecalAccuracyReached and hcalAccuracyReached :
                 break
 
+            self._checkpointIteration(iteration,
+                {"ecalToHadGeVBarrel" : ecalToHadGeVBarrel,
+                 "ecalToHadGeVEndcap" : ecalToHadGeVEndcap,
+                 "hcalToHadGeV" : hcalToHadGeV,
+                 "ecalRescale" : ecalRescaleFactor,
+                 "hcalRescale" : hcalRescaleFactor,
+                 "ecalRescaleCumul" : ecalRescaleFactorCumul,
+                 "hcalRescaleCumul" : hcalRescaleFactorCumul,
+                 "ecalPrecision" : currentEcalPrecision,
+                 "hcalPrecision" : currentHcalPrecision,
+                 "ecalAccuracyReached" : ecalAccuracyReached,
+                 "hcalAccuracyReached" : hcalAccuracyReached,
+                 "newEcalEnergy" : newEcalKaon0LEnergy,
+                 "newHcalEnergy" : newHcalKaon0LEnergy,
+                 "ecalHistory" : ecalRescale.history(),
+                 "hcalHistory" : hcalRescale.history()})
+
         if not ecalAccuracyReached or not hcalAccuracyReached :
             raise RuntimeError("{0}: Couldn't reach the user accuracy".format(self._name))
 
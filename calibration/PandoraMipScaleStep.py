@@ -3,6 +3,7 @@
 
 
 from calibration.CalibrationStep import CalibrationStep
+from calibration.StepMetadata import pandoraMipScaleMetadata
 from calibration.Marlin import Marlin
 from calibration.PandoraAnalysis import *
 from calibration.FileTools import *
@@ -12,8 +13,10 @@ from subprocess import call
 
 
 class PandoraMipScaleStep(CalibrationStep) :
+    metadata = pandoraMipScaleMetadata
+
     def __init__(self) :
-        CalibrationStep.__init__(self, "PandoraMipScale")
+        CalibrationStep.__init__(self)
         self._marlin = None
         self._muonEnergy = 0
 
@@ -24,14 +27,6 @@ class PandoraMipScaleStep(CalibrationStep) :
         self._outputHcalToGeVMip = None
         self._outputMuonToGeVMip = None
         
-        # command line requirement
-        self._requireSteeringFile()
-        self._requireCompactFile()
-        self._requireMuonFile()
-        
-    def description(self):
-        return "Calculate the EcalToGeVMip, HcalToGeVMip and MuonToGeVMip that correspond to the mean reconstructed energy of mip calorimeter hit in the respective detectors"
-
     def readCmdLine(self, parsed) :
         # setup marlin
         self._marlin = Marlin(parsed.steeringFile)
@@ -40,7 +35,9 @@ class PandoraMipScaleStep(CalibrationStep) :
         self._marlin.setCompactFile(parsed.compactFile)
         self._marlin.setMaxRecordNumber(parsed.maxRecordNumber)
         self._marlin.setInputFiles(self._extractFileList(parsed.lcioMuonFile, "slcio"))
+        self._pfoOutputFile = self._workspacePath("PfoAnalysis_" + self._name + ".root")
         self._marlin.setProcessorParameter(self._pfoAnalysisProcessor, "RootFile", self._pfoOutputFile)
+        self._configureMarlin(parsed)
         
         self._muonEnergy = parsed.muonEnergy
 
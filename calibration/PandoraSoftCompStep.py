@@ -3,8 +3,8 @@
 
 
 from calibration.CalibrationStep import *
+from calibration.StepMetadata import pandoraSoftCompMetadata
 from calibration.Marlin import *
-from calibration.MarlinXML import MarlinXML
 from calibration.PandoraAnalysis import *
 from calibration.FileTools import *
 from calibration.PandoraXML import *
@@ -14,8 +14,10 @@ from subprocess import call
 
 
 class PandoraSoftCompStep(CalibrationStep) :
+    metadata = pandoraSoftCompMetadata
+
     def __init__(self) :
-        CalibrationStep.__init__(self, "PandoraSoftComp")
+        CalibrationStep.__init__(self)
         self._marlin = None
         self._calibrator = None
         self._runMarlin = True
@@ -28,16 +30,6 @@ class PandoraSoftCompStep(CalibrationStep) :
         # step output
         self._outputSoftCompWeights = None
 
-        # command line requirement
-        self._requireSteeringFile()
-        self._requireCompactFile()
-        self._requireCustomCmdLineArg("energies")
-        self._requireCustomCmdLineArg("lcioFilePattern")
-        self._requireCustomCmdLineArg("rootFilePattern")
-
-    def description(self):
-        return "Calibrate the PandoraPFA software compensation energy correction weights"
-
     def readCmdLine(self, parsed) :
         self._runMarlin = parsed.runMarlin
         self._runMinimizer = parsed.runMinimizer
@@ -49,15 +41,21 @@ class PandoraSoftCompStep(CalibrationStep) :
         if self._runMarlin:
             self._marlin = ParallelMarlin()
             self._marlin.setMaxNParallelInstances(int(parsed.maxParallel))
+            self._marlin.setFailurePolicy(ParallelMarlin.failFast)
+            self._nCores = max(1, int(parsed.maxParallel))
+            marlinCache = self._createMarlinCache(parsed)
 
             lcioFilePattern = parsed.lcioFilePattern
             if lcioFilePattern.find("%{energy}") == -1 :
                 raise RuntimeError("File pattern '{0}' : couldn't find '%{energy}' tag !".format(lcioFilePattern))
 
-            steeringFile = parsed.steeringFile
-            marlinXml = MarlinXML()
-            marlinXml.setSteeringFile(steeringFile, load=True)
-            pandoraSettings = marlinXml.getProcessorParameter(self._marlinPandoraProcessor, "PandoraSettingsXmlFile")
+            # the steering file is parsed once, each energy only holds its own settings
+            steeringTemplate = Marlin(parsed.steeringFile)
+            steeringTemplate.setCompactFile(parsed.compactFile)
+            steeringTemplate.setGearFile(steeringTemplate.convertToGear(parsed.compactFile))
+            steeringTemplate.setMaxRecordNumber(parsed.maxRecordNumber)
+            steeringTemplate.setPfoAnalysisProcessor(self._pfoAnalysisProcessor)
+            pandoraSettings = steeringTemplate.getProcessorParameter(self._marlinPandoraProcessor, "PandoraSettingsXmlFile")
             pandora = PandoraXML(pandoraSettings)
             pandora.setRemoveEnergyCorrections(True)
 
@@ -78,12 +76,8 @@ class PandoraSoftCompStep(CalibrationStep) :
                 index = rootFile.rfind(".root")
                 pfoAnalysisFile = rootFile[:index] + "_PfoAnalysis.root"
 
-                marlin = Marlin(steeringFile)
-                marlin.setCompactFile(parsed.compactFile)
-                gearFile = marlin.convertToGear(parsed.compactFile)
-                marlin.setGearFile(gearFile)
+                marlin = steeringTemplate.copy()
                 marlin.setInputFiles(lcioFiles)
-                marlin.setMaxRecordNumber(parsed.maxRecordNumber)
                 marlin.setProcessorParameter(self._marlinPandoraProcessor, "PandoraSettingsXmlFile", str(newPandoraXmlFileName))
 
                 try:
@@ -91,7 +85,10 @@ class PandoraSoftCompStep(CalibrationStep) :
                 except:
                     pass
 
-                self._marlin.addMarlinInstance(marlin)
+                marlin.addOutputFile(rootFile)
+                marlin.setCache(marlinCache)
+
+                self._marlin.addMarlinInstance(marlin, "energy {0}".format(energy))
 
         if self._runMinimizer:
             self._calibrator = PandoraSoftCompCalibrator()
@@ -113,7 +110,11 @@ class PandoraSoftCompStep(CalibrationStep) :
             print "================================================="
             print "{0} step: running Marlin !!!".format(self.name())
             print "================================================="
-            self._marlin.run()
+            results = self._marlin.run()
+            failedEnergies = [result.name for result in results if result.status != 0]
+
+            if failedEnergies:
+                raise RuntimeError("{0} step: marlin failed or not run for {1}".format(self.name(), ", ".join(failedEnergies)))
 
         # run calibration
         if self._runMinimizer:
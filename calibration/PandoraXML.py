@@ -4,6 +4,7 @@ from calibration.XmlTools import *
 import os
 import subprocess
 import tempfile
+from calibration.Workspace import Workspace
 
 ############################################################
 ############################################################
@@ -12,6 +13,10 @@ import tempfile
     to activate/de-activated some features
 """
 class PandoraXML(object) :
+    # the directory of the generated settings files (default workspace tmp directory).
+    # Must be shared with the batch nodes when marlin runs as batch jobs
+    settingsDirectory = None
+
     def __init__(self, fileName=None):
         self._fileName = fileName
         self._xmlTree = None
@@ -57,7 +62,11 @@ class PandoraXML(object) :
         if self._runSoftCompTraining:
             self._addSoftCompTrainingAlgorithm()
         
-        fhandle, fileName = tempfile.mkstemp(suffix=".xml")
+        if self.settingsDirectory:
+            fhandle, fileName = tempfile.mkstemp(suffix=".xml", prefix="pandora_", dir=self.settingsDirectory)
+            os.close(fhandle)
+        else:
+            fileName = Workspace.instance().mkstemp(suffix=".xml")
 
         self._xmlTree.write(fileName, pretty_print=True)
         return fileName
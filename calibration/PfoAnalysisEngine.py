@@ -0,0 +1,255 @@
+#
+
+""" Native (in-process) analysis of the PfoAnalysis root tree.
+    Replaces the LCPandoraAnalysis digitisation binaries by reading the
+    tree columns once into numpy arrays and computing the calibration
+    quantities with vectorized operations.
+    Requires the numpy and uproot python packages.
+"""
+
+import os
+import threading
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import uproot
+except ImportError:
+    uproot = None
+
+
+""" Result of a contained events analysis (ecal/hcal digitisation)
+"""
+ContainedEventsResult = collections.namedtuple("ContainedEventsResult", ["mean", "nEvents", "nSelectedEvents"])
+
+""" Result of a direction correction analysis (ecal/hcal ring)
+"""
+DirectionCorrectionResult = collections.namedtuple("DirectionCorrectionResult", ["endcapMean", "ringMean", "nEndcapHits", "nRingHits"])
+
+
+""" Whether the native engine can be used (numpy and uproot installed)
+"""
+def nativeEngineAvailable():
+    return numpy is not None and uproot is not None
+
+
+""" Compute the mean of the smallest window containing the given fraction of the entries (mean90)
+"""
+def truncatedMean(values, fraction=0.9):
+    values = numpy.sort(numpy.asarray(values, dtype=numpy.float64))
+    nValues = len(values)
+
+    if nValues == 0:
+        raise RuntimeError("truncatedMean: no entry to compute the mean from")
+
+    nWindow = max(1, int(round(fraction*nValues)))
+    widths = values[nWindow-1:] - values[:nValues-nWindow+1]
+    start = int(numpy.argmin(widths))
+    return float(numpy.mean(values[start:start+nWindow]))
+
+
+""" PfoAnalysisTree class.
+    Columns of the PfoAnalysis tree loaded on demand, each branch is read only once.
+    Use PfoAnalysisTree.open(rootFile) to share the loaded columns between calibrators
+"""
+class PfoAnalysisTree(object):
+    treeName = "PfoAnalysisTree"
+
+    # branch names as written by the PfoAnalysis processor (CollectCalibrationDetails)
+    mcMomentumBranches = ("mcPfoPx", "mcPfoPy", "mcPfoPz")
+    ecalEnergyBranch = "ECalTotalCaloHitEnergy"
+    hcalEnergyBranch = "HCalTotalCaloHitEnergy"
+    muonEnergyBranch = "MuonTotalCaloHitEnergy"
+    ecalRegionEnergyBranches = {"Barrel" : "ECalBarrelCaloHitEnergy", "EndCap" : "ECalEndCapCaloHitEnergy", "Other" : "ECalOtherCaloHitEnergy"}
+    hcalRegionEnergyBranches = {"Barrel" : "HCalBarrelCaloHitEnergy", "EndCap" : "HCalEndCapCaloHitEnergy", "Other" : "HCalOtherCaloHitEnergy"}
+    ecalDirectionCorrectionBranches = ("ECalEndCapDirectionCorrectedCaloHit", "ECalOtherDirectionCorrectedCaloHit")
+    hcalDirectionCorrectionBranches = ("HCalEndCapDirectionCorrectedCaloHit", "HCalOtherDirectionCorrectedCaloHit")
+
+    # maximum energy fraction leaking out of the calorimeter region under study
+    containmentFraction = 0.05
+    # events above this multiple of the true energy are ignored (histogram range of the binaries)
+    maxEnergyRatio = 2.
+
+    _cache = {}
+    _cacheLock = threading.Lock()
+
+    """ Get the (cached) tree for the given root file
+    """
+    @classmethod
+    def open(cls, rootFile):
+        if not nativeEngineAvailable():
+            raise RuntimeError("PfoAnalysisTree: numpy and uproot are required for the native analysis engine")
+
+        stat = os.stat(rootFile)
+        key = (os.path.abspath(rootFile), stat.st_mtime, stat.st_size)
+
+        with cls._cacheLock:
+            tree = cls._cache.get(key)
+            if tree is None:
+                # only keep the last file, the calibration reads one file per iteration
+                cls._cache.clear()
+                tree = cls(rootFile)
+                cls._cache[key] = tree
+        return tree
+
+    def __init__(self, rootFile):
+        self._rootFile = rootFile
+        self._tree = uproot.open(rootFile)[self.treeName]
+        self._columns = {}
+        self._cosTheta = None
+        self._lock = threading.Lock()
+
+    """ Get a branch as numpy array. Variable size branches are returned as (values, counts)
+    """
+    def column(self, name):
+        with self._lock:
+            if name not in self._columns:
+                self._columns[name] = self._readColumn(name)
+            return self._columns[name]
+
+    def _readColumn(self, name):
+        try:
+            array = self._tree[name].array(library="np")
+        except TypeError:
+            # uproot 3 interface
+            array = self._tree[name].array()
+        except KeyError:
+            raise RuntimeError("PfoAnalysisTree: branch '{0}' not found in {1}".format(name, self._rootFile))
+
+        # uproot 3 jagged array
+        if hasattr(array, "content") and hasattr(array, "counts"):
+            return numpy.asarray(array.content, dtype=numpy.float64), numpy.asarray(array.counts)
+
+        array = numpy.asarray(array)
+
+        if array.dtype == object:
+            counts = numpy.fromiter((len(entry) for entry in array), dtype=numpy.int64, count=len(array))
+            values = numpy.concatenate(array).astype(numpy.float64) if counts.sum() else numpy.zeros(0)
+            return values, counts
+
+        return array.astype(numpy.float64)
+
+    """ Get the first entry of a variable size branch per event (nan if empty)
+    """
+    def _firstEntries(self, name):
+        values, counts = self.column(name)
+        offsets = numpy.cumsum(counts) - counts
+        first = numpy.full(len(counts), numpy.nan)
+        valid = counts > 0
+        first[valid] = values[offsets[valid]]
+        return first
+
+    """ Get a branch summed per event. Works for both fixed and variable size branches
+    """
+    def eventSums(self, name):
+        column = self.column(name)
+        if not isinstance(column, tuple):
+            return column
+        values, counts = column
+        sums = numpy.zeros(len(counts))
+        filled = counts > 0
+        offsets = numpy.cumsum(counts) - counts
+        sums[filled] = numpy.add.reduceat(values, offsets[filled]) if len(values) else 0.
+        return sums
+
+    """ The |cos(theta)| of the generated particle, per event
+    """
+    def cosTheta(self):
+        if self._cosTheta is None:
+            px, py, pz = [self._firstEntries(name) for name in self.mcMomentumBranches]
+            momentum = numpy.sqrt(px*px + py*py + pz*pz)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                self._cosTheta = numpy.abs(pz / momentum)
+        return self._cosTheta
+
+    def _cosThetaMask(self, minCosTheta, maxCosTheta):
+        cosTheta = self.cosTheta()
+        return (cosTheta >= float(minCosTheta)) & (cosTheta <= float(maxCosTheta))
+
+    """ The energy deposited per event in the given calorimeter ("ECal" or "HCal")
+    """
+    def calorimeterEnergy(self, calorimeter):
+        return self.column(self.ecalEnergyBranch if calorimeter == "ECal" else self.hcalEnergyBranch)
+
+    """ The energy deposited per event outside of the given calorimeter ("ECal" or "HCal")
+    """
+    def leakageEnergy(self, calorimeter):
+        otherEnergyBranch = self.hcalEnergyBranch if calorimeter == "ECal" else self.ecalEnergyBranch
+        return self.column(otherEnergyBranch) + self.column(self.muonEnergyBranch)
+
+    """ The energy deposited per event in each region (barrel, endcap, other) of the given calorimeter
+    """
+    def regionEnergies(self, calorimeter):
+        branches = self.ecalRegionEnergyBranches if calorimeter == "ECal" else self.hcalRegionEnergyBranches
+        return dict([(region, self.eventSums(branch)) for region, branch in branches.items()])
+
+    """ The energy deposited per event in a region ("Barrel", "EndCap", "Other") of the given
+        calorimeter, and the energy deposited outside of this region. The whole calorimeter if region is None
+    """
+    def regionEnergy(self, calorimeter, region=None):
+        energy = self.calorimeterEnergy(calorimeter)
+        leakage = self.leakageEnergy(calorimeter)
+        if region is None:
+            return energy, leakage
+        branches = self.ecalRegionEnergyBranches if calorimeter == "ECal" else self.hcalRegionEnergyBranches
+        if region not in branches:
+            raise ValueError("PfoAnalysisTree: unknown detector region '{0}'. Options are : {1}".format(region, ", ".join(sorted(branches.keys()))))
+        regionEnergy = self.eventSums(branches[region])
+        return regionEnergy, leakage + (energy - regionEnergy)
+
+    """ Compute the energy mean of events contained in the ecal (or in an ecal region)
+        within the given cos theta range
+    """
+    def ecalContainedEvents(self, minCosTheta, maxCosTheta, region=None, trueEnergy=None):
+        energy, leakage = self.regionEnergy("ECal", region)
+        return self.containedEvents(energy, leakage, minCosTheta, maxCosTheta, trueEnergy)
+
+    """ Compute the energy mean of events contained in the hcal (or in an hcal region)
+        within the given cos theta range
+    """
+    def hcalContainedEvents(self, minCosTheta, maxCosTheta, region=None, trueEnergy=None):
+        energy, leakage = self.regionEnergy("HCal", region)
+        return self.containedEvents(energy, leakage, minCosTheta, maxCosTheta, trueEnergy)
+
+    """ Compute the mean of the energy for events contained in the calorimeter 
+        (small leakage energy) within the given cos theta range.
+        If the true energy is given, the events above maxEnergyRatio*trueEnergy are ignored
+    """
+    def containedEvents(self, energy, leakage, minCosTheta, maxCosTheta, trueEnergy=None):
+        totalEnergy = energy + leakage
+        contained = (energy > 0) & (leakage <= self.containmentFraction*totalEnergy)
+        selection = contained & self._cosThetaMask(minCosTheta, maxCosTheta)
+        if trueEnergy is not None:
+            selection = selection & (energy <= self.maxEnergyRatio*float(trueEnergy))
+        nSelected = int(numpy.count_nonzero(selection))
+
+        if not nSelected:
+            raise RuntimeError("PfoAnalysisTree: no contained event in cos theta range [{0}, {1}] ({2})".format(minCosTheta, maxCosTheta, self._rootFile))
+
+        return ContainedEventsResult(truncatedMean(energy[selection]), len(energy), nSelected)
+
+    """ Compute the mean direction corrected hit energies in the ecal endcap and ring
+    """
+    def ecalDirectionCorrections(self):
+        return self._directionCorrections(*self.ecalDirectionCorrectionBranches)
+
+    """ Compute the mean direction corrected hit energies in the hcal endcap and ring
+    """
+    def hcalDirectionCorrections(self):
+        return self._directionCorrections(*self.hcalDirectionCorrectionBranches)
+
+    def _directionCorrections(self, endcapBranch, ringBranch):
+        endcapValues, endcapCounts = self.column(endcapBranch)
+        ringValues, ringCounts = self.column(ringBranch)
+
+        if not len(endcapValues) or not len(ringValues):
+            raise RuntimeError("PfoAnalysisTree: no hit to compute the direction corrections ({0})".format(self._rootFile))
+
+        return DirectionCorrectionResult(float(numpy.mean(endcapValues)), float(numpy.mean(ringValues)), len(endcapValues), len(ringValues))
+
+
+#
@@ -0,0 +1,249 @@
+#
+
+""" Tools to run and reap external processes.
+    Each child process is reaped by a dedicated waiter thread (os.wait4 on its pid),
+    which posts the end status and resource usage on a queue and writes a byte on a
+    wakeup pipe. The launcher blocks in a read of the pipe (interruptible by signals,
+    i.e KeyboardInterrupt) and is woken up as soon as any child ends, without polling. Only the pids started by
+    the watcher are reaped, processes started elsewhere are not affected.
+    The resource usage of the ended processes is recorded in the ResourceAccounting
+    set for the launching thread (see setResourceAccounting). Each process is traced
+    on a free process track of the Tracer.
+"""
+
+import os
+import time
+import errno
+import fcntl
+import Queue
+import threading
+import subprocess
+import collections
+from calibration.AdmissionControl import AdmissionController
+from calibration.Trace import Tracer
+
+
+""" Result of an external process.
+    status is None if the process was never started
+"""
+ProcessResult = collections.namedtuple("ProcessResult", ["name", "status", "wallTime", "outputs"])
+
+
+""" Resource usage of an ended process.
+    Times in seconds, maxRSS in bytes, blockInput/blockOutput in number of block operations
+"""
+ProcessUsage = collections.namedtuple("ProcessUsage", ["name", "status", "wallTime", "userTime", "systemTime", "maxRSS", "blockInput", "blockOutput"])
+
+
+""" ResourceAccounting class.
+    Collects the resource usage of the processes launched by a calibration step
+"""
+class ResourceAccounting(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usages = []
+        self._pendingUsages = []
+
+    def add(self, usage):
+        with self._lock:
+            self._usages.append(usage)
+            self._pendingUsages.append(usage)
+
+    """ Get all the recorded usages
+    """
+    def usages(self):
+        with self._lock:
+            return list(self._usages)
+
+    """ Get the usages recorded since the last call
+    """
+    def takeUsages(self):
+        with self._lock:
+            usages = self._pendingUsages
+            self._pendingUsages = []
+            return usages
+
+    """ Get the summary of all the recorded usages (dict). The times are summed, maxRSS is the maximum
+    """
+    def summary(self):
+        usages = self.usages()
+        return {
+            "nProcesses" : len(usages),
+            "wallTime" : sum([usage.wallTime for usage in usages]),
+            "userTime" : sum([usage.userTime for usage in usages]),
+            "systemTime" : sum([usage.systemTime for usage in usages]),
+            "maxRSS" : max([usage.maxRSS for usage in usages]) if usages else 0,
+            "blockInput" : sum([usage.blockInput for usage in usages]),
+            "blockOutput" : sum([usage.blockOutput for usage in usages])
+        }
+
+
+_threadData = threading.local()
+
+""" Set the resource accounting of the processes launched by the current thread (None to disable)
+"""
+def setResourceAccounting(accounting):
+    _threadData.accounting = accounting
+
+""" Get the resource accounting of the current thread (None if not set)
+"""
+def currentResourceAccounting():
+    return getattr(_threadData, "accounting", None)
+
+
+""" Create the usage of an ended process from its rusage (None if unknown, i.e batch jobs)
+"""
+def createProcessUsage(name, status, wallTime, rusage):
+    if rusage is None:
+        return ProcessUsage(name, status, wallTime, 0., 0., 0, 0, 0)
+    # ru_maxrss is in kilobytes on linux
+    return ProcessUsage(name, status, wallTime, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss*1024, rusage.ru_inblock, rusage.ru_oublock)
+
+
+""" Decode a status returned by os.waitpid as in subprocess (negative signal number if killed)
+"""
+def decodeWaitStatus(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+""" ChildWatcher class.
+    Start processes with start(args, key) and get the ended ones with wait()
+"""
+class ChildWatcher(object):
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._running = {}
+        self._admissions = {}
+        self._accountings = {}
+        self._lock = threading.Lock()
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        for fd in (self._wakeupRead, self._wakeupWrite):
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    def __del__(self):
+        for fd in (self._wakeupRead, self._wakeupWrite):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    """ Start a process. The key identifies the process in the wait() result.
+        The admission (see AdmissionControl) is released when the process ends.
+        The name identifies the process in the resource accounting (default executable name)
+    """
+    def start(self, args, key, admission=None, name=None, **popenArgs):
+        if admission is not None and "preexec_fn" not in popenArgs:
+            popenArgs["preexec_fn"] = AdmissionController.instance().preexecFunction()
+        try:
+            process = subprocess.Popen(args = args, **popenArgs)
+        except:
+            if admission is not None:
+                AdmissionController.instance().release(admission)
+            raise
+        self._register(process, key, admission, name if name is not None else os.path.basename(args[0]))
+        thread = threading.Thread(target=self._waitProcess, args=(process, key, time.time()))
+        thread.daemon = True
+        thread.start()
+        return process
+
+    def _waitProcess(self, process, key, startTime):
+        while True:
+            try:
+                pid, status, rusage = os.wait4(process.pid, 0)
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+        # let subprocess know the process is already reaped
+        process.returncode = decodeWaitStatus(status)
+        self._notify((key, process.returncode, time.time() - startTime, rusage))
+
+    """ Post the result of an ended process (or batch job) and wake up wait()
+    """
+    def _notify(self, result):
+        self._queue.put(result)
+        os.write(self._wakeupWrite, b"x")
+
+    """ Start several processes. jobs is a list of (args, key, name, admission). Returns the processes
+    """
+    def startArray(self, jobs, **popenArgs):
+        return [self.start(args, key, admission, name, **popenArgs) for args, key, name, admission in jobs]
+
+    """ Whether the processes run on this node (and need an admission, see AdmissionControl)
+    """
+    def usesLocalResources(self):
+        return True
+
+    """ The number of processes started and not yet returned by wait()
+    """
+    def nRunning(self):
+        with self._lock:
+            return len(self._running)
+
+    """ Register a started process (or batch job)
+    """
+    def _register(self, process, key, admission, name):
+        with self._lock:
+            self._running[key] = process
+            self._admissions[key] = admission
+            self._accountings[key] = (name, currentResourceAccounting(), Tracer.instance().acquireTrack())
+
+    """ Block until a process ends. Returns (key, status, wallTime, rusage)
+    """
+    def wait(self):
+        # one byte per posted result. A blocking Queue.get() would not be
+        # interruptible and Queue.get(timeout) polls on Python 2
+        while True:
+            try:
+                os.read(self._wakeupRead, 1)
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+        key, status, wallTime, rusage = self._queue.get_nowait()
+        with self._lock:
+            del self._running[key]
+            admission = self._admissions.pop(key)
+            name, accounting, track = self._accountings.pop(key)
+        if admission is not None:
+            AdmissionController.instance().release(admission, rusage)
+        usage = createProcessUsage(name, status, wallTime, rusage)
+        if accounting is not None:
+            accounting.add(usage)
+        if track is not None:
+            tracer = Tracer.instance()
+            end = tracer.now()
+            tracer.completeEvent(name, "process", end - wallTime*1e6, end, track, dict(usage._asdict()))
+            tracer.releaseTrack(track)
+        return key, status, wallTime, rusage
+
+    """ Send SIGTERM to all running processes
+    """
+    def terminateAll(self):
+        with self._lock:
+            processes = list(self._running.values())
+        for process in processes:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+
+
+""" Run a single process and wait for it. Returns a ProcessResult.
+    If a workload name is given, the process waits for admission (see AdmissionControl)
+"""
+def runProcess(args, name=None, outputs=None, workload=None, **popenArgs):
+    name = name if name is not None else os.path.basename(args[0])
+    admission = AdmissionController.instance().acquire(workload) if workload is not None else None
+    watcher = ChildWatcher()
+    watcher.start(args, 0, admission, name, **popenArgs)
+    key, status, wallTime, rusage = watcher.wait()
+    return ProcessResult(name, status, wallTime, list(outputs) if outputs else [])
+
+
+
+#
@@ -0,0 +1,128 @@
+#
+
+""" Update strategies for the iterative calibration loops.
+    The calibration constants are scaled by a cumulative factor (scale) relative
+    to their input values. After each marlin iteration, the strategy receives the
+    scale used and the measured energy and returns the rescale factor to apply
+    for the next iteration. The history of (scale, measured energy) pairs is
+    the one written in the iteration outputs of the calibration steps.
+"""
+
+
+""" RescaleStrategy class.
+    Base class implementing the fixed point update : scale * trueEnergy / measuredEnergy
+"""
+class RescaleStrategy(object):
+    # maximum change of the scale in one iteration (safeguard)
+    maxStep = 2.
+
+    def __init__(self, trueEnergy):
+        self._trueEnergy = float(trueEnergy)
+        self._scales = []
+        self._measurements = []
+
+    def name(self):
+        return "fixedPoint"
+
+    """ Get the (scale, measured energy) history
+    """
+    def history(self):
+        return list(zip(self._scales, self._measurements))
+
+    """ Set the (scale, measured energy) history, i.e to resume an iteration loop
+    """
+    def setHistory(self, history):
+        self._scales = [float(scale) for scale, measured in history]
+        self._measurements = [float(measured) for scale, measured in history]
+
+    """ Record the iteration result and return the rescale factor for the next iteration
+    """
+    def rescaleFactor(self, scale, measured):
+        self._scales.append(float(scale))
+        self._measurements.append(float(measured))
+        fixedPointScale = self._fixedPointScale()
+
+        try:
+            nextScale = self._nextScale(fixedPointScale)
+        except ZeroDivisionError:
+            nextScale = fixedPointScale
+
+        # fall back on the fixed point update if the proposal is unphysical or too large
+        if nextScale <= 0 or nextScale > scale*self.maxStep or nextScale < scale/self.maxStep:
+            nextScale = fixedPointScale
+
+        return nextScale / scale
+
+    def _fixedPointScale(self):
+        return self._scales[-1] * self._trueEnergy / self._measurements[-1]
+
+    def _nextScale(self, fixedPointScale):
+        return fixedPointScale
+
+
+""" SecantRescale class.
+    Solves measured(scale) = trueEnergy using the secant through the last two iterations
+"""
+class SecantRescale(RescaleStrategy):
+    def name(self):
+        return "secant"
+
+    def _nextScale(self, fixedPointScale):
+        if len(self._scales) < 2:
+            return fixedPointScale
+
+        s0, s1 = self._scales[-2:]
+        m0, m1 = self._measurements[-2:]
+        return s1 + (self._trueEnergy - m1) * (s1 - s0) / (m1 - m0)
+
+
+""" AitkenRescale class.
+    Aitken delta-squared extrapolation of the sequence of scales,
+    completed with the fixed point proposal for the next iteration
+"""
+class AitkenRescale(RescaleStrategy):
+    def name(self):
+        return "aitken"
+
+    def _nextScale(self, fixedPointScale):
+        if len(self._scales) < 2:
+            return fixedPointScale
+
+        x0, x1 = self._scales[-2:]
+        x2 = fixedPointScale
+        return x2 - (x2 - x1)**2 / (x2 - 2*x1 + x0)
+
+
+""" DampedNewtonRescale class.
+    Newton update on measured(scale) - trueEnergy, with the derivative estimated
+    from the last two iterations (linear response for the first one) and a damping factor
+"""
+class DampedNewtonRescale(RescaleStrategy):
+    damping = 0.8
+
+    def name(self):
+        return "newton"
+
+    def _nextScale(self, fixedPointScale):
+        s1, m1 = self._scales[-1], self._measurements[-1]
+
+        if len(self._scales) < 2:
+            derivative = m1 / s1
+        else:
+            s0, m0 = self._scales[-2], self._measurements[-2]
+            derivative = (m1 - m0) / (s1 - s0)
+
+        return s1 + self.damping * (self._trueEnergy - m1) / derivative
+
+
+rescaleStrategies = {"fixedPoint" : RescaleStrategy, "secant" : SecantRescale, "aitken" : AitkenRescale, "newton" : DampedNewtonRescale}
+
+""" Create a rescale strategy by name
+"""
+def createRescaleStrategy(name, trueEnergy):
+    if name not in rescaleStrategies:
+        raise KeyError("Unknown rescale strategy '{0}'. Options are : {1}".format(name, ", ".join(sorted(rescaleStrategies.keys()))))
+    return rescaleStrategies[name](trueEnergy)
+
+
+#
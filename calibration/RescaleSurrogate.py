@@ -0,0 +1,134 @@
+#
+
+""" Surrogate of the marlin reconstruction for the digitisation energy factor iterations.
+    The calibration factors of a calorimeter region (all layer groups) are rescaled
+    by a common factor at each iteration, so the reconstructed energy of a region
+    scales linearly with it. One reconstruction is enough to predict the energy
+    measured for new factors, without re-running marlin.
+"""
+
+import logging
+from calibration.PfoAnalysisEngine import PfoAnalysisTree
+
+
+class EnergyRescaleSurrogate(object):
+    def __init__(self, rootFile, calorimeter, regions):
+        self._tree = PfoAnalysisTree.open(rootFile)
+        self._calorimeter = calorimeter
+        regionEnergies = self._tree.regionEnergies(calorimeter)
+        self._regionEnergies = dict([(region, regionEnergies[region]) for region in regions])
+        # energy outside of the rescaled regions : other calorimeters and regions not calibrated here
+        self._leakage = self._tree.leakageEnergy(calorimeter) + self._tree.calorimeterEnergy(calorimeter) - sum(self._regionEnergies.values())
+        self._logger = logging.getLogger("surrogate")
+
+    """ Compute the energy mean of the events contained in a region after rescaling the
+        region energies. Same selection as the region calibrators : the energy of the
+        other regions counts as leakage. Regions not in scales are not rescaled
+    """
+    def containedMean(self, scales, region, minCosTheta, maxCosTheta, trueEnergy=None):
+        energies = dict([(name, scales.get(name, 1.)*energy) for name, energy in self._regionEnergies.items()])
+        leakage = self._leakage + sum([energy for name, energy in energies.items() if name != region])
+        return self._tree.containedEvents(energies[region], leakage, minCosTheta, maxCosTheta, trueEnergy).mean
+
+    """ Iterate the region rescale factors until the predicted energy mean in each
+        cos theta window reaches the true energy.
+        The windows and the reference means (measured by the calibrator on the same
+        reconstruction) are keyed by region name.
+        Returns the rescale factor and the predicted energy mean per region
+    """
+    def solve(self, trueEnergy, windows, referenceMeans, accuracy, maxNIterations=50):
+        scales = dict([(region, 1.) for region in windows])
+        baseMeans = dict([(region, self.containedMean(scales, region, minCos, maxCos, trueEnergy)) for region, (minCos, maxCos) in windows.items()])
+        means = dict(referenceMeans)
+
+        for iteration in range(maxNIterations):
+            # normalize the surrogate to the calibrator estimate
+            means = dict([(region, self.containedMean(scales, region, minCos, maxCos, trueEnergy) / baseMeans[region] * referenceMeans[region])
+                for region, (minCos, maxCos) in windows.items()])
+
+            self._logger.info("{0} surrogate iteration {1}: rescale factors {2}".format(self._calorimeter, iteration, scales))
+
+            if all([abs(1 - mean / trueEnergy) < accuracy for mean in means.values()]):
+                return scales, means
+
+            scales = dict([(region, scales[region] * trueEnergy / means[region]) for region in windows])
+
+        self._logger.warning("{0} surrogate: accuracy not reached after {1} iterations".format(self._calorimeter, maxNIterations))
+        return scales, means
+
+
+""" SurrogateIterations class.
+    Drives the region rescale factors of an iterative step with the surrogate.
+    After each marlin iteration, the energy measured by the calibrators is compared
+    to the surrogate prediction of the previous iteration. As long as they agree within
+    the calibration accuracy, the surrogate solution built from the new reconstruction
+    replaces the rescale strategy update. On the first disagreement (or if the surrogate
+    can't reach the accuracy), the surrogate is switched off for the rest of the loop
+"""
+class SurrogateIterations(object):
+    def __init__(self, calorimeter, trueEnergy, accuracy, windows, enabled=True):
+        self._calorimeter = calorimeter
+        self._trueEnergy = float(trueEnergy)
+        self._accuracy = float(accuracy)
+        self._windows = dict(windows)
+        self._active = enabled
+        self._predictedEnergies = {}
+        self._logger = logging.getLogger("surrogate")
+
+    """ Whether the surrogate still drives the rescale factors
+    """
+    def active(self):
+        return self._active
+
+    """ Get the state to checkpoint, i.e to resume an iteration loop
+    """
+    def state(self):
+        return {"active" : self._active, "predictedEnergies" : dict(self._predictedEnergies)}
+
+    """ Set the checkpointed state
+    """
+    def setState(self, state):
+        if state is None:
+            return
+        self._active = self._active and state["active"]
+        self._predictedEnergies = dict(state["predictedEnergies"])
+
+    """ Get the rescale factors to apply for the next iteration, per region, from the given
+        reconstruction and the energies measured on it (regions still iterating only).
+        Regions missing in the result keep the rescale strategy update (empty when switched off)
+    """
+    def rescaleFactors(self, rootFile, measuredEnergies):
+        if not self._active or not measuredEnergies:
+            return {}
+
+        for region, energy in measuredEnergies.items():
+            if region not in self._predictedEnergies:
+                continue
+            residual = abs(1 - energy / self._predictedEnergies[region])
+            if residual >= self._accuracy:
+                self._logger.warning("{0} surrogate: {1} energy {2} differs from the prediction {3} (residual {4}). Switching off the surrogate".format(
+                    self._calorimeter, region, energy, self._predictedEnergies[region], residual))
+                return self._switchOff()
+
+        # the regions already calibrated keep their factors
+        windows = dict([(region, self._windows[region]) for region, energy in measuredEnergies.items() if abs(1 - energy / self._trueEnergy) >= self._accuracy])
+        if not windows:
+            return {}
+
+        surrogate = EnergyRescaleSurrogate(rootFile, self._calorimeter, self._windows.keys())
+        scales, means = surrogate.solve(self._trueEnergy, windows, measuredEnergies, self._accuracy)
+
+        if any([abs(1 - mean / self._trueEnergy) >= self._accuracy for mean in means.values()]):
+            return self._switchOff()
+
+        self._predictedEnergies = means
+        self._logger.info("{0} surrogate rescale factors: {1}".format(self._calorimeter, scales))
+        return scales
+
+    def _switchOff(self):
+        self._active = False
+        self._predictedEnergies = {}
+        return {}
+
+
+#
@@ -0,0 +1,46 @@
+#
+
+""" Metadata of the calibration steps : name, description and required command line arguments.
+    This module has no dependency. The step registry answers the introspection queries
+    (--showSteps, --dryRun, command line validation) from it without importing the step
+    modules, and the step classes read their metadata from it.
+"""
+
+import collections
+
+
+""" Metadata of a calibration step
+"""
+StepMetadata = collections.namedtuple("StepMetadata", ["name", "description", "requiredArgs"])
+
+mipScaleMetadata = StepMetadata("MipScale",
+    "Calculate the mip values from SimCalorimeter collections in the muon lcio file. Outputs ecal mip, hcal barrel mip, hcal endcap mip and hcal ring mip values",
+    ("lcioMuonFile", "compactFile", "steeringFile"))
+
+ecalEnergyMetadata = StepMetadata("EcalEnergy",
+    "Calculate the constants related to the energy deposit in a ecal cell (unit GeV). Outputs the ecalFactors values",
+    ("steeringFile", "compactFile", "maxNIteration", "lcioPhotonFile", "ecalCalibrationAccuracy"))
+
+hcalEnergyMetadata = StepMetadata("HcalEnergy",
+    "Calculate the constants related to the energy deposit in a hcal cell (unit GeV). Outputs the hcalBarrelFactor, hcalEndcapFactor and hcalRingFactor values",
+    ("steeringFile", "compactFile", "maxNIteration", "lcioKaon0LFile", "hcalCalibrationAccuracy"))
+
+pandoraMipScaleMetadata = StepMetadata("PandoraMipScale",
+    "Calculate the EcalToGeVMip, HcalToGeVMip and MuonToGeVMip that correspond to the mean reconstructed energy of mip calorimeter hit in the respective detectors",
+    ("steeringFile", "compactFile", "lcioMuonFile"))
+
+pandoraEMScaleMetadata = StepMetadata("PandoraEMScale",
+    "Calibrate the electromagnetic scale of the ecal and the hcal. Outputs the constants ECalToEMGeVCalibration and HCalToEMGeVCalibration",
+    ("steeringFile", "compactFile", "maxNIteration", "lcioPhotonFile", "ecalCalibrationAccuracy"))
+
+pandoraHadScaleMetadata = StepMetadata("PandoraHadScale",
+    "Calibrate the hadronic scale of the ecal and the hcal. Outputs the constants ECalToHadGeVCalibrationBarrel, ECalToHadGeVCalibrationEndCap and HCalToHadGeVCalibration",
+    ("steeringFile", "compactFile", "maxNIteration", "lcioKaon0LFile", "hcalCalibrationAccuracy", "ecalCalibrationAccuracy"))
+
+pandoraSoftCompMetadata = StepMetadata("PandoraSoftComp",
+    "Calibrate the PandoraPFA software compensation energy correction weights",
+    ("steeringFile", "compactFile", "energies", "lcioFilePattern", "rootFilePattern"))
+
+
+
+#
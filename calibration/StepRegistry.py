@@ -0,0 +1,159 @@
+#
+
+""" Lazy registry of the calibration steps.
+    A step is declared with the module implementing it and its metadata (name,
+    description, required arguments, see StepMetadata), shared with the step class.
+    The step module, and the heavy modules it depends on (marlin, pandora analysis,
+    numpy/uproot), are only imported when the step is actually used by the
+    calibration manager (selected step range). The introspection (--showSteps,
+    --dryRun) and the command line validation don't import any step module.
+"""
+
+import logging
+import importlib
+import collections
+from calibration import StepMetadata
+
+
+""" Declaration of a calibration step
+"""
+StepDeclaration = collections.namedtuple("StepDeclaration", ["className", "module", "metadata"])
+
+
+class StepRegistry(object):
+    _declarations = {}
+
+    """ Declare a step class implemented in the given module, with its metadata (see StepMetadata)
+    """
+    @classmethod
+    def declare(cls, className, module, metadata):
+        cls._declarations[className] = StepDeclaration(className, module, metadata)
+
+    @classmethod
+    def declaration(cls, className):
+        if className not in cls._declarations:
+            raise KeyError("StepRegistry: step class '{0}' not declared".format(className))
+        return cls._declarations[className]
+
+    """ Get the declared step class (imports its module)
+    """
+    @classmethod
+    def stepClass(cls, className):
+        declaration = cls.declaration(className)
+        module = importlib.import_module(declaration.module)
+        return getattr(module, declaration.className)
+
+    @classmethod
+    def stepClasses(cls):
+        return sorted(cls._declarations.keys())
+
+    """ Create a lazy step. The arguments are passed to the step constructor on first use
+    """
+    @classmethod
+    def create(cls, className, *args, **kwargs):
+        return LazyStep(cls.declaration(className), args, kwargs)
+
+
+""" LazyStep class.
+    Proxy of a calibration step, created from its declaration.
+    The name, description and required arguments are answered from the step
+    metadata, the dependencies from the recorded configuration. The configuration
+    calls (set*) are recorded and
+    replayed on the step when it is created. Any other call creates the step
+    (import of its module) and is forwarded to it.
+"""
+class LazyStep(object):
+    def __init__(self, declaration, args, kwargs):
+        self._declaration = declaration
+        self._args = args
+        self._kwargs = kwargs
+        self._calls = []
+        self._manager = None
+        self._stepOutputsToLoad = list()
+        self._step = None
+
+    def name(self):
+        return self._declaration.metadata.name
+
+    def description(self):
+        if self._step is not None:
+            return self._step.description()
+        return self._declaration.metadata.description
+
+    def requiredArgs(self):
+        if self._step is not None:
+            return self._step.requiredArgs()
+        return set(self._declaration.metadata.requiredArgs)
+
+    def dependencies(self):
+        if self._step is not None:
+            return self._step.dependencies()
+        return list(self._stepOutputsToLoad)
+
+    def setLoadStepOutputs(self, steps):
+        self._stepOutputsToLoad = list(steps)
+        self._record("setLoadStepOutputs", (steps,), {})
+
+    def setManager(self, mgr):
+        self._manager = mgr
+        if self._step is not None:
+            self._step.setManager(mgr)
+
+    """ Whether the step module has been imported and the step created
+    """
+    def created(self):
+        return self._step is not None
+
+    """ Get the actual step, created on first call
+    """
+    def step(self):
+        if self._step is None:
+            stepClass = StepRegistry.stepClass(self._declaration.className)
+            if stepClass.metadata != self._declaration.metadata:
+                raise RuntimeError("StepRegistry: step class {0} declared with the metadata of step {1}, got {2}".format(self._declaration.className, self._declaration.metadata.name, stepClass.metadata.name))
+            step = stepClass(*self._args, **self._kwargs)
+
+            for method, args, kwargs in self._calls:
+                getattr(step, method)(*args, **kwargs)
+            if self._manager is not None:
+                step.setManager(self._manager)
+
+            logging.getLogger("stepRegistry").debug("Created step {0} ({1}.{2})".format(step.name(), self._declaration.module, self._declaration.className))
+            self._calls = []
+            self._step = step
+        return self._step
+
+    def _record(self, method, args, kwargs):
+        if self._step is not None:
+            getattr(self._step, method)(*args, **kwargs)
+        else:
+            self._calls.append((method, args, kwargs))
+
+    def __getattr__(self, attr):
+        # only called for the attributes not defined by the proxy
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr.startswith("set") and self._step is None:
+            return lambda *args, **kwargs: self._record(attr, args, kwargs)
+        return getattr(self.step(), attr)
+
+
+for _className, _module, _metadata in [
+        ("MipScaleStep", "calibration.MipScaleStep", StepMetadata.mipScaleMetadata),
+        ("SplitDigiMipScaleStep", "calibration.MipScaleStep", StepMetadata.mipScaleMetadata),
+        ("ILDCaloDigiMipScaleStep", "calibration.MipScaleStep", StepMetadata.mipScaleMetadata),
+        ("EcalEnergyStep", "calibration.EcalEnergyStep", StepMetadata.ecalEnergyMetadata),
+        ("SplitRecoEcalEnergyStep", "calibration.EcalEnergyStep", StepMetadata.ecalEnergyMetadata),
+        ("ILDCaloDigiEcalEnergyStep", "calibration.EcalEnergyStep", StepMetadata.ecalEnergyMetadata),
+        ("HcalEnergyStep", "calibration.HcalEnergyStep", StepMetadata.hcalEnergyMetadata),
+        ("SplitRecoHcalEnergyStep", "calibration.HcalEnergyStep", StepMetadata.hcalEnergyMetadata),
+        ("ILDCaloDigiHcalEnergyStep", "calibration.HcalEnergyStep", StepMetadata.hcalEnergyMetadata),
+        ("PandoraMipScaleStep", "calibration.PandoraMipScaleStep", StepMetadata.pandoraMipScaleMetadata),
+        ("PandoraEMScaleStep", "calibration.PandoraEMScaleStep", StepMetadata.pandoraEMScaleMetadata),
+        ("PandoraHadScaleStep", "calibration.PandoraHadScaleStep", StepMetadata.pandoraHadScaleMetadata),
+        ("PandoraSoftCompStep", "calibration.PandoraSoftCompStep", StepMetadata.pandoraSoftCompMetadata)]:
+    StepRegistry.declare(_className, _module, _metadata)
+
+
+
+#
@@ -0,0 +1,140 @@
+#
+
+""" Dependency graph scheduler of the calibration steps.
+    The step dependencies are the step outputs they load (see CalibrationStep.setLoadStepOutputs).
+    A step is started as soon as its dependencies are completed and enough cores are available
+    in the global core budget. Each step runs on its own copy of the calibration store, its
+    step element is committed in the calibration store after each iteration and once completed.
+    When a step fails, the steps depending on it are skipped, the other branches keep running.
+"""
+
+import logging
+import threading
+from calibration.ProcessTools import setResourceAccounting
+from calibration.Trace import Tracer
+
+
+""" Run a step on the calibration store (init, run, writeOutput) with its
+    resource accounting and trace spans. The step changes are committed at the end
+"""
+def runStep(step, config):
+    tracer = Tracer.instance()
+    setResourceAccounting(step.resourceAccounting())
+    try:
+        with tracer.span(step.name(), "step"):
+            with tracer.span("init", "step"):
+                step.init(config)
+            with tracer.span("run", "step"):
+                step.run(config)
+            with tracer.span("writeOutput", "step"):
+                step.writeOutput(config)
+                step.writeResourceSummary(config)
+                config.commitOutput(step.name(), step.resourceAccounting().summary())
+    finally:
+        setResourceAccounting(None)
+
+
+class StepScheduler(object):
+    def __init__(self, steps, maxNCores):
+        self._steps = list(steps)
+        self._maxNCores = max(1, int(maxNCores))
+        self._condition = threading.Condition()
+        self._completionCallback = None
+        self._logger = logging.getLogger("stepScheduler")
+
+        self._usedCores = 0
+        self._running = set()
+        self._completed = set()
+        self._failed = {}
+
+    """ Set a function called with each completed step (after merging its outputs)
+    """
+    def setCompletionCallback(self, callback):
+        self._completionCallback = callback
+
+    """ Get the dependencies of a step among the scheduled steps
+    """
+    def _dependencies(self, step, stepNames):
+        return [name for name in step.dependencies() if name in stepNames and name != step.name()]
+
+    """ Run all the steps on the calibration store.
+        Raises the exception of the first failed step, after all runnable steps are processed
+    """
+    def run(self, config):
+        stepNames = set([step.name() for step in self._steps])
+        pending = list(self._steps)
+        firstException = None
+
+        with self._condition:
+            while pending or self._running:
+                for step in list(pending):
+                    dependencies = self._dependencies(step, stepNames)
+                    failedDependencies = [name for name in dependencies if name in self._failed]
+
+                    if failedDependencies:
+                        pending.remove(step)
+                        self._failed[step.name()] = None
+                        self._logger.error("Step {0} skipped, dependencies failed : {1}".format(step.name(), ", ".join(failedDependencies)))
+                        continue
+
+                    if [name for name in dependencies if name not in self._completed]:
+                        continue
+
+                    nCores = min(step.nCores(), self._maxNCores)
+                    if self._running and self._usedCores + nCores > self._maxNCores:
+                        continue
+
+                    pending.remove(step)
+                    self._startStep(step, nCores, config.copy())
+
+                if not self._running:
+                    if pending:
+                        raise RuntimeError("StepScheduler: unresolved step dependencies for {0}".format(", ".join([step.name() for step in pending])))
+                    break
+
+                self._condition.wait(1.)
+
+        for step in self._steps:
+            exception = self._failed.get(step.name())
+            if exception is not None:
+                firstException = exception
+                break
+
+        if firstException is not None:
+            raise firstException
+
+    def _startStep(self, step, nCores, stepConfig):
+        self._usedCores = self._usedCores + nCores
+        self._running.add(step.name())
+        self._logger.info("Starting step {0} ({1} core(s), {2}/{3} used)".format(step.name(), nCores, self._usedCores, self._maxNCores))
+
+        thread = threading.Thread(target=self._runStep, args=(step, nCores, stepConfig), name=step.name())
+        thread.daemon = True
+        thread.start()
+
+    def _runStep(self, step, nCores, stepConfig):
+        exception = None
+        try:
+            runStep(step, stepConfig)
+        except Exception as e:
+            self._logger.error("Caught exception while running step {0}: {1}".format(step.name(), str(e)))
+            exception = e
+
+        with self._condition:
+            try:
+                if exception is None:
+                    self._completed.add(step.name())
+                    if self._completionCallback is not None:
+                        self._completionCallback(step)
+                else:
+                    self._failed[step.name()] = exception
+            except Exception as e:
+                self._failed[step.name()] = e
+            finally:
+                self._running.discard(step.name())
+                self._usedCores = self._usedCores - nCores
+                self._condition.notify_all()
+
+
+
+#
@@ -0,0 +1,137 @@
+#
+
+""" Timeline trace of a calibration run, in the chrome trace event format
+    (viewable in chrome://tracing or https://ui.perfetto.dev).
+    The calibration phases are recorded as nested spans on the track of the thread
+    running them. The external processes are recorded on separate process tracks,
+    so that concurrent processes (i.e parallel marlin instances) never overlap.
+    The tracer is disabled by default and costs nothing until enabled.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+
+""" Tracer class.
+    Use Tracer.instance() to get the tracer shared by the whole package
+"""
+class Tracer(object):
+    # the process tracks ids start after the thread ids
+    _processTrackOffset = 1000
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    """ Get the shared tracer
+    """
+    @classmethod
+    def instance(cls):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self._logger = logging.getLogger("trace")
+        self._lock = threading.Lock()
+        self._traceFile = None
+        self._events = []
+        self._origin = time.time()
+        self._pid = os.getpid()
+        self._threadIds = {}
+        self._freeTracks = []
+        self._nTracks = 0
+
+    """ Enable the tracing. The trace is written in the given file by write()
+    """
+    def enable(self, traceFile):
+        with self._lock:
+            self._traceFile = traceFile
+            self._events = []
+            self._origin = time.time()
+
+    def enabled(self):
+        return self._traceFile is not None
+
+    """ The current trace timestamp (microseconds)
+    """
+    def now(self):
+        return (time.time() - self._origin) * 1e6
+
+    def _threadId(self):
+        thread = threading.current_thread()
+        with self._lock:
+            if thread.ident not in self._threadIds:
+                tid = len(self._threadIds) + 1
+                self._threadIds[thread.ident] = tid
+                self._events.append({"name" : "thread_name", "ph" : "M", "pid" : self._pid, "tid" : tid, "args" : {"name" : thread.name}})
+            return self._threadIds[thread.ident]
+
+    """ Record a span between two timestamps, on the given track (default current thread)
+    """
+    def completeEvent(self, name, category, start, end, track=None, args=None):
+        if not self.enabled():
+            return
+        event = {"name" : name, "cat" : category, "ph" : "X", "pid" : self._pid,
+                 "tid" : track if track is not None else self._threadId(),
+                 "ts" : start, "dur" : max(0., end - start)}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+
+    """ Record a span around a block of code, i.e :
+        with Tracer.instance().span("run", "step"):
+            ...
+    """
+    @contextlib.contextmanager
+    def span(self, name, category, args=None):
+        if not self.enabled():
+            yield
+            return
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.completeEvent(name, category, start, self.now(), None, args)
+
+    """ Get a free process track (None if the tracing is disabled)
+    """
+    def acquireTrack(self):
+        if not self.enabled():
+            return None
+        with self._lock:
+            if self._freeTracks:
+                self._freeTracks.sort()
+                return self._freeTracks.pop(0)
+            self._nTracks = self._nTracks + 1
+            track = self._processTrackOffset + self._nTracks
+            self._events.append({"name" : "thread_name", "ph" : "M", "pid" : self._pid, "tid" : track, "args" : {"name" : "processes {0}".format(self._nTracks)}})
+            return track
+
+    """ Give back a process track
+    """
+    def releaseTrack(self, track):
+        if track is None:
+            return
+        with self._lock:
+            self._freeTracks.append(track)
+
+    """ Write the trace file (if enabled)
+    """
+    def write(self):
+        if not self.enabled():
+            return
+        with self._lock:
+            events = list(self._events)
+        with open(self._traceFile, "w") as f:
+            json.dump({"traceEvents" : events, "displayTimeUnit" : "ms"}, f)
+        self._logger.info("Trace written in {0} ({1} events)".format(self._traceFile, len(events)))
+
+
+
+#
@@ -0,0 +1,157 @@
+#
+
+""" Working directories of a calibration run.
+    With a workspace root directory, each run gets its own directory
+    (<root>/run_<date>_<unique>), each step a sub-directory and each iteration
+    a sub-directory of its step. The temporary files (steering files, pandora
+    settings, calibrator outputs) go in the tmp directory of the run.
+    Several calibrations can then run concurrently on the same node.
+    Without root directory, the files go in the current directory and the
+    temporary files in the system temporary directory, as before.
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+
+class Workspace(object):
+    # marker file written in a run directory when the run is over (see finalize)
+    completionMarker = ".completed"
+    # retention policies of the run directories
+    keepAll = "all"
+    keepFailed = "failed"
+    keepNone = "none"
+    retentionPolicies = [keepAll, keepFailed, keepNone]
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    """ Get the shared workspace (current directory if not configured)
+    """
+    @classmethod
+    def instance(cls):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    """ Configure the shared workspace. See Workspace constructor
+    """
+    @classmethod
+    def configure(cls, rootDirectory=None, retention=keepAll, maxNRuns=0):
+        with cls._instanceLock:
+            cls._instance = cls(rootDirectory, retention, maxNRuns)
+            return cls._instance
+
+    """ Constructor. The retention policy applies to the run directory at the end of the run.
+        If maxNRuns is positive, only the maxNRuns most recent run directories are kept in the root directory
+    """
+    def __init__(self, rootDirectory=None, retention=keepAll, maxNRuns=0):
+        if retention not in Workspace.retentionPolicies:
+            raise ValueError("Workspace: unknown retention policy '{0}'".format(retention))
+
+        self._logger = logging.getLogger("workspace")
+        self._lock = threading.Lock()
+        self._rootDirectory = os.path.abspath(rootDirectory) if rootDirectory else None
+        self._retention = retention
+        self._maxNRuns = int(maxNRuns)
+        self._runDirectory = None
+        self._tmpDirectory = None
+
+        if self._rootDirectory is not None:
+            if not os.path.isdir(self._rootDirectory):
+                os.makedirs(self._rootDirectory)
+            prefix = "run_{0}_".format(time.strftime("%Y%m%d-%H%M%S"))
+            self._runDirectory = tempfile.mkdtemp(prefix=prefix, dir=self._rootDirectory)
+            self._tmpDirectory = os.path.join(self._runDirectory, "tmp")
+            os.mkdir(self._tmpDirectory)
+            self._logger.info("Workspace run directory: {0}".format(self._runDirectory))
+
+    def _makeDirectory(self, directory):
+        with self._lock:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        return directory
+
+    """ The directory of the run (current directory if no workspace)
+    """
+    def runDirectory(self):
+        return self._runDirectory if self._runDirectory is not None else "."
+
+    """ The directory of the temporary files (None for the system temporary directory)
+    """
+    def tmpDirectory(self):
+        return self._tmpDirectory
+
+    """ The directory of a step, or of a step iteration
+    """
+    def stepDirectory(self, stepName, iteration=None):
+        if self._runDirectory is None:
+            return "."
+        directory = os.path.join(self._runDirectory, stepName)
+        if iteration is not None:
+            directory = os.path.join(directory, "iter{0}".format(iteration))
+        return self._makeDirectory(directory)
+
+    """ The path of a file produced by a step (or a step iteration)
+    """
+    def stepPath(self, stepName, fileName, iteration=None):
+        return os.path.join(self.stepDirectory(stepName, iteration), fileName)
+
+    """ Resolve a path relative to the run directory. Absolute paths are unchanged
+    """
+    def resolve(self, path):
+        if os.path.isabs(path) or self._runDirectory is None:
+            return path
+        return os.path.normpath(os.path.join(self._runDirectory, path))
+
+    """ Create a temporary file in the tmp directory. The file descriptor is closed,
+        the file name is returned. The file is removed with the tmp directory
+    """
+    def mkstemp(self, suffix="", prefix="tmp"):
+        fhandle, fileName = tempfile.mkstemp(suffix=suffix, prefix=prefix, dir=self._tmpDirectory)
+        os.close(fhandle)
+        return fileName
+
+    """ Apply the retention policy at the end of the run
+    """
+    def finalize(self, success):
+        if self._runDirectory is None:
+            return
+
+        keepRun = self._retention == Workspace.keepAll or (self._retention == Workspace.keepFailed and not success)
+        if not keepRun:
+            self._logger.info("Removing run directory {0}".format(self._runDirectory))
+            shutil.rmtree(self._runDirectory, ignore_errors=True)
+        else:
+            if success:
+                shutil.rmtree(self._tmpDirectory, ignore_errors=True)
+            # the run directory can now be pruned by the other runs
+            with open(os.path.join(self._runDirectory, self.completionMarker), "w") as f:
+                f.write("success\n" if success else "failed\n")
+
+        if self._maxNRuns > 0:
+            self._removeOldRuns()
+
+    """ Remove the oldest completed run directories, keeping the maxNRuns most recent ones.
+        The directories of the runs still running (no completion marker) are never removed
+    """
+    def _removeOldRuns(self):
+        runDirectories = [os.path.join(self._rootDirectory, name) for name in os.listdir(self._rootDirectory) if name.startswith("run_")]
+        runDirectories = [directory for directory in runDirectories if directory != self._runDirectory and os.path.isfile(os.path.join(directory, self.completionMarker))]
+        runDirectories.sort(key=lambda directory: os.path.getmtime(os.path.join(directory, self.completionMarker)), reverse=True)
+        # the current run counts as the most recent one if kept
+        if os.path.isdir(self._runDirectory):
+            runDirectories.insert(0, self._runDirectory)
+
+        for directory in runDirectories[self._maxNRuns:]:
+            self._logger.info("Removing old run directory {0}".format(directory))
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+
+#
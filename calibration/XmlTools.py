@@ -1,34 +1,38 @@
 
+import logging
+
+_logger = logging.getLogger("xmlTools")
+
 try:
     from lxml import etree
-    print("running with lxml.etree")
+    _logger.debug("running with lxml.etree")
 except ImportError:
     try:
         # nafhh special case
         import etree
-        print("running with etree.so lib on Python 2.5+")
+        _logger.debug("running with etree.so lib on Python 2.5+")
     except ImportError:    
         try:
             # Python 2.5
             import xml.etree.ElementTree as etree
-            print("running with ElementTree on Python 2.5+")
+            _logger.debug("running with ElementTree on Python 2.5+")
         except ImportError:
             try:
                 # Python 2.5
                 import xml.etree.cElementTree as etree
-                print("running with cElementTree on Python 2.5+")
+                _logger.debug("running with cElementTree on Python 2.5+")
             except ImportError:
                 try:
                     # normal ElementTree install
                     import elementtree.ElementTree as etree
-                    print("running with ElementTree")
+                    _logger.debug("running with ElementTree")
                 except ImportError:
                     try:
                         # normal cElementTree install
                         import cElementTree as etree
-                        print("running with cElementTree")
+                        _logger.debug("running with cElementTree")
                     except ImportError:
-                        print("Failed to import ElementTree from any known place")
+                        _logger.error("Failed to import ElementTree from any known place")
 
 def createXMLParser():
     if etree.LXML_VERSION >= (3, 2, 1, 0):
@@ -66,6 +66,7 @@ energyList = parsed.energies
 if parsed.runMarlin :
     marlinMaster = ParallelMarlin()
     marlinMaster.setMaxNParallelInstances(int(parsed.maxParallel))
+    marlinMaster.setFailurePolicy(ParallelMarlin.failFast)
 
     lcioFilePattern = parsed.lcioFilePattern
     if lcioFilePattern.find("%{energy}") == -1 :
@@ -105,9 +106,13 @@ if parsed.runMarlin :
         except:
             pass
         
-        marlinMaster.addMarlinInstance(marlin)
+        marlinMaster.addMarlinInstance(marlin, "energy {0}".format(energy))
 
-    marlinMaster.run()
+    results = marlinMaster.run()
+    failedEnergies = [result.name for result in results if result.status != 0]
+
+    if failedEnergies:
+        raise RuntimeError("Marlin failed or not run for {0}".format(", ".join(failedEnergies)))
 
 
 if not parsed.noMinimizer :
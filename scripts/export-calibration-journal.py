@@ -0,0 +1,27 @@
+#!/usr/bin/python
+
+""" Export a calibration journal (see --journal option of the calibration scripts)
+    to the calibration xml format. The input element is taken from the input calibration file
+"""
+
+import argparse
+from calibration.CalibrationJournal import CalibrationJournal
+
+parser = argparse.ArgumentParser("Export a calibration journal to the calibration xml format:",
+                                     formatter_class=argparse.RawTextHelpFormatter)
+
+parser.add_argument("--journal", action="store",
+                        help="The calibration journal (json lines)", required = True)
+
+parser.add_argument("--inputCalibrationFile", action="store",
+                        help="The XML input calibration file", required = True)
+
+parser.add_argument("--outputCalibrationFile", action="store",
+                        help="The XML output calibration file", required = True)
+
+parsed = parser.parse_args()
+
+journal = CalibrationJournal(parsed.journal)
+journal.exportXml(parsed.inputCalibrationFile, parsed.outputCalibrationFile)
+
+#
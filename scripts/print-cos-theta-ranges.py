@@ -14,8 +14,12 @@ parser = argparse.ArgumentParser("Running energy calibration:",
 parser.add_argument("--compactFile", action="store", default="",
                         help="The compact XML file", required = True)
 
+parser.add_argument("--geometryBackend", action="store", default=GeometryInterface.gearBackend, choices=GeometryInterface.backends,
+                        help="How to read the detector geometry : gear (convertToGear) or compact (compact file reader, no conversion)", required = False)
+
 parsed = parser.parse_args()
 
+GeometryInterface.backend = parsed.geometryBackend
 geo = GeometryInterface(parsed.compactFile)
 
 ebmin, ebmax = geo.getEcalBarrelCosThetaRange()
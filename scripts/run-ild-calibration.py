@@ -11,14 +11,7 @@
 
 from calibration.CalibrationManager import CalibrationManager
 from calibration.MarlinXML import MarlinXML
-from calibration.MipScaleStep import *
-from calibration.EcalEnergyStep import *
-from calibration.HcalEnergyStep import *
-from calibration.PandoraMipScaleStep import *
-from calibration.PandoraEMScaleStep import *
-from calibration.PandoraHadScaleStep import *
-from calibration.PandoraSoftCompStep import *
-from calibration.SwitchStep import *
+from calibration.StepRegistry import StepRegistry
 
 
 if __name__ == "__main__":
@@ -54,7 +47,7 @@ if __name__ == "__main__":
                             help="The maximum number of marlin instance to run in parallel (process) for soft comp")
 
     # mip scale for all detectors
-    mipScaleStep = SplitDigiMipScaleStep()
+    mipScaleStep = StepRegistry.create("SplitDigiMipScaleStep")
     stepNames.append(mipScaleStep.name())
     mipScaleStep.setRunProcessors(["InitDD4hep", "MyPfoAnalysis"])
     mipScaleStep.setPfoAnalysisProcessor(pfoAnalysisProcessor)
@@ -64,7 +57,7 @@ if __name__ == "__main__":
     manager.addStep( mipScaleStep )
 
     # Ecal calibration
-    ecalEnergyStep = SplitRecoEcalEnergyStep()
+    ecalEnergyStep = StepRegistry.create("SplitRecoEcalEnergyStep")
     ecalEnergyStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(ecalEnergyStep.name())
     ecalEnergyStep.setEcalRecoNames("MyEcalBarrelReco", "MyEcalEndcapReco", "MyEcalRingReco")
@@ -84,7 +77,7 @@ if __name__ == "__main__":
     manager.addStep( ecalEnergyStep )
 
     # Hcal calibration
-    hcalEnergyStep = SplitRecoHcalEnergyStep()
+    hcalEnergyStep = StepRegistry.create("SplitRecoHcalEnergyStep")
     hcalEnergyStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(hcalEnergyStep.name())
     hcalEnergyStep.setHcalRecoNames("MyHcalBarrelReco", "MyHcalEndcapReco", "MyHcalRingReco")
@@ -106,7 +99,7 @@ if __name__ == "__main__":
 
     # advanced PandoraPFA calibration
     # Pandora mip scale calibration
-    pandoraMipScaleStep = PandoraMipScaleStep()
+    pandoraMipScaleStep = StepRegistry.create("PandoraMipScaleStep")
     pandoraMipScaleStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(pandoraMipScaleStep.name())
     pandoraMipScaleStep.setRunProcessors(["MyAIDAProcessor", "InitDD4hep",
@@ -124,7 +117,7 @@ if __name__ == "__main__":
     manager.addStep( pandoraMipScaleStep )
 
     # Pandora EM scale calibration
-    pandoraEMScaleStep = PandoraEMScaleStep()
+    pandoraEMScaleStep = StepRegistry.create("PandoraEMScaleStep")
     pandoraEMScaleStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(pandoraEMScaleStep.name())
     pandoraEMScaleStep.setPfoAnalysisProcessor(pfoAnalysisProcessor)
@@ -132,16 +125,16 @@ if __name__ == "__main__":
     manager.addStep( pandoraEMScaleStep )
 
     # Pandora hadronic scale calibration
-    pandoraHadScaleStep = PandoraHadScaleStep()
+    pandoraHadScaleStep = StepRegistry.create("PandoraHadScaleStep")
     pandoraHadScaleStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(pandoraHadScaleStep.name())
     pandoraHadScaleStep.setPfoAnalysisProcessor(pfoAnalysisProcessor)
     pandoraHadScaleStep.setMarlinPandoraProcessor(pandoraProcessor)
     manager.addStep( pandoraHadScaleStep )
 
-    pandoraSoftCompStep = PandoraSoftCompStep()
+    pandoraSoftCompStep = StepRegistry.create("PandoraSoftCompStep")
     pandoraSoftCompStep.setLoadStepOutputs(list(stepNames))
-    stepNames.append(pandoraHadScaleStep.name())
+    stepNames.append(pandoraSoftCompStep.name())
     pandoraSoftCompStep.setPfoAnalysisProcessor(pfoAnalysisProcessor)
     pandoraSoftCompStep.setMarlinPandoraProcessor(pandoraProcessor)
     manager.addStep( pandoraSoftCompStep )
@@ -11,12 +11,7 @@
 
 from calibration.CalibrationManager import CalibrationManager
 from calibration.MarlinXML import MarlinXML
-from calibration.MipScaleStep import *
-from calibration.EcalEnergyStep import *
-from calibration.HcalEnergyStep import *
-from calibration.PandoraMipScaleStep import *
-from calibration.PandoraEMScaleStep import *
-from calibration.PandoraHadScaleStep import *
+from calibration.StepRegistry import StepRegistry
 
 
 if __name__ == "__main__":
@@ -31,7 +26,7 @@ if __name__ == "__main__":
     manager = CalibrationManager()
 
     # mip scale for all detectors
-    mipScaleStep = SplitDigiMipScaleStep()
+    mipScaleStep = StepRegistry.create("SplitDigiMipScaleStep")
     stepNames.append(mipScaleStep.name())
     mipScaleStep.setRunProcessors(["InitDD4hep", "MyPfoAnalysis"])
     mipScaleStep.setPfoAnalysisProcessor(pfoAnalysisProcessor)
@@ -41,7 +36,7 @@ if __name__ == "__main__":
     manager.addStep( mipScaleStep )
 
     # Ecal calibration
-    ecalEnergyStep = SplitRecoEcalEnergyStep()
+    ecalEnergyStep = StepRegistry.create("SplitRecoEcalEnergyStep")
     ecalEnergyStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(ecalEnergyStep.name())
     ecalEnergyStep.setEcalRecoNames("ECalBarrelReco", "ECalEndcapReco", None)
@@ -57,7 +52,7 @@ if __name__ == "__main__":
     manager.addStep( ecalEnergyStep )
 
     # Hcal calibration
-    hcalEnergyStep = SplitRecoHcalEnergyStep()
+    hcalEnergyStep = StepRegistry.create("SplitRecoHcalEnergyStep")
     hcalEnergyStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(hcalEnergyStep.name())
     hcalEnergyStep.setHcalRecoNames("HCalBarrelReco", "HCalEndcapReco", None)
@@ -75,7 +70,7 @@ if __name__ == "__main__":
 
     # advanced PandoraPFA calibration
     # Pandora mip scale calibration
-    pandoraMipScaleStep = PandoraMipScaleStep()
+    pandoraMipScaleStep = StepRegistry.create("PandoraMipScaleStep")
     pandoraMipScaleStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(pandoraMipScaleStep.name())
     pandoraMipScaleStep.setRunProcessors(["MyAIDAProcessor", "InitDD4hep",
@@ -89,7 +84,7 @@ if __name__ == "__main__":
     manager.addStep( pandoraMipScaleStep )
 
     # Pandora EM scale calibration
-    pandoraEMScaleStep = PandoraEMScaleStep()
+    pandoraEMScaleStep = StepRegistry.create("PandoraEMScaleStep")
     pandoraEMScaleStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(pandoraEMScaleStep.name())
     pandoraEMScaleStep.setPfoAnalysisProcessor(pfoAnalysisProcessor)
@@ -97,7 +92,7 @@ if __name__ == "__main__":
     manager.addStep( pandoraEMScaleStep )
         
     # Pandora hadronic scale calibration
-    pandoraHadScaleStep = PandoraHadScaleStep()
+    pandoraHadScaleStep = StepRegistry.create("PandoraHadScaleStep")
     pandoraHadScaleStep.setLoadStepOutputs(list(stepNames))
     stepNames.append(pandoraHadScaleStep.name())
     pandoraHadScaleStep.setPfoAnalysisProcessor(pfoAnalysisProcessor)
@@ -13,7 +13,9 @@
 """
 
 from calibration.DDSimCalibration import DDSimCalibration
+from calibration.Executors import executors, setDefaultExecutor, BatchExecutor
 import os
+import sys
 import argparse
 
 compactFile = ""
@@ -36,8 +38,26 @@ parser.add_argument("--physicsList", action="store", dest="physicsList", default
 parser.add_argument("--steeringFile", action="store", dest="steeringFile", default=steeringFile,
                     help="DDSim steering file", required = True)
 
+parser.add_argument("--eventsPerShard", action="store", default=0, type=int,
+                    help="The maximum number of events per ddsim process. The simulations are split in shards with their own seed and output file (default 0, no sharding)", required = False)
+
+parser.add_argument("--maxNProcesses", action="store", default=0, type=int,
+                    help="The maximum number of concurrent ddsim processes (default 0, limited by the cores and memory only)", required = False)
+
+parser.add_argument("--seed", action="store", default=None, type=int,
+                    help="The base random seed. Each shard gets its own seed (seed, seed+1, ...). Default random with --eventsPerShard", required = False)
+
+parser.add_argument("--executor", action="store", default="local", choices=sorted(executors.keys()),
+                    help="Where the ddsim processes run : on this node, as SGE or HTCondor batch jobs, or on the local fake scheduler (default local)", required = False)
+
+parser.add_argument("--batchOptions", action="store", default="",
+                    help="Additional batch submission options (qsub options, or condor submit commands separated by ';')", required = False)
+
 parsed = parser.parse_args()
 
+BatchExecutor.submitOptions = parsed.batchOptions
+setDefaultExecutor(parsed.executor)
+
 commonParameters = {}
 commonParameters["numberOfEvents"] = parsed.numberOfEvents
 commonParameters["physicsList"] = parsed.physicsList
@@ -61,12 +81,29 @@ muonParameters["outputFile"] = "ddsim-muon-calibration.slcio"
 simCalib = DDSimCalibration()
 simCalib.setSterringFile(parsed.steeringFile)
 simCalib.setCompactFile(parsed.compactFile)
+simCalib.setEventsPerShard(parsed.eventsPerShard)
+simCalib.setMaxNProcesses(parsed.maxNProcesses)
+if parsed.seed is not None:
+    simCalib.setSeed(parsed.seed)
 
 simCalib.addSimulation(photonParameters)
 simCalib.addSimulation(muonParameters)
 simCalib.addSimulation(kaon0LParameters)
 
-simCalib.run()
+results = simCalib.run()
+failedResults = [result for result in results if result.status != 0]
+
+# don't let a calibration run on a partial sample
+if failedResults:
+    for result in failedResults:
+        print >> sys.stderr, "Simulation '{0}' failed with status {1}".format(result.name, result.status)
+    sys.exit(1)
+
+# the output files, as calibration script arguments
+photonFiles, muonFiles, kaon0LFiles = simCalib.simulationOutputFiles()
+print "--lcioPhotonFile " + " ".join(photonFiles)
+print "--lcioKaon0LFile " + " ".join(kaon0LFiles)
+print "--lcioMuonFile " + " ".join(muonFiles)
 
 
 #
@@ -0,0 +1,83 @@
+#
+
+""" Comparison of the compact file reader with the gear conversion,
+    on a sample compact file and its gear file (tests/data)
+"""
+
+import os
+import unittest
+from calibration.XmlTools import etree, createXMLParser
+from calibration.CompactReader import CompactReader
+from calibration.GeometryInterface import GeometryInterface
+
+dataDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+compactFile = os.path.join(dataDirectory, "compact.xml")
+gearFile = os.path.join(dataDirectory, "gear_compact.xml")
+
+
+""" Create a geometry interface from a summary, without gear cache
+"""
+def createGeometry(summary):
+    geometry = GeometryInterface.__new__(GeometryInterface)
+    geometry._compactFile = compactFile
+    geometry._summary = summary
+    return geometry
+
+""" Compute the summary of the sample gear file, as done by the gear backend
+"""
+def gearSummary():
+    geometry = createGeometry(None)
+    geometry._xmlTree = etree.parse(gearFile, createXMLParser())
+    return geometry._computeGearSummary()
+
+
+@unittest.skipIf(not hasattr(etree, "LXML_VERSION"), "lxml not available")
+class CompactReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.compactSummary = CompactReader(compactFile).summary()
+        self.gearSummary = gearSummary()
+
+    def testConstants(self):
+        reader = CompactReader(compactFile)
+        # defined from a constant declared later in the file
+        self.assertAlmostEqual(reader.constant("Ecal_half_length"), 2350.)
+        self.assertAlmostEqual(reader.constant("Hcal_inner_radius"), 2058.)
+        self.assertAlmostEqual(reader.evaluate("2*Ecal_endcap_zmin/cm"), 482.2)
+
+    def testSummary(self):
+        compactDetectors = self.compactSummary["detectors"]
+        gearDetectors = self.gearSummary["detectors"]
+        self.assertEqual(sorted(compactDetectors.keys()), sorted(gearDetectors.keys()))
+        self.assertEqual(len(gearDetectors), 6)
+
+        for key, gearDetector in gearDetectors.items():
+            compactDetector = compactDetectors[key]
+            self.assertEqual(sorted(compactDetector.keys()), sorted(gearDetector.keys()))
+            for name, value in gearDetector.items():
+                if value is None:
+                    self.assertIsNone(compactDetector[name], "{0} {1}".format(key, name))
+                else:
+                    self.assertAlmostEqual(compactDetector[name], value, 6, "{0} {1}".format(key, name))
+
+    def testGeometryQueries(self):
+        compactGeometry = createGeometry(self.compactSummary)
+        gearGeometry = createGeometry(self.gearSummary)
+
+        for query in ["getEcalBarrelCosThetaRange", "getEcalEndcapCosThetaRange", "getHcalBarrelCosThetaRange", "getHcalEndcapCosThetaRange"]:
+            for compactValue, gearValue in zip(getattr(compactGeometry, query)(), getattr(gearGeometry, query)()):
+                self.assertAlmostEqual(compactValue, gearValue, 9, query)
+
+        self.assertAlmostEqual(compactGeometry.getEcalGeometryFactor(), gearGeometry.getEcalGeometryFactor(), 9)
+        self.assertAlmostEqual(compactGeometry.getHcalGeometryFactor(), gearGeometry.getHcalGeometryFactor(), 9)
+
+    def testKnownValues(self):
+        ecalBarrel = self.gearSummary["detectors"]["EcalBarrel/CalorimeterParameters"]
+        self.assertAlmostEqual(ecalBarrel["outer_r"], 1894.3)
+        self.assertAlmostEqual(ecalBarrel["absorberSum"], 79.8)
+        self.assertAlmostEqual(ecalBarrel["sensitiveSum"], 14.5)
+        hcalRing = self.gearSummary["detectors"]["HcalRing/CalorimeterParameters"]
+        self.assertAlmostEqual(hcalRing["outer_z"], 2662.)
+
+
+
+#
@@ -0,0 +1,169 @@
+#
+
+""" Tests of the batch execution path, through the local fake batch scheduler
+"""
+
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from calibration.Executors import BatchExecutor, SGEExecutor, createExecutor, setDefaultExecutor, runJob
+from calibration.Marlin import Marlin, ParallelMarlin
+from calibration.DDSimCalibration import DDSimCalibration
+
+
+""" Marlin instance running a shell command instead of marlin
+"""
+class ShellMarlin(Marlin):
+    def __init__(self, command):
+        Marlin.__init__(self)
+        self._command = command
+
+    def createProcessArgs(self):
+        return ["/bin/sh", "-c", self._command]
+
+    def getOutputFiles(self):
+        return []
+
+
+class FakeExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="test_executors_")
+        BatchExecutor.directory = os.path.join(self.directory, "batch")
+        setDefaultExecutor("fake")
+
+    def tearDown(self):
+        setDefaultExecutor("local")
+        BatchExecutor.directory = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, fileName):
+        return os.path.join(self.directory, fileName)
+
+
+class BatchExecutorTest(FakeExecutorTestCase):
+    def testStatusAndHoldJobIds(self):
+        executor = createExecutor()
+        self.assertFalse(executor.usesLocalResources())
+        executor.startArray([(["/bin/sh", "-c", "sleep 1; touch {0}".format(self.path("first"))], "first", "first", None),
+                             (["/bin/sh", "-c", "exit 3"], "failed", "failed", None)])
+        holdJobIds = executor.jobIds()
+        # the held job only succeeds if the first array is over
+        executor.startArray([(["/bin/sh", "-c", "test -f {0}".format(self.path("first"))], "held", "held", None)], holdJobIds=holdJobIds)
+
+        statuses = {}
+        while executor.nRunning():
+            key, status, wallTime, rusage = executor.wait()
+            statuses[key] = status
+            self.assertEqual(rusage, None)
+        self.assertEqual(statuses, {"first" : 0, "failed" : 3, "held" : 0})
+
+    def testLostJob(self):
+        executor = createExecutor()
+        executor.start(["sleep", "30"], "lost", None, "lost")
+        executor.terminateAll()
+        key, status, wallTime, rusage = executor.wait()
+        self.assertEqual((key, status), ("lost", -1))
+
+    def testRunJob(self):
+        result = runJob(["/bin/sh", "-c", "exit 2"], "job", [self.path("output")])
+        self.assertEqual(result.status, 2)
+        self.assertEqual(result.outputs, [self.path("output")])
+
+    def testUnknownExecutor(self):
+        self.assertRaises(KeyError, setDefaultExecutor, "pbs")
+
+
+class SGEExecutorTest(FakeExecutorTestCase):
+    def testSubmitCommand(self):
+        commands = []
+        def runCommand(args):
+            commands.append(args)
+            return 0, "42.1-2:1\n", ""
+
+        executor = SGEExecutor()
+        executor._runCommand = runCommand
+        jobs = executor.startArray([(["echo", "a"], 0, "echo", None), (["echo", "b"], 1, "echo", None)], holdJobIds=["41"])
+        self.assertEqual([job.jobId for job in jobs], ["42", "42"])
+
+        args = commands[0]
+        self.assertEqual(args[0], "qsub")
+        self.assertEqual(args[args.index("-S")+1], "/bin/bash")
+        self.assertEqual(args[args.index("-t")+1], "1-2")
+        self.assertEqual(args[args.index("-hold_jid")+1], "41")
+        # don't let the poller wait for the jobs
+        executor._jobs.clear()
+
+
+class ParallelMarlinTest(FakeExecutorTestCase):
+    def testStatusPropagation(self):
+        parallelMarlin = ParallelMarlin()
+        for index, command in enumerate(["exit 0", "exit 3", "touch {0}".format(self.path("done"))]):
+            parallelMarlin.addMarlinInstance(ShellMarlin(command), "marlin{0}".format(index))
+        results = parallelMarlin.run()
+        self.assertEqual([result.status for result in results], [0, 3, 0])
+        self.assertEqual([result.name for result in results], ["marlin0", "marlin1", "marlin2"])
+        self.assertTrue(os.path.isfile(self.path("done")))
+
+    def testFailFast(self):
+        parallelMarlin = ParallelMarlin()
+        parallelMarlin.setMaxNParallelInstances(1)
+        parallelMarlin.setFailurePolicy(ParallelMarlin.failFast)
+        for index, command in enumerate(["exit 1", "exit 0", "exit 0"]):
+            parallelMarlin.addMarlinInstance(ShellMarlin(command), "marlin{0}".format(index))
+        results = parallelMarlin.run()
+        self.assertEqual([result.status for result in results], [1, None, None])
+
+
+class DDSimCalibrationTest(FakeExecutorTestCase):
+    def setUp(self):
+        FakeExecutorTestCase.setUp(self)
+        # fake ddsim : writes its output file, fails for protons
+        binDirectory = self.path("bin")
+        os.mkdir(binDirectory)
+        ddsim = os.path.join(binDirectory, "ddsim")
+        with open(ddsim, "w") as f:
+            f.write("#!/bin/sh\n")
+            f.write("while [ $# -gt 0 ]; do case $1 in --outputFile) output=$2;; --gun.particle) particle=$2;; esac; shift; done\n")
+            f.write("[ \"$particle\" = proton ] && exit 5\n")
+            f.write("touch $output\n")
+        os.chmod(ddsim, os.stat(ddsim).st_mode | stat.S_IXUSR)
+        self._path = os.environ["PATH"]
+        os.environ["PATH"] = binDirectory + os.pathsep + self._path
+
+    def tearDown(self):
+        os.environ["PATH"] = self._path
+        FakeExecutorTestCase.tearDown(self)
+
+    def testShards(self):
+        simulation = DDSimCalibration()
+        simulation.setEventsPerShard(50)
+        simulation.setSeed(10)
+        simulation.addSimulation({"particle" : "mu-", "energy" : 10, "numberOfEvents" : 100, "outputFile" : self.path("muon.slcio")})
+        simulation.addSimulation({"particle" : "proton", "energy" : 10, "numberOfEvents" : 50, "outputFile" : self.path("proton.slcio")})
+        results = simulation.run()
+
+        self.assertEqual(sorted([result.status for result in results]), [0, 0, 5])
+        self.assertEqual(simulation.simulationOutputFiles(), [[self.path("muon_shard0.slcio"), self.path("muon_shard1.slcio")], []])
+        for fileName in simulation.simulationOutputFiles()[0]:
+            self.assertTrue(os.path.isfile(fileName))
+
+    def testDefaultSeeds(self):
+        seeds = []
+        for production in range(2):
+            simulation = DDSimCalibration()
+            simulation.setEventsPerShard(50)
+            simulation.addSimulation({"particle" : "mu-", "energy" : 10, "numberOfEvents" : 100, "outputFile" : "muon.slcio"})
+            seeds.append([parameters["seed"] for index, parameters, name in simulation._createShards()])
+        # distinct seeds within and across productions
+        self.assertEqual(seeds[0][1], seeds[0][0] + 1)
+        self.assertNotEqual(seeds[0], seeds[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+
+#
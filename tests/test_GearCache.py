@@ -0,0 +1,59 @@
+#
+
+""" Tests of the gear cache key
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from calibration.GearCache import GearCache
+
+
+class GearCacheKeyTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="test_gear_")
+        self._environment = dict(os.environ)
+        self.cache = GearCache(os.path.join(self._directory, "cache"))
+        self.compactFile = os.path.join(self._directory, "compact.xml")
+        self.includeFile = os.path.join(self._directory, "include.xml")
+        self._write(self.compactFile, '<lccdd><include ref="include.xml"/></lccdd>')
+        self._write(self.includeFile, '<detector name="ECal"/>')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environment)
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _write(self, fileName, content):
+        with open(fileName, "w") as f:
+            f.write(content)
+
+    def testIncludedFileChange(self):
+        key = self.cache.computeKey(self.compactFile, "default")
+        self.assertEqual(key, self.cache.computeKey(self.compactFile, "default"))
+        self.assertNotEqual(key, self.cache.computeKey(self.compactFile, "other"))
+        self._write(self.includeFile, '<detector name="HCal"/>')
+        self.assertNotEqual(key, self.cache.computeKey(self.compactFile, "default"))
+
+    def testSoftwareEnvironment(self):
+        key = self.cache.computeKey(self.compactFile, "default")
+        for variable in GearCache.environmentVariables:
+            os.environ[variable] = "/opt/release/" + variable
+            newKey = self.cache.computeKey(self.compactFile, "default")
+            self.assertNotEqual(key, newKey)
+            key = newKey
+
+    def testConvertToGearPath(self):
+        key = self.cache.computeKey(self.compactFile, "default")
+        binDirectory = os.path.join(self._directory, "bin")
+        os.mkdir(binDirectory)
+        convertToGear = os.path.join(binDirectory, "convertToGear")
+        self._write(convertToGear, "#!/bin/sh\n")
+        os.chmod(convertToGear, 0o755)
+        os.environ["PATH"] = binDirectory + os.pathsep + os.environ.get("PATH", "")
+        self.assertNotEqual(key, self.cache.computeKey(self.compactFile, "default"))
+
+
+
+#
@@ -0,0 +1,96 @@
+#
+
+""" Tests of the marlin event range sharding
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from calibration.XmlTools import etree
+from calibration.Marlin import Marlin
+from calibration.MarlinCache import MarlinCache
+
+steeringContent = """<marlin>
+  <execute>
+    <processor name="MyPfoAnalysis"/>
+  </execute>
+  <global>
+    <parameter name="LCIOInputFiles"> </parameter>
+    <parameter name="MaxRecordNumber" value="0"/>
+    <parameter name="SkipNEvents" value="0"/>
+  </global>
+  <processor name="MyPfoAnalysis" type="PfoAnalysis">
+    <parameter name="RootFile" type="string">PfoAnalysis.root</parameter>
+  </processor>
+</marlin>
+"""
+
+
+@unittest.skipIf(not hasattr(etree, "LXML_VERSION"), "lxml not available")
+class MarlinShardsTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="test_marlin_")
+        steeringFile = os.path.join(self._directory, "steering.xml")
+        with open(steeringFile, "w") as f:
+            f.write(steeringContent)
+        self.marlin = Marlin(steeringFile)
+        self.marlin.setMaxNShards(3)
+        self.marlin.setMinEventsPerShard(500)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    """ Set the input files, given as (name, number of events)
+    """
+    def setInputFiles(self, files):
+        self.marlin.setInputFiles([lcioFile for lcioFile, nEvents in files])
+        self.marlin._nEventsPerFile = dict(files)
+
+    def testOneShardPerFile(self):
+        self.setInputFiles([("f0.slcio", 1000), ("f1.slcio", 1000), ("f2.slcio", 1000)])
+        self.assertEqual(self.marlin._createShards(), [(["f0.slcio"], 0, 0), (["f1.slcio"], 0, 0), (["f2.slcio"], 0, 0)])
+
+    def testSplitLargeFile(self):
+        self.setInputFiles([("f0.slcio", 3000)])
+        # one run header per window
+        self.assertEqual(self.marlin._createShards(), [(["f0.slcio"], 0, 1001), (["f0.slcio"], 1000, 1001), (["f0.slcio"], 2000, 1001)])
+
+    def testGroupSmallFiles(self):
+        self.marlin.setMaxNShards(4)
+        self.setInputFiles([("f{0}.slcio".format(i), 200) for i in range(6)])
+        self.assertEqual(self.marlin._createShards(), [(["f0.slcio", "f1.slcio", "f2.slcio"], 0, 0), (["f3.slcio", "f4.slcio", "f5.slcio"], 0, 0)])
+
+    def testMaxRecordNumber(self):
+        self.setInputFiles([("f0.slcio", 1000), ("f1.slcio", 1000), ("f2.slcio", 1000)])
+        self.marlin.setMaxRecordNumber(1500)
+        # f2 is not read, f1 is truncated (500 events + run header)
+        self.assertEqual(self.marlin._createShards(), [(["f0.slcio"], 0, 501), (["f0.slcio"], 500, 501), (["f1.slcio"], 0, 501)])
+
+    def testNoSharding(self):
+        self.setInputFiles([("f0.slcio", 999)])
+        self.assertEqual(self.marlin._createShards(), [])
+        self.setInputFiles([("f0.slcio", 3000)])
+        self.marlin.setSkipNEvents(10)
+        self.assertEqual(self.marlin._createShards(), [])
+
+    def testCopy(self):
+        cache = MarlinCache(os.path.join(self._directory, "cache"), 1e6)
+        self.marlin.setCache(cache)
+        self.marlin.setMinEventsPerShard(200)
+        self.marlin.addOutputFile("output.slcio")
+        marlin = self.marlin.copy()
+        self.assertEqual(marlin._maxNShards, 3)
+        self.assertEqual(marlin._minEventsPerShard, 200)
+        self.assertTrue(marlin._cache is cache)
+        self.assertEqual(marlin.getOutputFiles(), ["PfoAnalysis.root", "output.slcio"])
+        marlin.addOutputFile("other.slcio")
+        self.assertEqual(self.marlin.getOutputFiles(), ["PfoAnalysis.root", "output.slcio"])
+
+    def testWorkload(self):
+        self.assertEqual(self.marlin.workload(), "Marlin steering.xml")
+        self.assertEqual(self.marlin.copy().workload(), "Marlin steering.xml")
+
+
+
+#
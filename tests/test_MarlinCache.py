@@ -0,0 +1,61 @@
+#
+
+""" Tests of the marlin outputs cache shared between instances
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from calibration import MarlinCache as marlinCacheModule
+from calibration.MarlinCache import MarlinCache
+
+
+class MarlinCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="test_marlin_cache_")
+        self._copyfile = shutil.copyfile
+        self.cacheDirectory = os.path.join(self._directory, "cache")
+        self.outputFile = os.path.join(self._directory, "PfoAnalysis.root")
+        with open(self.outputFile, "w") as f:
+            f.write("pfo analysis")
+
+    def tearDown(self):
+        marlinCacheModule.shutil.copyfile = self._copyfile
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def testStoreRestore(self):
+        MarlinCache(self.cacheDirectory, 1e6).store("key", [self.outputFile])
+        os.remove(self.outputFile)
+
+        # another instance sharing the cache directory
+        cache = MarlinCache(self.cacheDirectory, 1e6)
+        self.assertFalse(cache.restore("other", [self.outputFile]))
+        self.assertTrue(cache.restore("key", [self.outputFile]))
+        with open(self.outputFile) as f:
+            self.assertEqual(f.read(), "pfo analysis")
+
+    def testEvictedWhileRestoring(self):
+        cache = MarlinCache(self.cacheDirectory, 1e6)
+        cache.store("key", [self.outputFile])
+        other = MarlinCache(self.cacheDirectory, 0)
+
+        # the entry is evicted by the other instance before being copied
+        def copyfile(source, destination):
+            other._evict()
+            return self._copyfile(source, destination)
+        marlinCacheModule.shutil.copyfile = copyfile
+
+        self.assertFalse(cache.restore("key", [self.outputFile]))
+        self.assertFalse(os.path.isdir(os.path.join(self.cacheDirectory, "key")))
+
+    def testEviction(self):
+        cache = MarlinCache(self.cacheDirectory, len("pfo analysis"))
+        cache.store("key1", [self.outputFile])
+        os.utime(os.path.join(self.cacheDirectory, "key1"), (0, 0))
+        cache.store("key2", [self.outputFile])
+        self.assertEqual(sorted(os.listdir(self.cacheDirectory)), ["key2"])
+
+
+
+#
@@ -0,0 +1,132 @@
+#
+
+""" Tests of the native PfoAnalysis engine on in-memory columns (no root file needed)
+"""
+
+import unittest
+from calibration.PfoAnalysisEngine import PfoAnalysisTree, numpy
+from calibration.PandoraAnalysis import PandoraAnalysisBinary, EcalCalibrator
+
+
+""" Build a tree from in-memory columns, bypassing the root file reading.
+    Variable size branches are given as (values, counts)
+"""
+def createColumn(values):
+    if isinstance(values, tuple):
+        return numpy.asarray(values[0], dtype=numpy.float64), numpy.asarray(values[1], dtype=numpy.int64)
+    return numpy.asarray(values, dtype=numpy.float64)
+
+def createTree(columns):
+    tree = PfoAnalysisTree.__new__(PfoAnalysisTree)
+    tree._rootFile = "memory"
+    tree._tree = None
+    tree._columns = dict([(name, createColumn(values)) for name, values in columns.items()])
+    tree._cosTheta = None
+    tree._lock = __import__("threading").Lock()
+    return tree
+
+
+@unittest.skipIf(numpy is None, "numpy not available")
+class PfoAnalysisTreeTest(unittest.TestCase):
+    def setUp(self):
+        # events 0-1 : barrel, 2-3 : endcap, 4 : shared between barrel and endcap, 5 : leaking in the hcal
+        barrel = [10., 10.2, 0., 0., 5., 10.]
+        endcap = [0., 0., 9.6, 10.4, 5., 0.]
+        other = [0., 0., 0., 0., 0., 0.]
+        ecal = [b + e for b, e in zip(barrel, endcap)]
+        self.tree = createTree({
+            "mcPfoPx" : ([1., 1., 0., 0., 1., 1.], [1]*6), "mcPfoPy" : ([0.]*6, [1]*6), "mcPfoPz" : ([0.1, 0.1, 1., 1., 0.5, 0.1], [1]*6),
+            "ECalTotalCaloHitEnergy" : ecal, "HCalTotalCaloHitEnergy" : [0., 0., 0., 0., 0., 5.], "MuonTotalCaloHitEnergy" : [0.]*6,
+            "ECalBarrelCaloHitEnergy" : barrel, "ECalEndCapCaloHitEnergy" : endcap, "ECalOtherCaloHitEnergy" : other})
+
+    def testWholeCalorimeter(self):
+        result = self.tree.ecalContainedEvents(0., 1.)
+        self.assertEqual(result.nEvents, 6)
+        # event 5 leaks in the hcal
+        self.assertEqual(result.nSelectedEvents, 5)
+
+    def testRegions(self):
+        barrel = self.tree.ecalContainedEvents(0., 1., "Barrel")
+        endcap = self.tree.ecalContainedEvents(0., 1., "EndCap")
+        # the event shared between barrel and endcap is not contained in either region
+        self.assertEqual(barrel.nSelectedEvents, 2)
+        self.assertEqual(endcap.nSelectedEvents, 2)
+        self.assertNotAlmostEqual(barrel.mean, endcap.mean)
+        self.assertRaises(ValueError, self.tree.ecalContainedEvents, 0., 1., "Ring")
+
+    def testTrueEnergyRange(self):
+        result = self.tree.ecalContainedEvents(0., 1., "EndCap", trueEnergy=5.2)
+        self.assertEqual(result.nSelectedEvents, 2)
+        result = self.tree.ecalContainedEvents(0., 1., "EndCap", trueEnergy=5.)
+        self.assertEqual(result.nSelectedEvents, 1)
+
+
+@unittest.skipIf(numpy is None, "numpy not available")
+class NativeCalibratorTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = createTree({
+            "mcPfoPx" : ([1., 1., 0., 0.], [1]*4), "mcPfoPy" : ([0.]*4, [1]*4), "mcPfoPz" : ([0.1, 0.1, 1., 1.], [1]*4),
+            "ECalTotalCaloHitEnergy" : [10., 10.2, 9.6, 10.4], "HCalTotalCaloHitEnergy" : [0.]*4, "MuonTotalCaloHitEnergy" : [0.]*4,
+            "ECalBarrelCaloHitEnergy" : [10., 10.2, 0., 0.], "ECalEndCapCaloHitEnergy" : [0., 0., 9.6, 10.4], "ECalOtherCaloHitEnergy" : [0.]*4})
+        # the tree is built in memory, no root file to open
+        self._open = PfoAnalysisTree.__dict__["open"]
+        PfoAnalysisTree.open = classmethod(lambda cls, rootFile: self.tree)
+
+    def tearDown(self):
+        PfoAnalysisTree.open = self._open
+        PandoraAnalysisBinary.useNativeEngine = False
+        PandoraAnalysisBinary.nativeRegions = False
+        PandoraAnalysisBinary.validateNativeEngine = False
+
+    def createCalibrator(self, region):
+        calibrator = EcalCalibrator()
+        calibrator.setRootFile("PfoAnalysis.root")
+        calibrator.setDetectorRegion(region)
+        return calibrator
+
+    def testRegionGate(self):
+        PandoraAnalysisBinary.useNativeEngine = True
+        calibrator = EcalCalibrator()
+        self.assertTrue(calibrator._useNativeEngine())
+        calibrator.setDetectorRegion("Barrel")
+        self.assertFalse(calibrator._useNativeEngine())
+        PandoraAnalysisBinary.nativeRegions = True
+        self.assertTrue(calibrator._useNativeEngine())
+        # the validation runs the binaries
+        PandoraAnalysisBinary.validateNativeEngine = True
+        self.assertFalse(calibrator._useNativeEngine())
+
+    def testNativeRegions(self):
+        PandoraAnalysisBinary.useNativeEngine = True
+        PandoraAnalysisBinary.nativeRegions = True
+        barrel = self.createCalibrator("Barrel")
+        barrel.run()
+        endcap = self.createCalibrator("EndCap")
+        endcap.run()
+        self.assertEqual(barrel.getResult().nSelectedEvents, 2)
+        self.assertEqual(endcap.getResult().nSelectedEvents, 2)
+        self.assertAlmostEqual(barrel.getEcalDigiMean(), 10.1)
+        self.assertAlmostEqual(endcap.getEcalDigiMean(), 10.)
+
+    def testValidation(self):
+        PandoraAnalysisBinary.validateNativeEngine = True
+        calibrator = self.createCalibrator("Barrel")
+        # the binary output, as read from its calibration file
+        calibrator._ecalDigiMean = 10.1
+        self.assertEqual(calibrator._validateNativeEngine(), [])
+        self.assertEqual(calibrator.getEcalDigiMean(), 10.1)
+
+        calibrator._ecalDigiMean = 11.
+        differences = calibrator._validateNativeEngine()
+        self.assertEqual([name for name, binaryValue, nativeValue in differences], ["_ecalDigiMean"])
+        self.assertAlmostEqual(differences[0][2], 10.1)
+        # the binary output is kept
+        self.assertEqual(calibrator.getEcalDigiMean(), 11.)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+
+#
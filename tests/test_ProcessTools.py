@@ -0,0 +1,47 @@
+#
+
+""" Tests of the child watcher
+"""
+
+import os
+import time
+import signal
+import threading
+import unittest
+from calibration.ProcessTools import ChildWatcher, runProcess
+
+
+class ChildWatcherTest(unittest.TestCase):
+    def testWaitOrder(self):
+        watcher = ChildWatcher()
+        watcher.start(["sleep", "0.4"], "slow")
+        watcher.start(["sh", "-c", "exit 3"], "fast")
+        self.assertEqual(watcher.nRunning(), 2)
+        key, status, wallTime, rusage = watcher.wait()
+        self.assertEqual((key, status), ("fast", 3))
+        key, status, wallTime, rusage = watcher.wait()
+        self.assertEqual((key, status), ("slow", 0))
+        self.assertTrue(wallTime >= 0.4)
+        self.assertEqual(watcher.nRunning(), 0)
+
+    def testRunProcess(self):
+        self.assertEqual(runProcess(["sh", "-c", "exit 2"]).status, 2)
+
+    def testWaitInterruptible(self):
+        watcher = ChildWatcher()
+        process = watcher.start(["sleep", "30"], "sleep")
+        timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGINT))
+        timer.start()
+        startTime = time.time()
+        try:
+            self.assertRaises(KeyboardInterrupt, watcher.wait)
+        finally:
+            timer.cancel()
+            watcher.terminateAll()
+        self.assertTrue(time.time() - startTime < 10.)
+        key, status, wallTime, rusage = watcher.wait()
+        self.assertEqual(status, -signal.SIGTERM)
+
+
+
+#
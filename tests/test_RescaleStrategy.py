@@ -0,0 +1,92 @@
+#
+
+""" Tests of the rescale strategies on a synthetic calorimeter response (no marlin run needed)
+"""
+
+import unittest
+from calibration.RescaleStrategy import RescaleStrategy, SecantRescale, AitkenRescale, DampedNewtonRescale, createRescaleStrategy, rescaleStrategies
+
+
+""" Non linear energy response of a calorimeter to the scale of its calibration constants
+"""
+def response(scale):
+    return 8. * scale**0.9
+
+
+class RescaleStrategyTest(unittest.TestCase):
+    trueEnergy = 10.
+    accuracy = 1e-4
+
+    """ Run the iteration loop of the calibration steps. Returns the number of iterations and the final scale
+    """
+    def iterate(self, strategy, maxNIterations=20):
+        scale = 1.
+        for iteration in range(maxNIterations):
+            measured = response(scale)
+            rescaleFactor = strategy.rescaleFactor(scale, measured)
+            if abs(1 - measured / self.trueEnergy) < self.accuracy:
+                return iteration + 1, scale
+            scale = scale * rescaleFactor
+        self.fail("{0}: accuracy not reached after {1} iterations".format(strategy.name(), maxNIterations))
+
+    def testConvergence(self):
+        nIterations = {}
+        for name in rescaleStrategies:
+            strategy = createRescaleStrategy(name, self.trueEnergy)
+            nIterations[name], scale = self.iterate(strategy)
+            self.assertAlmostEqual(response(scale), self.trueEnergy, delta=self.accuracy*self.trueEnergy)
+            self.assertEqual(len(strategy.history()), nIterations[name])
+
+        # the extrapolations don't need more iterations than the fixed point.
+        # The damped newton trades speed for robustness (linear convergence)
+        for name in ["secant", "aitken"]:
+            self.assertLessEqual(nIterations[name], nIterations["fixedPoint"])
+
+    def testUnknownStrategy(self):
+        self.assertRaises(KeyError, createRescaleStrategy, "bisection", self.trueEnergy)
+
+    """ Check that the strategy falls back on the fixed point update after the given history
+    """
+    def checkFallback(self, strategy, history):
+        strategy.setHistory(history[:-1])
+        scale, measured = history[-1]
+        self.assertAlmostEqual(strategy.rescaleFactor(scale, measured), self.trueEnergy / measured)
+
+    def testNegativeProposal(self):
+        # secant : 2 + (10 - 4.9) / (-0.1) < 0
+        self.checkFallback(SecantRescale(self.trueEnergy), [(1., 5.), (2., 4.9)])
+
+    def testLargeProposal(self):
+        # secant : 2 + (10 - 5.1) / 0.1 > 2*2
+        self.checkFallback(SecantRescale(self.trueEnergy), [(1., 5.), (2., 5.1)])
+        # newton : flat response, 2 + 0.8 * (10 - 5.1) / 0.1 > 2*2
+        self.checkFallback(DampedNewtonRescale(self.trueEnergy), [(1., 5.), (2., 5.1)])
+
+    def testSmallProposal(self):
+        # secant : 2 + (10 - 12) / 1.5 < 2/2
+        self.checkFallback(SecantRescale(self.trueEnergy), [(1., 10.5), (2., 12.)])
+        # aitken : 5 - (5 - 2)**2 / (5 - 4 + 1) < 2/2
+        self.checkFallback(AitkenRescale(self.trueEnergy), [(1., 5.), (2., 4.)])
+
+    def testDegenerateHistory(self):
+        # secant : same energy measured twice
+        self.checkFallback(SecantRescale(self.trueEnergy), [(1., 5.), (2., 5.)])
+        # aitken : x2 - 2*x1 + x0 = 0
+        self.checkFallback(AitkenRescale(self.trueEnergy), [(1., 5.), (2., 20./3.)])
+        # newton : same scale twice
+        self.checkFallback(DampedNewtonRescale(self.trueEnergy), [(2., 5.), (2., 6.)])
+
+    def testHistory(self):
+        strategy = RescaleStrategy(self.trueEnergy)
+        strategy.rescaleFactor(1., 8.)
+        strategy.rescaleFactor(1.25, 9.6)
+        resumed = SecantRescale(self.trueEnergy)
+        resumed.setHistory(strategy.history())
+        self.assertEqual(resumed.history(), [(1., 8.), (1.25, 9.6)])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+#
@@ -0,0 +1,91 @@
+#
+
+""" Tests of the surrogate iterations on in-memory reconstructions (no marlin run needed)
+"""
+
+import unittest
+from calibration.PfoAnalysisEngine import PfoAnalysisTree, numpy
+from calibration.RescaleSurrogate import EnergyRescaleSurrogate, SurrogateIterations
+from tests.test_PfoAnalysisEngine import createTree
+
+
+""" Build the reconstruction of a linear calorimeter, the region energies scaled by the given factors.
+    Events 0-3 : barrel, 4-7 : endcap, 8 : shared between barrel and endcap, 9 : leaking in the hcal
+"""
+def createReconstruction(barrelScale=1., endcapScale=1.):
+    barrel = [barrelScale*energy for energy in [8., 8.2, 7.8, 8.1, 0., 0., 0., 0., 0.4, 8.]]
+    endcap = [endcapScale*energy for energy in [0., 0., 0., 0., 12., 12.3, 11.8, 12.1, 11.6, 0.]]
+    return createTree({
+        "mcPfoPx" : ([1.]*4 + [0.]*4 + [0.1, 1.], [1]*10), "mcPfoPy" : ([0.]*10, [1]*10), "mcPfoPz" : ([0.1]*4 + [1.]*4 + [1., 0.1], [1]*10),
+        "ECalTotalCaloHitEnergy" : [b + e for b, e in zip(barrel, endcap)], "HCalTotalCaloHitEnergy" : [0.]*9 + [6.], "MuonTotalCaloHitEnergy" : [0.]*10,
+        "ECalBarrelCaloHitEnergy" : barrel, "ECalEndCapCaloHitEnergy" : endcap, "ECalOtherCaloHitEnergy" : [0.]*10})
+
+
+@unittest.skipIf(numpy is None, "numpy not available")
+class RescaleSurrogateTest(unittest.TestCase):
+    windows = {"Barrel" : (0., 0.5), "EndCap" : (0.5, 1.)}
+    trueEnergy = 10.
+    accuracy = 0.01
+
+    def setUp(self):
+        # the trees are built in memory, no root file to open
+        self.trees = {"iter0.root" : createReconstruction()}
+        self._open = PfoAnalysisTree.__dict__["open"]
+        PfoAnalysisTree.open = classmethod(lambda cls, rootFile: self.trees[rootFile])
+
+    def tearDown(self):
+        PfoAnalysisTree.open = self._open
+
+    """ The energies measured by the region calibrators on a reconstruction
+    """
+    def measure(self, rootFile):
+        tree = self.trees[rootFile]
+        return dict([(region, tree.ecalContainedEvents(minCos, maxCos, region, self.trueEnergy).mean) for region, (minCos, maxCos) in self.windows.items()])
+
+    def testSelection(self):
+        surrogate = EnergyRescaleSurrogate("iter0.root", "ECal", self.windows.keys())
+        measured = self.measure("iter0.root")
+
+        for region, (minCos, maxCos) in self.windows.items():
+            self.assertAlmostEqual(surrogate.containedMean({}, region, minCos, maxCos, self.trueEnergy), measured[region])
+
+    def testIterations(self):
+        iterations = SurrogateIterations("ECal", self.trueEnergy, self.accuracy, self.windows)
+        scales = iterations.rescaleFactors("iter0.root", self.measure("iter0.root"))
+        self.assertEqual(sorted(scales.keys()), ["Barrel", "EndCap"])
+
+        # the next reconstruction confirms the prediction : both regions are calibrated
+        self.trees["iter1.root"] = createReconstruction(scales["Barrel"], scales["EndCap"])
+        measured = self.measure("iter1.root")
+
+        for energy in measured.values():
+            self.assertLess(abs(1 - energy / self.trueEnergy), self.accuracy)
+
+        self.assertEqual(iterations.rescaleFactors("iter1.root", measured), {})
+        self.assertTrue(iterations.active())
+
+    def testSwitchOff(self):
+        iterations = SurrogateIterations("ECal", self.trueEnergy, self.accuracy, self.windows)
+        scales = iterations.rescaleFactors("iter0.root", self.measure("iter0.root"))
+
+        # the next reconstruction is not linear in the factors
+        self.trees["iter1.root"] = createReconstruction(1.1*scales["Barrel"], scales["EndCap"])
+        self.assertEqual(iterations.rescaleFactors("iter1.root", self.measure("iter1.root")), {})
+        self.assertFalse(iterations.active())
+
+        # resuming keeps the surrogate switched off
+        resumed = SurrogateIterations("ECal", self.trueEnergy, self.accuracy, self.windows)
+        resumed.setState(iterations.state())
+        self.assertFalse(resumed.active())
+        self.assertEqual(resumed.rescaleFactors("iter0.root", self.measure("iter0.root")), {})
+
+    def testDisabled(self):
+        iterations = SurrogateIterations("ECal", self.trueEnergy, self.accuracy, self.windows, enabled=False)
+        self.assertEqual(iterations.rescaleFactors("iter0.root", self.measure("iter0.root")), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+#
@@ -0,0 +1,50 @@
+#
+
+""" Tests of the step configuration of the calibration scripts
+"""
+
+import os
+import sys
+import runpy
+import unittest
+from calibration.CalibrationManager import CalibrationManager
+
+scriptsDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+
+
+""" Run a calibration script up to CalibrationManager.run and return the registered steps
+"""
+def getScriptSteps(script):
+    steps = []
+    run, argv = CalibrationManager.run, sys.argv
+    CalibrationManager.run = lambda manager: steps.extend(manager._steps)
+    sys.argv = [script]
+    try:
+        runpy.run_path(os.path.join(scriptsDirectory, script), run_name="__main__")
+    finally:
+        CalibrationManager.run, sys.argv = run, argv
+    return steps
+
+
+class RunScriptsTest(unittest.TestCase):
+    """ Each step loads the outputs of all the previous steps : the constants used by
+        the reconstruction of a step are the same as in a sequential run
+    """
+    def checkCumulativeDependencies(self, script, expectedNames):
+        steps = getScriptSteps(script)
+        names = [step.name() for step in steps]
+        self.assertEqual(names, expectedNames)
+        for index, step in enumerate(steps):
+            self.assertEqual(step.dependencies(), names[:index], "{0} {1}".format(script, step.name()))
+
+    def testILD(self):
+        self.checkCumulativeDependencies("run-ild-calibration.py",
+            ["MipScale", "EcalEnergy", "HcalEnergy", "PandoraMipScale", "PandoraEMScale", "PandoraHadScale", "PandoraSoftComp"])
+
+    def testSiD(self):
+        self.checkCumulativeDependencies("run-sid-calibration.py",
+            ["MipScale", "EcalEnergy", "HcalEnergy", "PandoraMipScale", "PandoraEMScale", "PandoraHadScale"])
+
+
+
+#
@@ -0,0 +1,91 @@
+#
+
+""" Tests of the lazy step registry
+"""
+
+import os
+import sys
+import json
+import subprocess
+import unittest
+from calibration.StepRegistry import StepRegistry
+
+packageDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run a script and print the loaded modules, once the manager exits
+introspectionCode = """
+import sys, json, runpy
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted([name for name, module in sys.modules.items() if module is not None])))
+"""
+
+""" The script output and the modules loaded after running a calibration script with the given arguments
+"""
+def getLoadedModules(script, args):
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = packageDirectory + os.pathsep + environment.get("PYTHONPATH", "")
+    process = subprocess.Popen([sys.executable, "-c", introspectionCode, os.path.join(packageDirectory, "scripts", script)] + args,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+    output, error = process.communicate()
+    return output.decode(), set(json.loads(error.decode().splitlines()[-1]))
+
+
+class StepRegistryTest(unittest.TestCase):
+    heavyModules = ["numpy", "calibration.Marlin", "calibration.MarlinCache", "calibration.PandoraAnalysis", "calibration.PfoAnalysisEngine"]
+
+    def checkNoStepModule(self, modules):
+        for className in StepRegistry.stepClasses():
+            self.assertNotIn(StepRegistry.declaration(className).module, modules)
+        for module in self.heavyModules:
+            self.assertNotIn(module, modules)
+
+    def testShowSteps(self):
+        output, modules = getLoadedModules("run-ild-calibration.py", ["--showSteps"])
+        self.assertIn("6) PandoraSoftComp", output)
+        self.assertIn("calibration.StepRegistry", modules)
+        self.checkNoStepModule(modules)
+        # the runtime modules of the manager are not needed either
+        for module in ["calibration.AdmissionControl", "calibration.Executors", "calibration.GeometryInterface", "calibration.GearCache"]:
+            self.assertNotIn(module, modules)
+
+    def testDryRun(self):
+        output, modules = getLoadedModules("run-ild-calibration.py", ["--dryRun", "--inputCalibrationFile", "calibration.xml",
+            "--compactFile", "compact.xml", "--steeringFile", "steering.xml", "--lcioMuonFile", "muons.slcio",
+            "--lcioPhotonFile", "photons.slcio", "--lcioKaon0LFile", "kaons.slcio", "--energies", "10", "20",
+            "--lcioFilePattern", "File_%{energy}GeV.slcio", "--rootFilePattern", "SoftComp_%{energy}GeV.root",
+            "--ecalCalibrationAccuracy", "0.01", "--hcalCalibrationAccuracy", "0.01"])
+        self.assertIn("Registered steps (7)", output)
+        self.assertIn("calibration.StepRegistry", modules)
+        self.checkNoStepModule(modules)
+
+    def testMetadata(self):
+        for className in StepRegistry.stepClasses():
+            lazyStep = StepRegistry.create(className)
+            metadata = StepRegistry.declaration(className).metadata
+            self.assertEqual(lazyStep.name(), metadata.name)
+            self.assertEqual(lazyStep.requiredArgs(), set(metadata.requiredArgs))
+
+            # same metadata once the step is created
+            step = lazyStep.step()
+            self.assertTrue(StepRegistry.stepClass(className).metadata is metadata)
+            self.assertEqual(step.name(), lazyStep.name())
+            self.assertEqual(step.description(), lazyStep.description())
+            self.assertEqual(step.requiredArgs(), lazyStep.requiredArgs())
+
+    def testUnknownStep(self):
+        self.assertRaises(KeyError, StepRegistry.create, "UnknownStep")
+
+    def testRecordedCalls(self):
+        lazyStep = StepRegistry.create("PandoraMipScaleStep")
+        lazyStep.setLoadStepOutputs(["MipScale"])
+        self.assertEqual(lazyStep.dependencies(), ["MipScale"])
+        self.assertFalse(lazyStep.created())
+        self.assertEqual(lazyStep.step().dependencies(), ["MipScale"])
+
+
+
+#
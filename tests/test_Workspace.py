@@ -0,0 +1,50 @@
+#
+
+""" Tests of the run directories retention
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from calibration.Workspace import Workspace
+
+
+class WorkspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.rootDirectory = tempfile.mkdtemp(prefix="test_workspace_")
+
+    def tearDown(self):
+        shutil.rmtree(self.rootDirectory, ignore_errors=True)
+
+    def testRunningRunsAreNotPruned(self):
+        running = Workspace(self.rootDirectory)
+        completed = []
+        for run in range(3):
+            workspace = Workspace(self.rootDirectory, maxNRuns=2)
+            workspace.finalize(True)
+            completed.append(workspace.runDirectory())
+            time.sleep(0.01)
+
+        # the two most recent completed runs are kept, the running one too
+        self.assertTrue(os.path.isdir(running.runDirectory()))
+        self.assertFalse(os.path.isdir(completed[0]))
+        self.assertTrue(os.path.isdir(completed[1]))
+        self.assertTrue(os.path.isdir(completed[2]))
+
+    def testRemovedRunIsNotCounted(self):
+        kept = Workspace(self.rootDirectory)
+        kept.finalize(True)
+        workspace = Workspace(self.rootDirectory, retention=Workspace.keepNone, maxNRuns=1)
+        workspace.finalize(True)
+        self.assertFalse(os.path.isdir(workspace.runDirectory()))
+        self.assertTrue(os.path.isdir(kept.runDirectory()))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+
+#